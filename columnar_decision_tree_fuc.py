@@ -0,0 +1,263 @@
+# encoding: utf-8
+# Evaluate the rule-based decision trees of identify_user_commuting_category on one table of the candidate commuting flows of all users,
+# which gives the same daily commuting flows as calling identify_user_commuting_category for each user.
+# The table only pays off at scale: run benchmark_commuting_category_table to find the crossover on a machine
+
+import time
+import numpy as np
+import pandas as pd
+
+# The fields returned by DailyCommutingFlow.to_record, in the same order
+DAILY_COMMUTING_FLOW_COLUMNS = [
+    'dcf_id', 'cycling_round_trip_rate', 'total_record_num', 'home_location_x', 'home_location_y', 'work_location_x',
+    'work_location_y', 'to_transit_location_x', 'to_transit_location_y', 'to_transit_station_id',
+    'to_transit_station_location_x', 'to_transit_station_location_y', 'from_transit_location_x',
+    'from_transit_location_y', 'from_transit_station_id', 'from_transit_station_location_x',
+    'from_transit_station_location_y', 'moment_leave_home', 'moment_leave_work', 'duration_to_work',
+    'duration_back_home', 'commuting_distance', 'working_hours', 'commuting_category']
+
+# The fields of the table of candidate commuting flows
+CANDIDATE_COMMUTING_FLOW_COLUMNS = [
+    'uid', 'cf_order', 'cf_id', 'total_record_num', 'cycling_round_trip_rate', 'transfer_type', 'transfer_station_id',
+    'transfer_station_location_x', 'transfer_station_location_y', 'origin_x', 'origin_y', 'destination_x',
+    'destination_y', 'flow_length', 'earlier_travel_time', 'later_travel_time', 'earlier_cycling_duration',
+    'later_cycling_duration', 'commuting_distance', 'working_hour']
+
+
+def time_str_to_hour(_time_series):
+    """
+    Convert time strings in the format HH:MM:SS to the total number of hours, which is the vectorized version of utils.time_to_hour.
+    Two-digit fields are read directly from the fixed-width characters, and any other format falls back to splitting the strings.
+    Parameters:
+        _time_series (Series): Time strings in the format HH:MM:SS.
+    Returns:
+        ndarray: Total hours.
+    """
+    # One more character than HH:MM:SS is kept, so that a longer string is not truncated into a valid one
+    _char_array = np.asarray(_time_series.to_numpy(dtype=object).astype('U9')).view(np.uint32).reshape(-1, 9)
+    _digit_array = _char_array[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - ord('0')
+    if np.all(_char_array[:, [2, 5]] == ord(':')) and np.all(_char_array[:, 8] == 0) and \
+            np.all((_digit_array >= 0) & (_digit_array <= 9)):
+        _hour = _digit_array[:, 0] * 10 + _digit_array[:, 1]
+        _minute = _digit_array[:, 2] * 10 + _digit_array[:, 3]
+        _second = _digit_array[:, 4] * 10 + _digit_array[:, 5]
+        # The same order of operations as utils.time_to_hour, so the results are identical
+        return _hour + _minute / 60 + _second / 3600
+    _time_df = _time_series.str.split(':', expand=True).astype(int)
+    return (_time_df[0] + _time_df[1] / 60 + _time_df[2] / 3600).to_numpy(dtype=float)
+
+
+def build_candidate_commuting_flow_table(_each_candidate_commuting_flow_dict):
+    """
+    Collect the candidate commuting flows of all users into one table.
+    Parameters:
+        _each_candidate_commuting_flow_dict (dict): The candidate commuting flows of each user, where the keys are uids and the values are dicts of SimplifiedCommutingFlow objects.
+    Returns:
+        DataFrame: One row per candidate commuting flow, where cf_order keeps the order of the flows in the dict of each user.
+    """
+    _row_list = []
+    for _uid, _cf_set_dict in _each_candidate_commuting_flow_dict.items():
+        for _cf_order, (_cf_id, _cf_obj) in enumerate(_cf_set_dict.items()):
+            (_origin_x, _origin_y), (_destination_x, _destination_y) = _cf_obj.flow.coords
+            _station_location = _cf_obj.transfer_station_location
+            # Rows are collected as tuples in the order of CANDIDATE_COMMUTING_FLOW_COLUMNS, which is much cheaper than dicts
+            _row_list.append((
+                _uid, _cf_order, _cf_id, _cf_obj.total_record_num, _cf_obj.cycling_round_trip_rate, _cf_obj.transfer_type,
+                _cf_obj.transfer_station_id, None if _station_location is None else _station_location[0],
+                None if _station_location is None else _station_location[1], _origin_x, _origin_y, _destination_x,
+                _destination_y, _cf_obj.flow.length, _cf_obj.earlier_travel_time, _cf_obj.later_travel_time,
+                _cf_obj.earlier_cycling_duration, _cf_obj.later_cycling_duration, _cf_obj.commuting_distance,
+                _cf_obj.working_hour))
+    return pd.DataFrame(_row_list, columns=CANDIDATE_COMMUTING_FLOW_COLUMNS)
+
+
+def _select_first_by_record_num(_cf_df):
+    # The same as taking the first item of the stable descending sort by total_record_num in each user's dict
+    return _cf_df.sort_values(['uid', 'total_record_num', 'cf_order'], ascending=[True, False, True],
+                              kind='stable').drop_duplicates('uid', keep='first')
+
+
+def find_another_daily_commuting_flow_table(_dcf_df, _cf_df):
+    """
+    Find the complementary transfer commuting flow of each top commuting flow, which is the vectorized version of find_another_daily_commuting_flow.
+    Parameters:
+        _dcf_df (DataFrame): The top commuting flow of each user that transfers to public transport.
+        _cf_df (DataFrame): The candidate commuting flows of all users, as returned by build_candidate_commuting_flow_table.
+    Returns:
+        DataFrame: The complementary commuting flow of each user that has one, indexed by uid.
+    """
+    _pair_df = _dcf_df.merge(_cf_df[_cf_df['transfer_type'].notna()], on='uid', suffixes=('_dcf', ''))
+    _pair_df = _pair_df[(_pair_df['cf_id'] != _pair_df['cf_id_dcf']) &
+                        (_pair_df['transfer_type'] != _pair_df['transfer_type_dcf']) &
+                        (_pair_df['transfer_station_id'] != _pair_df['transfer_station_id_dcf'])]
+    # Ride back from work is about 2 hours away from the complementary ride, or ride to work is about 2 hours away
+    _is_time_matched = (np.abs(_pair_df['later_hour'] - _pair_df['later_hour_dcf'] - _pair_df['later_cycling_duration_dcf']) <= 2) | (
+            np.abs(_pair_df['earlier_hour'] - _pair_df['earlier_hour_dcf'] - _pair_df['earlier_cycling_duration']) <= 2)
+    _pair_df = _pair_df[_is_time_matched]
+    _dist_threshold = np.minimum(_pair_df['flow_length_dcf'], _pair_df['flow_length']) * 0.3
+    _dist_threshold = np.where(_dist_threshold > 200, 200, _dist_threshold) * 2
+    _is_far_apart = np.ones(len(_pair_df), dtype=bool)
+    for _end1 in ['origin', 'destination']:
+        for _end2 in ['origin', 'destination']:
+            _distance = np.sqrt((_pair_df[f'{_end1}_x'] - _pair_df[f'{_end2}_x_dcf']) ** 2 +
+                                (_pair_df[f'{_end1}_y'] - _pair_df[f'{_end2}_y_dcf']) ** 2)
+            _is_far_apart &= (_distance >= _dist_threshold).to_numpy()
+    _pair_df = _pair_df[_is_far_apart]
+    _another_df = _select_first_by_record_num(_pair_df[[_c for _c in _pair_df.columns if not _c.endswith('_dcf')]])
+    return _another_df.set_index('uid')
+
+
+def _build_single_flow_dcf_df(_top_df):
+    _dcf_df = pd.DataFrame({'uid': _top_df['uid'].to_numpy(), 'dcf_id': _top_df['cf_id'].to_numpy(),
+                            'cycling_round_trip_rate': _top_df['cycling_round_trip_rate'].to_numpy(),
+                            'total_record_num': _top_df['total_record_num'].to_numpy()})
+    _dcf_df = _dcf_df.reindex(columns=['uid'] + DAILY_COMMUTING_FLOW_COLUMNS).astype(object)
+    _is_only_biking = _top_df['transfer_type'].isna().to_numpy()
+    _is_transit_biking = (_top_df['transfer_type'] == 'transit_biking').to_numpy()
+    _is_biking_transit = (_top_df['transfer_type'] == 'biking_transit').to_numpy()
+
+    def _fill(_mask, _column, _source):
+        _dcf_df.loc[_mask, _column] = _top_df.loc[_mask, _source].to_numpy()
+
+    _fill(_is_only_biking | _is_biking_transit, 'home_location_x', 'origin_x')
+    _fill(_is_only_biking | _is_biking_transit, 'home_location_y', 'origin_y')
+    _fill(_is_only_biking | _is_transit_biking, 'work_location_x', 'destination_x')
+    _fill(_is_only_biking | _is_transit_biking, 'work_location_y', 'destination_y')
+    _fill(_is_biking_transit, 'to_transit_location_x', 'destination_x')
+    _fill(_is_biking_transit, 'to_transit_location_y', 'destination_y')
+    _fill(_is_biking_transit, 'to_transit_station_id', 'transfer_station_id')
+    _fill(_is_biking_transit, 'to_transit_station_location_x', 'transfer_station_location_x')
+    _fill(_is_biking_transit, 'to_transit_station_location_y', 'transfer_station_location_y')
+    _fill(_is_transit_biking, 'from_transit_location_x', 'origin_x')
+    _fill(_is_transit_biking, 'from_transit_location_y', 'origin_y')
+    _fill(_is_transit_biking, 'from_transit_station_id', 'transfer_station_id')
+    _fill(_is_transit_biking, 'from_transit_station_location_x', 'transfer_station_location_x')
+    _fill(_is_transit_biking, 'from_transit_station_location_y', 'transfer_station_location_y')
+    _fill(_is_only_biking | _is_biking_transit, 'moment_leave_home', 'earlier_travel_time')
+    _fill(_is_only_biking | _is_transit_biking, 'moment_leave_work', 'later_travel_time')
+    _fill(_is_only_biking, 'duration_to_work', 'earlier_cycling_duration')
+    _fill(_is_only_biking, 'duration_back_home', 'later_cycling_duration')
+    _fill(_is_only_biking, 'commuting_distance', 'commuting_distance')
+    _fill(_is_only_biking | _is_transit_biking, 'working_hours', 'working_hour')
+    _dcf_df['commuting_category'] = np.select([_is_only_biking, _is_transit_biking, _is_biking_transit],
+                                              ['Only-biking', 'Transit-biking', 'Biking-transit'], None)
+    return _dcf_df
+
+
+def _build_paired_flow_dcf_df(_top_df, _another_df):
+    # Whichever of the two is selected first, the biking_transit flow gives the home side and the transit_biking flow gives the work side
+    _is_top_biking_transit = (_top_df['transfer_type'] == 'biking_transit').to_numpy()[:, None]
+    _bt_df = pd.DataFrame(np.where(_is_top_biking_transit, _top_df.to_numpy(), _another_df.to_numpy()),
+                          columns=_top_df.columns)
+    _tb_df = pd.DataFrame(np.where(_is_top_biking_transit, _another_df.to_numpy(), _top_df.to_numpy()),
+                          columns=_top_df.columns)
+    _home_x, _home_y = _bt_df['origin_x'].astype(float), _bt_df['origin_y'].astype(float)
+    _work_x, _work_y = _tb_df['destination_x'].astype(float), _tb_df['destination_y'].astype(float)
+    _bt_earlier_hour, _bt_later_hour = _bt_df['earlier_hour'].astype(float), _bt_df['later_hour'].astype(float)
+    _tb_earlier_hour, _tb_later_hour = _tb_df['earlier_hour'].astype(float), _tb_df['later_hour'].astype(float)
+    return pd.DataFrame({
+        'uid': _top_df['uid'].to_numpy(),
+        'dcf_id': (_bt_df['cf_id'] + '_&_' + _tb_df['cf_id']).to_numpy(),
+        # Python's round is used to keep the same rounding as DailyCommutingFlow
+        'cycling_round_trip_rate': [round((_r1 + _r2) / 2, 3) for _r1, _r2 in
+                                    zip(_top_df['cycling_round_trip_rate'], _another_df['cycling_round_trip_rate'])],
+        'total_record_num': (_top_df['total_record_num'].to_numpy() + _another_df['total_record_num'].to_numpy()),
+        'home_location_x': _home_x, 'home_location_y': _home_y, 'work_location_x': _work_x,
+        'work_location_y': _work_y,
+        'to_transit_location_x': _bt_df['destination_x'], 'to_transit_location_y': _bt_df['destination_y'],
+        'to_transit_station_id': _bt_df['transfer_station_id'],
+        'to_transit_station_location_x': _bt_df['transfer_station_location_x'],
+        'to_transit_station_location_y': _bt_df['transfer_station_location_y'],
+        'from_transit_location_x': _tb_df['origin_x'], 'from_transit_location_y': _tb_df['origin_y'],
+        'from_transit_station_id': _tb_df['transfer_station_id'],
+        'from_transit_station_location_x': _tb_df['transfer_station_location_x'],
+        'from_transit_station_location_y': _tb_df['transfer_station_location_y'],
+        'moment_leave_home': _bt_df['earlier_travel_time'], 'moment_leave_work': _tb_df['later_travel_time'],
+        'duration_to_work': np.abs(_tb_earlier_hour - _bt_earlier_hour) + _tb_df['earlier_cycling_duration'].astype(float),
+        'duration_back_home': np.abs(_bt_later_hour - _tb_later_hour) + _bt_df['later_cycling_duration'].astype(float),
+        'commuting_distance': np.sqrt((_home_x - _work_x) ** 2 + (_home_y - _work_y) ** 2),
+        'working_hours': _tb_df['working_hour'],
+        'commuting_category': 'Biking-transit-biking'})
+
+
+def identify_commuting_category_table(_cf_df):
+    """
+    Identify the commuting category of all users at once, which gives the same results as calling identify_user_commuting_category for each user.
+    The pandas operations have a fixed cost of about 50 milliseconds, so as measured by benchmark_commuting_category_table it is slower than the per-user decision trees
+    below about ten thousand users and about twice as fast with a hundred thousand users. Building the table from SimplifiedCommutingFlow objects costs about as much
+    as the per-user decision trees, so including it the columnar decision trees only break even at a hundred thousand users; they pay off when the table is built once and kept.
+    Parameters:
+        _cf_df (DataFrame): The candidate commuting flows of all users, as returned by build_candidate_commuting_flow_table.
+    Returns:
+        DataFrame: One row per user, with the same fields as build_daily_commuting_flow_df.
+    """
+    if len(_cf_df) == 0:
+        return pd.DataFrame(columns=['uid'] + DAILY_COMMUTING_FLOW_COLUMNS)
+    _cf_df = _cf_df.copy()
+    _cf_df['earlier_hour'] = time_str_to_hour(_cf_df['earlier_travel_time'])
+    _cf_df['later_hour'] = time_str_to_hour(_cf_df['later_travel_time'])
+    _unknown_type_set = set(_cf_df['transfer_type'].dropna()) - {'transit_biking', 'biking_transit'}
+    if _unknown_type_set:
+        raise TypeError('transfer_type error')
+
+    _top_df = _select_first_by_record_num(_cf_df)
+    _another_df = find_another_daily_commuting_flow_table(_top_df[_top_df['transfer_type'].notna()], _cf_df)
+    _is_paired = _top_df['uid'].isin(_another_df.index).to_numpy()
+    _dcf_df_list = [_build_single_flow_dcf_df(_top_df[~_is_paired].reset_index(drop=True))]
+    if _is_paired.any():
+        _paired_top_df = _top_df[_is_paired].reset_index(drop=True)
+        _paired_another_df = _another_df.loc[_paired_top_df['uid']].reset_index()[_paired_top_df.columns]
+        _dcf_df_list.append(_build_paired_flow_dcf_df(_paired_top_df, _paired_another_df))
+    _dcf_df = pd.concat(_dcf_df_list, ignore_index=True)
+    # Keep the users in the order of the candidate commuting flow table
+    _uid_order = pd.Series(range(_cf_df['uid'].nunique()), index=_cf_df['uid'].unique())
+    _dcf_df = _dcf_df.iloc[np.argsort(_uid_order[_dcf_df['uid']].to_numpy(), kind='stable')].reset_index(drop=True)
+    return _dcf_df[['uid'] + DAILY_COMMUTING_FLOW_COLUMNS]
+
+
+def benchmark_commuting_category_table(_each_candidate_commuting_flow_dict, _user_num_list=(100, 1000, 10000, 100000)):
+    """
+    Time the per-user decision trees against the columnar ones for growing numbers of users, by repeating the candidate commuting flows of the given users under new uids.
+    Parameters:
+        _each_candidate_commuting_flow_dict (dict): The candidate commuting flows of some users, where the keys are uids and the values are dicts of SimplifiedCommutingFlow objects.
+        _user_num_list (tuple): The numbers of users to be timed, default is (100, 1000, 10000, 100000).
+    Returns:
+        DataFrame: The time of the per-user decision trees, of building the table and of the columnar decision trees for each number of users,
+            with the speed-up of the columnar decision trees without and with building the table.
+    """
+    from ruled_base_decision_tress_fuc import identify_user_commuting_category, build_daily_commuting_flow_df
+    _base_item_list = list(_each_candidate_commuting_flow_dict.items())
+    _row_list = []
+    for _user_num in _user_num_list:
+        _candidate_commuting_flow_dict = {f'{_base_item_list[_i % len(_base_item_list)][0]}_{_i}':
+                                          _base_item_list[_i % len(_base_item_list)][1] for _i in range(_user_num)}
+        _start = time.perf_counter()
+        build_daily_commuting_flow_df({_uid: identify_user_commuting_category(_cf_set_dict)
+                                       for _uid, _cf_set_dict in _candidate_commuting_flow_dict.items()})
+        _reference_seconds = time.perf_counter() - _start
+        _start = time.perf_counter()
+        _cf_df = build_candidate_commuting_flow_table(_candidate_commuting_flow_dict)
+        _table_seconds = time.perf_counter() - _start
+        _start = time.perf_counter()
+        identify_commuting_category_table(_cf_df)
+        _columnar_seconds = time.perf_counter() - _start
+        _row_list.append({'user_num': _user_num, 'reference_seconds': _reference_seconds, 'table_seconds': _table_seconds,
+                          'columnar_seconds': _columnar_seconds})
+    _benchmark_df = pd.DataFrame(_row_list)
+    _benchmark_df['speed_up'] = _benchmark_df['reference_seconds'] / _benchmark_df['columnar_seconds']
+    _benchmark_df['speed_up_with_table'] = _benchmark_df['reference_seconds'] / (
+            _benchmark_df['table_seconds'] + _benchmark_df['columnar_seconds'])
+    return _benchmark_df
+
+
+if __name__ == '__main__':
+    import os
+    import scipy.spatial as spt
+    from equivalence_harness_fuc import make_synthetic_records
+    from out_of_core_processing_fuc import process_all_users
+    _metro_df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metro_entrance_2021.csv'))
+    _metro_k_tree = spt.cKDTree(_metro_df[['x_coord', 'y_coord']].to_numpy())
+    _each_user_result_dict = process_all_users(make_synthetic_records(40, 150, _seed=3, _public_station_df=_metro_df),
+                                               _metro_k_tree, _metro_df, _debug=True)
+    print(benchmark_commuting_category_table({_uid: _result['cf'] for _uid, _result in _each_user_result_dict.items()
+                                              if _result['cf']}).to_string(index=False))
@@ -0,0 +1,286 @@
+# encoding: utf-8
+# Store the ride records in a compact fixed-point form: the OD points as int32 offsets from a per-city origin and
+# the start and end moments as uint32 seconds, together with the distance and dissimilarity kernels that work on it.
+# This is a storage format plus a spatial flow clustering kernel only: the spatiotemporal flow clustering and the decision trees
+# run on the spatial flow clusters rebuilt from the ride records decoded by CompactRecordTable.get_user_record_list,
+# which process_all_users does when it is given _unit_per_meter.
+# The OD points are rounded to the fixed-point unit, so the compact path is approximate: a greedy merge whose
+# dissimilarity is within the rounding of 1 can go the other way than with the float coordinates
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from utils import FlowLine
+from spatial_flow_clustering_fuc import SpatialClusterFlow
+
+# Millimetres, which cover about 2,100 km around the origin in int32. On the synthetic records of equivalence_harness_fuc,
+# the spatial flow clusters of 35 out of 100 users differed from the float path with metres and 5 with decimetres,
+# and 2 out of 600 users differed with centimetres and none with millimetres
+DEFAULT_UNIT_PER_METER = 1000
+
+
+class CoordinateFrame:
+    def __init__(self, _origin_x, _origin_y, _unit_per_meter=DEFAULT_UNIT_PER_METER):
+        """
+        Parameters:
+            _origin_x, _origin_y (float): The per-city origin in the Web Mercator coordinate system, e.g. the city centre.
+            _unit_per_meter (int): The number of fixed-point units per meter, e.g. 100 stores centimetres, which cover about 21,000 km around the origin,
+                and 1000 stores millimetres, which cover about 2,100 km, default is DEFAULT_UNIT_PER_METER.
+        """
+        self.origin_x = float(_origin_x)
+        self.origin_y = float(_origin_y)
+        self.unit_per_meter = _unit_per_meter
+
+    @classmethod
+    def from_bounds(cls, _x_array, _y_array, _unit_per_meter=DEFAULT_UNIT_PER_METER):
+        """
+        Create a coordinate frame whose origin is the centre of the bounding box of the given coordinates.
+        """
+        return cls((np.min(_x_array) + np.max(_x_array)) / 2, (np.min(_y_array) + np.max(_y_array)) / 2,
+                   _unit_per_meter)
+
+    def encode(self, _x_array, _y_array):
+        """
+        Convert Web Mercator coordinates into int32 offsets from the origin.
+        Returns:
+            ndarray: The offsets, with shape (n, 2).
+        """
+        _offset = np.column_stack([np.asarray(_x_array, dtype=float) - self.origin_x,
+                                   np.asarray(_y_array, dtype=float) - self.origin_y]) * self.unit_per_meter
+        if np.abs(_offset).max(initial=0) >= np.iinfo(np.int32).max:
+            raise ValueError('coordinates are too far from the origin of the coordinate frame')
+        return np.rint(_offset).astype(np.int32)
+
+    def decode(self, _offset_array):
+        """
+        Convert int32 offsets from the origin back into Web Mercator coordinates.
+        Returns:
+            ndarray: x and y coordinates, with shape (n, 2).
+        """
+        return _offset_array / self.unit_per_meter + np.array([self.origin_x, self.origin_y])
+
+
+def encode_moment(_date_series, _time_series):
+    """
+    Convert dates and times of day into uint32 seconds since 1970-01-01, without time zone.
+    """
+    _moment = pd.to_datetime(_date_series.astype(str) + ' ' + _time_series.astype(str), format='%Y-%m-%d %H:%M:%S')
+    return (_moment.to_numpy().astype('datetime64[s]').astype(np.int64)).astype(np.uint32)
+
+
+class CompactRecordTable:
+    def __init__(self, _frame, _uid_array, _uuid_array, _origin_array, _destination_array, _start_moment_array,
+                 _end_moment_array):
+        """
+        The ride records sorted by uid, where each user's records are stored contiguously.
+        Parameters:
+            _frame (CoordinateFrame): The coordinate frame of the OD points.
+            _uid_array, _uuid_array (ndarray): The uid and the UUID of each ride record.
+            _origin_array, _destination_array (ndarray): The int32 offsets of the OD points, with shape (n, 2).
+            _start_moment_array, _end_moment_array (ndarray): The uint32 start and end moments.
+        """
+        self.frame = _frame
+        _order = np.argsort(_uid_array, kind='stable')
+        self.uid_category = pd.Categorical(np.asarray(_uid_array)[_order])
+        self.uuid_array = np.asarray(_uuid_array)[_order]
+        self.origin_array = _origin_array[_order]
+        self.destination_array = _destination_array[_order]
+        self.start_moment_array = _start_moment_array[_order]
+        self.end_moment_array = _end_moment_array[_order]
+        _uid_code = self.uid_category.codes
+        self.user_offset_array = np.searchsorted(_uid_code, np.arange(len(self.uid_category.categories) + 1))
+
+    @classmethod
+    def from_df(cls, _record_df, _frame=None, _unit_per_meter=DEFAULT_UNIT_PER_METER):
+        """
+        Build the compact table from a DataFrame of ride records.
+        Parameters:
+            _record_df (DataFrame): The ride records with the uid, uuid, OD coordinates, date, start_time and end_time fields.
+            _frame (CoordinateFrame): The coordinate frame, default is None, which is created from the bounds of the records.
+            _unit_per_meter (int): See CoordinateFrame, only used when _frame is None, default is DEFAULT_UNIT_PER_METER.
+        """
+        if _frame is None:
+            _frame = CoordinateFrame.from_bounds(
+                np.r_[_record_df['origin_x'], _record_df['destination_x']],
+                np.r_[_record_df['origin_y'], _record_df['destination_y']], _unit_per_meter)
+        _start_moment_array = encode_moment(_record_df['date'], _record_df['start_time'])
+        _end_moment_array = encode_moment(_record_df['date'], _record_df['end_time'])
+        # A ride ending after midnight ends on the next day
+        _end_moment_array = np.where(_end_moment_array < _start_moment_array, _end_moment_array + 86400,
+                                     _end_moment_array).astype(np.uint32)
+        return cls(_frame, _record_df['uid'].to_numpy(), _record_df['uuid'].to_numpy(),
+                   _frame.encode(_record_df['origin_x'], _record_df['origin_y']),
+                   _frame.encode(_record_df['destination_x'], _record_df['destination_y']),
+                   _start_moment_array, _end_moment_array)
+
+    @property
+    def nbytes(self):
+        return (self.origin_array.nbytes + self.destination_array.nbytes + self.start_moment_array.nbytes +
+                self.end_moment_array.nbytes + self.uid_category.codes.nbytes + self.uuid_array.nbytes)
+
+    def get_user_slice(self, _uid):
+        _code = self.uid_category.categories.get_loc(_uid)
+        return slice(self.user_offset_array[_code], self.user_offset_array[_code + 1])
+
+    def get_user_record_list(self, _uid):
+        """
+        Decode the ride records of a user into the dictionaries used by init_bike_record_with_sfc_obj, e.g. for the spatiotemporal flow clustering and the decision trees,
+        which do not work on the compact form. The OD points are the rounded ones.
+        """
+        _slice = self.get_user_slice(_uid)
+        _origin = self.frame.decode(self.origin_array[_slice])
+        _destination = self.frame.decode(self.destination_array[_slice])
+        _start = pd.to_datetime(self.start_moment_array[_slice].astype(np.int64), unit='s')
+        _end = pd.to_datetime(self.end_moment_array[_slice].astype(np.int64), unit='s')
+        return [{'uid': _uid, 'uuid': _uuid, 'origin_x': _o[0], 'origin_y': _o[1], 'destination_x': _d[0],
+                 'destination_y': _d[1], 'date': _s.strftime('%Y-%m-%d'), 'start_time': _s.strftime('%H:%M:%S'),
+                 'end_time': _e.strftime('%H:%M:%S')}
+                for _uuid, _o, _d, _s, _e in zip(self.uuid_array[_slice], _origin.tolist(), _destination.tolist(), _start, _end)]
+
+
+def get_compact_squared_distance(_p1_array, _p2_array):
+    """
+    Calculate the exact squared distances between int32 points, in squared units of the coordinate frame.
+    The differences are taken in int64, so neither the subtraction nor the squares overflow.
+    """
+    _delta = _p1_array.astype(np.int64) - _p2_array.astype(np.int64)
+    return _delta[..., 0] * _delta[..., 0] + _delta[..., 1] * _delta[..., 1]
+
+
+def get_compact_near_record_index_list(_origin_array, _destination_array, _size_coefficient=0.3):
+    """
+    Get the indexes of the ride records near each ride record from the int32 OD points, which is the compact version of get_near_record_index_list.
+    The centroids are kept as the sum of the OD points, i.e. twice the centroid, so that they stay exact integers.
+    Parameters:
+        _origin_array, _destination_array (ndarray): The int32 offsets of the OD points, with shape (n, 2).
+        _size_coefficient (float): The coefficient for the distance threshold, default is 0.3.
+    Returns:
+        list: The sorted indexes of the nearby ride records of each ride record.
+    """
+    _double_centroid_array = _origin_array.astype(np.int64) + _destination_array.astype(np.int64)
+    _length_array = np.sqrt(get_compact_squared_distance(_origin_array, _destination_array))
+    _double_threshold_array = 2 * 1.4142 * _length_array * _size_coefficient
+    _candidate_index_list = cKDTree(_double_centroid_array).query_ball_point(
+        _double_centroid_array, _double_threshold_array + 1, return_sorted=True)
+    _near_record_index_list = []
+    for _this_index, _candidate_index in enumerate(_candidate_index_list):
+        _candidate_index = np.asarray(_candidate_index, dtype=np.int64)
+        _candidate_index = _candidate_index[_candidate_index != _this_index]
+        _squared_distance = get_compact_squared_distance(_double_centroid_array[_candidate_index],
+                                                         _double_centroid_array[_this_index])
+        _near_record_index_list.append(
+            _candidate_index[_squared_distance <= _double_threshold_array[_this_index] ** 2])
+    return _near_record_index_list
+
+
+def calculate_compact_spatial_dissimilarity_array(_sf1_od, _sf1_record_num, _od_sum_array, _record_num_array, _frame,
+                                                  _size_coefficient=0.3, _max_circle_boundary_radius=200):
+    """
+    Calculate the spatial dissimilarity coefficients between one spatial flow cluster and an array of spatial flow clusters, which are kept as the int64 sums of the int32 OD points of their ride records.
+    It is the compact version of calculate_spatial_dissimilarity_array, where the OD points of a cluster are the means of its ride records.
+    Parameters:
+        _sf1_od (ndarray): The sums of the OD offsets of the first cluster, with shape (4,).
+        _sf1_record_num (int): The number of ride records of the first cluster.
+        _od_sum_array (ndarray): The sums of the OD offsets of the other clusters, with shape (n, 4).
+        _record_num_array (ndarray): The numbers of ride records of the other clusters, with shape (n,).
+        _frame (CoordinateFrame): The coordinate frame of the offsets.
+        _size_coefficient: float, the size coefficient used to calculate the circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius: int, the maximum value for the circle boundary radius in meters, default is 200.
+    Returns:
+        ndarray, the spatial dissimilarity coefficients, with shape (n,).
+    """
+    _sf1_mean = np.asarray(_sf1_od, dtype=float) / _sf1_record_num
+    _mean_array = _od_sum_array / np.asarray(_record_num_array, dtype=float)[:, None]
+    _sf1_length = np.sqrt((_sf1_mean[0] - _sf1_mean[2]) ** 2 + (_sf1_mean[1] - _sf1_mean[3]) ** 2)
+    _length_array = np.sqrt((_mean_array[:, 0] - _mean_array[:, 2]) ** 2 + (_mean_array[:, 1] - _mean_array[:, 3]) ** 2)
+    _circle_boundary_radius = np.minimum(_length_array, _sf1_length) * _size_coefficient
+    _max_radius = _max_circle_boundary_radius * _frame.unit_per_meter
+    _circle_boundary_radius[_circle_boundary_radius >= _max_radius] = _max_radius
+    sd_0 = np.sqrt((_sf1_mean[0] - _mean_array[:, 0]) ** 2 + (_sf1_mean[1] - _mean_array[:, 1]) ** 2) / _circle_boundary_radius
+    sd_1 = np.sqrt((_sf1_mean[2] - _mean_array[:, 2]) ** 2 + (_sf1_mean[3] - _mean_array[:, 3]) ** 2) / _circle_boundary_radius
+    return np.sqrt(sd_0 ** 2 + sd_1 ** 2)
+
+
+def extract_compact_spatial_flow_clusters(_table, _uid, _activity_weekdays, _size_coefficient=0.3,
+                                          _max_circle_boundary_radius=200):
+    """
+    Extract the spatial flow clusters of one user directly from the compact table, following the same greedy order as extract_heavy_user_spatial_flow_clusters.
+    Each cluster is kept as the int64 sums of its OD offsets and its number of ride records instead of a SpatialClusterFlow object.
+    The results approximate those of extract_spatial_flow_clusters: the OD points are rounded to the unit of the coordinate frame, which can flip a merge whose dissimilarity is within the rounding of 1,
+    and the OD means are only accurate to the unit. equivalence_harness_fuc reports how many users differ.
+    Parameters:
+        _table (CompactRecordTable): The compact ride records.
+        _uid (str): The uid of the user.
+        _activity_weekdays (int): The number of activity weekdays of the user.
+        _size_coefficient (float): The coefficient for the neighbourhood and circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the circle boundary radius in meters, default is 200.
+    Returns:
+        list: The summaries of the final spatial flow clusters, in the same form as SpatialClusterFlow.to_summary.
+    """
+    _slice = _table.get_user_slice(_uid)
+    _origin_array = _table.origin_array[_slice]
+    _destination_array = _table.destination_array[_slice]
+    _record_num = len(_origin_array)
+    _near_record_index_list = get_compact_near_record_index_list(_origin_array, _destination_array, _size_coefficient)
+    _label_array = np.arange(_record_num)
+    _od_sum_array = np.hstack([_origin_array, _destination_array]).astype(np.int64)
+    _record_num_array = np.ones(_record_num, dtype=np.int64)
+    for _this_index, _near_record_index in enumerate(_near_record_index_list):
+        _this_label = _label_array[_this_index]
+        _near_record_index = _near_record_index[_label_array[_near_record_index] != _this_label]
+        _position = 0
+        while _position < len(_near_record_index):
+            _near_label_array = _label_array[_near_record_index[_position:]]
+            _flows_sd = calculate_compact_spatial_dissimilarity_array(
+                _od_sum_array[_this_label], _record_num_array[_this_label], _od_sum_array[_near_label_array],
+                _record_num_array[_near_label_array], _table.frame, _size_coefficient, _max_circle_boundary_radius)
+            _hit_position_array = np.nonzero((_near_label_array != _this_label) & (_flows_sd <= 1))[0]
+            if len(_hit_position_array) == 0:
+                break
+            _near_label = _near_label_array[_hit_position_array[0]]
+            _od_sum_array[_this_label] += _od_sum_array[_near_label]
+            _record_num_array[_this_label] += _record_num_array[_near_label]
+            _label_array[_label_array == _near_label] = _this_label
+            _position += _hit_position_array[0] + 1
+
+    _sfc_summary_list = []
+    _min_sfc_threshold = _activity_weekdays / 5
+    # The clusters are reported in the order of their first ride record, the same as extract_spatial_flow_clusters
+    for _label in dict.fromkeys(_label_array.tolist()):
+        if _record_num_array[_label] >= _min_sfc_threshold:
+            _mean_od = _table.frame.decode((_od_sum_array[_label] / _record_num_array[_label]).reshape(2, 2))
+            _sfc_summary_list.append({'sfc_id': f'sfc{str(_label).zfill(3)}', 'origin': _mean_od[0].tolist(),
+                                      'destination': _mean_od[1].tolist(),
+                                      'record_num': int(_record_num_array[_label]),
+                                      'record_uuid_list': _table.uuid_array[_slice][_label_array == _label].tolist()})
+    return _sfc_summary_list
+
+
+def extract_compact_spatial_flow_cluster_objects(_table, _uid, _activity_weekdays, _size_coefficient=0.3,
+                                                 _max_circle_boundary_radius=200):
+    """
+    Extract the spatial flow clusters of one user with extract_compact_spatial_flow_clusters, and rebuild them as SpatialClusterFlow objects
+    from the ride records decoded from the compact table, which is the form extract_spatiotemporal_flow_clusters works on.
+    Parameters:
+        _table (CompactRecordTable): The compact ride records.
+        _uid (str): The uid of the user.
+        _activity_weekdays (int): The number of activity weekdays of the user.
+        _size_coefficient (float): The coefficient for the neighbourhood and circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the circle boundary radius in meters, default is 200.
+    Returns:
+        dict: The final spatial flow clusters of the user, where the keys are SFC IDs and the values are SpatialClusterFlow objects.
+    """
+    _record_dict = {_record['uuid']: _record for _record in _table.get_user_record_list(_uid)}
+    _spatial_flow_cluster_dict = {}
+    for _sfc_summary in extract_compact_spatial_flow_clusters(_table, _uid, _activity_weekdays, _size_coefficient,
+                                                              _max_circle_boundary_radius):
+        _record_detail = {}
+        for _uuid in _sfc_summary['record_uuid_list']:
+            _record = _record_dict[_uuid]
+            _record_detail[_uuid] = {'origin': [_record['origin_x'], _record['origin_y']],
+                                     'destination': [_record['destination_x'], _record['destination_y']],
+                                     'start_time': _record['start_time'], 'end_time': _record['end_time'],
+                                     'date': _record['date']}
+        _spatial_flow_cluster_dict[_sfc_summary['sfc_id']] = SpatialClusterFlow(
+            _sfc_summary['sfc_id'], FlowLine([_sfc_summary['origin'], _sfc_summary['destination']]), _record_detail)
+    return _spatial_flow_cluster_dict
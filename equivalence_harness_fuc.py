@@ -0,0 +1,385 @@
+# encoding: utf-8
+# Run the reference implementations and the optimized ones side by side on the same ride records, diff their results
+# within tolerances and report the speed-up, so that a high-performance mode is only turned on once it reproduces the
+# greedy, order-dependent results of the reference
+
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import pandas as pd
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters, extract_heavy_user_spatial_flow_clusters
+from spatiotemporal_flow_clustering_fuc import extract_spatiotemporal_flow_clusters, \
+    extract_heavy_user_spatiotemporal_flow_clusters
+from ruled_base_decision_tress_fuc import extract_candidate_commuting_flows, identify_user_commuting_category, \
+    build_daily_commuting_flow_df
+from columnar_decision_tree_fuc import build_candidate_commuting_flow_table, identify_commuting_category_table
+from compact_storage_fuc import CompactRecordTable, extract_compact_spatial_flow_clusters, DEFAULT_UNIT_PER_METER
+from out_of_core_processing_fuc import DEFAULT_PIPELINE_PARAMS, RECORD_COLUMN_DTYPES, select_weekday_records, \
+    process_all_users
+from streaming_window_fuc import StreamingCommutingMonitor, DEFAULT_MAX_INCREMENTAL_RATE
+
+# The optimized code paths checked by the harness, each against its reference:
+# sfc_heavy_user and sfc_compact against extract_spatial_flow_clusters, stfc_heavy_user against extract_spatiotemporal_flow_clusters,
+# dcf_columnar against identify_user_commuting_category, and stream_window, the incremental streaming mode, against process_all_users
+# on the ride records of each window
+HARNESS_STAGE_LIST = ['sfc_heavy_user', 'sfc_compact', 'stfc_heavy_user', 'dcf_columnar', 'stream_window']
+
+# The code paths that round the ride records and are only expected to be close to their references.
+# Their differences are reported, but do not count against the equivalence of the optimized code paths.
+# stream_window is also approximate unless its users are re-clustered from scratch, i.e. _max_incremental_rate is 0
+APPROXIMATE_STAGE_LIST = ['sfc_compact']
+
+# The extent of the synthetic ride records in the Web Mercator coordinate system, which covers the centre of Shenzhen
+_SYNTHETIC_EXTENT = np.array([12670000, 2560000, 12700000, 2590000], dtype=float)
+
+
+def make_synthetic_records(_user_num, _record_num, _seed=0, _od_num=12, _noise_rate=0.15, _public_station_df=None):
+    """
+    Make synthetic ride records, where each user rides back and forth between a few OD pairs in the morning and the evening,
+    rides between other OD points at habitual times, and rides occasionally.
+    Parameters:
+        _user_num (int): The number of users.
+        _record_num (int): The number of ride records of each user.
+        _seed (int): The random seed, default is 0.
+        _od_num (int): The number of habitual OD pairs of each user, half of which form the outbound and return trips of commuting, default is 12.
+        _noise_rate (float): The share of occasional ride records with random OD points and times, default is 0.15.
+        _public_station_df (DataFrame): The metro entrances, near which some of the habitual OD points are placed to produce transfers, default is None.
+    Returns:
+        DataFrame: The ride records with the fields of RECORD_COLUMN_DTYPES.
+    """
+    _rng = np.random.default_rng(_seed)
+    _date_array = pd.date_range('2021-04-01', '2021-06-30', freq='B').strftime('%Y-%m-%d').to_numpy()
+    _pair_num = _od_num // 4
+    _user_df_list = [pd.DataFrame({_field: pd.Series(dtype=_dtype) for _field, _dtype in RECORD_COLUMN_DTYPES.items()})]
+    for _user_index in range(_user_num):
+        _habitual_od = _make_synthetic_od_array(_rng, _od_num, _public_station_df)
+        _habitual_hour = _rng.uniform(0, 24, _od_num)
+        # The first OD pairs are ridden in the morning and returned in the evening, as the commuting flows
+        _habitual_hour[:_pair_num] = _rng.uniform(6.5, 9.5, _pair_num)
+        _habitual_od[_pair_num:2 * _pair_num] = _habitual_od[:_pair_num][:, [2, 3, 0, 1]]
+        _habitual_hour[_pair_num:2 * _pair_num] = _habitual_hour[:_pair_num] + _rng.uniform(8, 10, _pair_num)
+        _od_weight = np.r_[np.full(2 * _pair_num, 3.0), np.ones(_od_num - 2 * _pair_num)]
+        _od_index = _rng.choice(_od_num, size=_record_num, p=_od_weight / _od_weight.sum())
+        _od = _habitual_od[_od_index] + _rng.normal(0, 80, (_record_num, 4))
+        _start_hour = (_habitual_hour[_od_index] + _rng.normal(0, 0.4, _record_num)) % 24
+        _is_noise = _rng.random(_record_num) < _noise_rate
+        _od[_is_noise] = _make_synthetic_od_array(_rng, _is_noise.sum())
+        _start_hour[_is_noise] = _rng.uniform(0, 24, _is_noise.sum())
+        _end_hour = (_start_hour + _rng.uniform(0.05, 0.5, _record_num)) % 24
+        _uid = f'synthetic_user{_user_index}'
+        _user_df_list.append(pd.DataFrame({
+            'uid': _uid, 'uuid': [f'{_uid}_{_i:06d}' for _i in range(_record_num)],
+            'origin_x': _od[:, 0], 'origin_y': _od[:, 1], 'destination_x': _od[:, 2], 'destination_y': _od[:, 3],
+            'date': _date_array[_rng.integers(len(_date_array), size=_record_num)],
+            'start_time': _format_hour_array(_start_hour), 'end_time': _format_hour_array(_end_hour)}))
+    return pd.concat(_user_df_list, ignore_index=True)
+
+
+def _make_synthetic_od_array(_rng, _od_num, _public_station_df=None):
+    """
+    Make random OD points with the lengths of bike rides between 0.5 and 4 km, where a quarter of the origins and a quarter of the destinations are placed near the metro entrances if given.
+    """
+    _origin = _rng.uniform(_SYNTHETIC_EXTENT[:2], _SYNTHETIC_EXTENT[2:], (_od_num, 2))
+    _angle = _rng.uniform(0, 2 * np.pi, _od_num)
+    _displacement = np.column_stack([np.cos(_angle), np.sin(_angle)]) * _rng.uniform(500, 4000, _od_num)[:, None]
+    if _public_station_df is not None:
+        _station_array = _public_station_df[['x_coord', 'y_coord']].to_numpy(dtype=float)
+        _near_station_location = _station_array[_rng.integers(len(_station_array), size=_od_num)] + _rng.normal(0, 15, (_od_num, 2))
+        _draw = _rng.random(_od_num)
+        _origin = np.where((_draw < 0.25)[:, None], _near_station_location, _origin)
+        _origin = np.where(((_draw >= 0.25) & (_draw < 0.5))[:, None], _near_station_location - _displacement, _origin)
+    return np.hstack([_origin, _origin + _displacement])
+
+
+def _format_hour_array(_hour_array):
+    _second_array = (_hour_array * 3600).astype(int) % 86400
+    return [f'{_s // 3600:02d}:{_s % 3600 // 60:02d}:{_s % 60:02d}' for _s in _second_array]
+
+
+def _normalize_spatial_flow_clusters(_sfc):
+    # Both the SpatialClusterFlow objects and their summaries are reduced to the members and the OD means of each cluster
+    _normalized_dict = {}
+    for _sfc_id, _item in (_sfc.items() if isinstance(_sfc, dict) else ((_s['sfc_id'], _s) for _s in _sfc)):
+        if isinstance(_item, dict):
+            _normalized_dict[_sfc_id] = (frozenset(_item['record_uuid_list']),
+                                         np.array([_item['origin'], _item['destination']], dtype=float))
+        else:
+            _normalized_dict[_sfc_id] = (frozenset(_item.including_record_detail),
+                                         np.array([_item.origin, _item.destination], dtype=float))
+    return _normalized_dict
+
+
+def diff_spatial_flow_clusters(_reference_sfc_dict, _fast_sfc, _od_tolerance=1e-6):
+    """
+    Diff the spatial flow clusters of one user.
+    Parameters:
+        _reference_sfc_dict (dict): The spatial flow clusters from extract_spatial_flow_clusters.
+        _fast_sfc (dict or list): The spatial flow clusters, or their summaries, from an optimized code path.
+        _od_tolerance (float): The tolerance of the OD means in meters, default is 1e-6.
+    Returns:
+        list: The descriptions of the differences, empty if the results are equivalent.
+    """
+    _reference_dict = _normalize_spatial_flow_clusters(_reference_sfc_dict)
+    _fast_dict = _normalize_spatial_flow_clusters(_fast_sfc)
+    _diff_list = [f'{_sfc_id} only in the reference' for _sfc_id in _reference_dict.keys() - _fast_dict.keys()]
+    _diff_list += [f'{_sfc_id} only in the fast results' for _sfc_id in _fast_dict.keys() - _reference_dict.keys()]
+    for _sfc_id in _reference_dict.keys() & _fast_dict.keys():
+        (_reference_uuid_set, _reference_od), (_fast_uuid_set, _fast_od) = _reference_dict[_sfc_id], _fast_dict[_sfc_id]
+        if _reference_uuid_set != _fast_uuid_set:
+            _diff_list.append(f'{_sfc_id} membership differs by {len(_reference_uuid_set ^ _fast_uuid_set)} ride records')
+        _od_error = np.abs(_reference_od - _fast_od).max()
+        if not _od_error <= _od_tolerance:
+            _diff_list.append(f'{_sfc_id} OD mean differs by {_od_error:.6g} m')
+    return _diff_list
+
+
+def diff_spatiotemporal_flow_clusters(_reference_stfc_dict, _fast_stfc_dict, _od_tolerance=1e-6, _time_tolerance=1e-9):
+    """
+    Diff the spatiotemporal flow clusters of one user.
+    Parameters:
+        _reference_stfc_dict (dict): The spatiotemporal flow clusters from extract_spatiotemporal_flow_clusters.
+        _fast_stfc_dict (dict): The spatiotemporal flow clusters from an optimized code path.
+        _od_tolerance (float): The tolerance of the OD points in meters, default is 1e-6.
+        _time_tolerance (float): The tolerance of the time spans in hours, default is 1e-9.
+    Returns:
+        list: The descriptions of the differences, empty if the results are equivalent.
+    """
+    _diff_list = [f'{_stfc_id} only in the reference' for _stfc_id in _reference_stfc_dict.keys() - _fast_stfc_dict.keys()]
+    _diff_list += [f'{_stfc_id} only in the fast results' for _stfc_id in _fast_stfc_dict.keys() - _reference_stfc_dict.keys()]
+    for _stfc_id in _reference_stfc_dict.keys() & _fast_stfc_dict.keys():
+        _reference_stfc, _fast_stfc = _reference_stfc_dict[_stfc_id], _fast_stfc_dict[_stfc_id]
+        if _reference_stfc.sfc_id != _fast_stfc.sfc_id:
+            _diff_list.append(f'{_stfc_id} belongs to {_reference_stfc.sfc_id} in the reference but {_fast_stfc.sfc_id}')
+        _uuid_difference = set(_reference_stfc.including_record_detail) ^ set(_fast_stfc.including_record_detail)
+        if _uuid_difference:
+            _diff_list.append(f'{_stfc_id} membership differs by {len(_uuid_difference)} ride records')
+        _od_error = np.abs(np.array(_reference_stfc.flow.coords) - np.array(_fast_stfc.flow.coords)).max()
+        if not _od_error <= _od_tolerance:
+            _diff_list.append(f'{_stfc_id} OD differs by {_od_error:.6g} m')
+        _time_error = np.abs(np.array(_reference_stfc.time_span) - np.array(_fast_stfc.time_span)).max()
+        if not _time_error <= _time_tolerance:
+            _diff_list.append(f'{_stfc_id} time span differs by {_time_error:.6g} h')
+    return _diff_list
+
+
+def diff_daily_commuting_flows(_reference_dcf_df, _fast_dcf_df, _tolerance=1e-9):
+    """
+    Diff the daily commuting flows of all users field by field, where the numeric fields are compared within a tolerance and missing values are equal.
+    Parameters:
+        _reference_dcf_df (DataFrame): The daily commuting flows from identify_user_commuting_category, as returned by build_daily_commuting_flow_df.
+        _fast_dcf_df (DataFrame): The daily commuting flows from an optimized code path.
+        _tolerance (float): The absolute tolerance of the numeric fields, default is 1e-9.
+    Returns:
+        list: The uid and the description of each difference, where the uid is None for a missing field, empty if the results are equivalent.
+    """
+    _reference_dcf_df = _reference_dcf_df.set_index('uid')
+    _fast_dcf_df = _fast_dcf_df.set_index('uid')
+    _diff_list = [(_uid, 'only in the reference') for _uid in _reference_dcf_df.index.difference(_fast_dcf_df.index)]
+    _diff_list += [(_uid, 'only in the fast results') for _uid in _fast_dcf_df.index.difference(_reference_dcf_df.index)]
+    _diff_list += [(None, f'field {_field} only in the reference') for _field in
+                   _reference_dcf_df.columns.difference(_fast_dcf_df.columns)]
+    _uid_index = _reference_dcf_df.index.intersection(_fast_dcf_df.index)
+    for _field in _reference_dcf_df.columns.intersection(_fast_dcf_df.columns):
+        _reference_series = _reference_dcf_df.loc[_uid_index, _field]
+        _fast_series = _fast_dcf_df.loc[_uid_index, _field]
+        try:
+            _is_equal = np.isclose(pd.to_numeric(_reference_series).to_numpy(dtype=float),
+                                   pd.to_numeric(_fast_series).to_numpy(dtype=float), rtol=0, atol=_tolerance,
+                                   equal_nan=True)
+        except (ValueError, TypeError):
+            _is_equal = ((_reference_series == _fast_series) | (_reference_series.isna() & _fast_series.isna())).to_numpy()
+        for _uid in _uid_index[~_is_equal]:
+            _diff_list.append((_uid, f'{_field} is {_reference_series[_uid]!r} in the reference but {_fast_series[_uid]!r}'))
+    return _diff_list
+
+
+def run_equivalence_harness(_record_df, _public_station_k_tree, _public_station_df, _params=None, _workers=4,
+                            _od_tolerance=1e-6, _time_tolerance=1e-9, _unit_per_meter=DEFAULT_UNIT_PER_METER,
+                            _compact_od_tolerance=None, _dcf_tolerance=1e-9, _window_days=28, _window_check_days=7,
+                            _max_incremental_rate=DEFAULT_MAX_INCREMENTAL_RATE):
+    """
+    Run the reference and the optimized code paths on the same ride records and diff every user.
+    Parameters:
+        _record_df (DataFrame): The ride records of all users.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used by the neighbour search of the heavy-user spatial flow clustering, default is 4.
+        _od_tolerance (float): The tolerance of the OD points in meters, default is 1e-6.
+        _time_tolerance (float): The tolerance of the time spans in hours, default is 1e-9.
+        _unit_per_meter (int): The fixed-point unit of the compact storage, see CoordinateFrame, default is DEFAULT_UNIT_PER_METER.
+        _compact_od_tolerance (float): The tolerance of the OD means of the compact storage in meters, default is None, which is one unit.
+        _dcf_tolerance (float): The absolute tolerance of the numeric fields of the daily commuting flows, default is 1e-9.
+        _window_days (int): The number of days in the window of the streaming mode, default is 28, and None skips the stream_window stage.
+        _window_check_days (int): The number of days between the windows compared with the batch mode, counted back from the last date, default is 7.
+        _max_incremental_rate (float): The rate of changed ride records that triggers a full re-clustering of a user in the streaming mode, see StreamingCommutingMonitor,
+            default is DEFAULT_MAX_INCREMENTAL_RATE.
+    Returns:
+        tuple: A DataFrame with the number of compared users, the number and the rate of users with differences, whether the stage is expected to be exact,
+            the time of the reference and the fast code path and the speed-up of each stage,
+            and a dictionary of the differences of each stage, where the keys are stages and the values are lists of (uid, description).
+            The users of stream_window are counted once per compared window, and its reference time is the mean time of the batch mode
+            on a compared window times the number of days streamed, i.e. the estimated time of re-running the batch mode every day.
+    """
+    _params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+    _spatial_params = {'_size_coefficient': _params['size_coefficient'],
+                       '_max_circle_boundary_radius': _params['max_circle_boundary_radius']}
+    _spatiotemporal_params = {'_expansion_coefficient': _params['expansion_coefficient'], **_spatial_params}
+    _compact_od_tolerance = 1 / _unit_per_meter if _compact_od_tolerance is None else _compact_od_tolerance
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(_record_df)
+    if len(_weekday_record_df):
+        _compact_table = CompactRecordTable.from_df(_weekday_record_df, _unit_per_meter=_unit_per_meter)
+
+    _reference_seconds = dict.fromkeys(HARNESS_STAGE_LIST, 0.0)
+    _fast_seconds = dict.fromkeys(HARNESS_STAGE_LIST, 0.0)
+    _compared_num = dict.fromkeys(HARNESS_STAGE_LIST, 0)
+    _diff_dict = {_stage: [] for _stage in HARNESS_STAGE_LIST}
+
+    def _timed(_function, *args, **kwargs):
+        _start = time.perf_counter()
+        _result = _function(*args, **kwargs)
+        return _result, time.perf_counter() - _start
+
+    _each_candidate_commuting_flow_dict = {}
+    for _uid, _user_record_df in _weekday_record_df.groupby('uid', sort=False):
+        _record_list = _user_record_df.to_dict(orient='records')
+        _activity_weekdays = _activity_weekdays_dict[_uid]
+        _reference_sfc_dict, _seconds = _timed(extract_spatial_flow_clusters, _record_list, _activity_weekdays,
+                                               **_spatial_params)
+        _reference_seconds['sfc_heavy_user'] += _seconds
+        _reference_seconds['sfc_compact'] += _seconds
+        _fast_sfc_dict, _seconds = _timed(extract_heavy_user_spatial_flow_clusters, _record_list, _activity_weekdays,
+                                          _workers=_workers, **_spatial_params)
+        _fast_seconds['sfc_heavy_user'] += _seconds
+        _compact_sfc_summary_list, _seconds = _timed(extract_compact_spatial_flow_clusters, _compact_table, _uid,
+                                                     _activity_weekdays, **_spatial_params)
+        _fast_seconds['sfc_compact'] += _seconds
+        _diff_dict['sfc_heavy_user'] += [(_uid, _d) for _d in diff_spatial_flow_clusters(
+            _reference_sfc_dict, _fast_sfc_dict, _od_tolerance)]
+        _diff_dict['sfc_compact'] += [(_uid, _d) for _d in diff_spatial_flow_clusters(
+            _reference_sfc_dict, _compact_sfc_summary_list, _compact_od_tolerance)]
+
+        # Each code path clusters its own spatial flow clusters, so that a difference of the first layer is not hidden
+        _reference_stfc_dict, _seconds = _timed(extract_spatiotemporal_flow_clusters, _reference_sfc_dict,
+                                                **_spatiotemporal_params)
+        _reference_seconds['stfc_heavy_user'] += _seconds
+        _fast_stfc_dict, _seconds = _timed(extract_heavy_user_spatiotemporal_flow_clusters, _fast_sfc_dict,
+                                           **_spatiotemporal_params)
+        _fast_seconds['stfc_heavy_user'] += _seconds
+        _diff_dict['stfc_heavy_user'] += [(_uid, _d) for _d in diff_spatiotemporal_flow_clusters(
+            _reference_stfc_dict, _fast_stfc_dict, _od_tolerance, _time_tolerance)]
+        for _stage in ['sfc_heavy_user', 'sfc_compact', 'stfc_heavy_user']:
+            _compared_num[_stage] += 1
+
+        _candidate_commuting_flow_dict = extract_candidate_commuting_flows(
+            _reference_stfc_dict, _public_station_k_tree, _public_station_df,
+            _boundary_circle_radius=_params['boundary_circle_radius'],
+            _working_hours_threshold=_params['working_hours_threshold'],
+            _transfer_distance_threshold=_params['transfer_distance_threshold'])
+        if _candidate_commuting_flow_dict:
+            _each_candidate_commuting_flow_dict[_uid] = _candidate_commuting_flow_dict
+
+    # Both decision-tree code paths start from the same candidate commuting flows
+    _fast_dcf_df, _seconds = _timed(
+        lambda: identify_commuting_category_table(build_candidate_commuting_flow_table(_each_candidate_commuting_flow_dict)))
+    _fast_seconds['dcf_columnar'] = _seconds
+    _reference_dcf_df, _seconds = _timed(lambda: build_daily_commuting_flow_df(
+        {_uid: identify_user_commuting_category(_cf_dict) for _uid, _cf_dict in _each_candidate_commuting_flow_dict.items()}))
+    _reference_seconds['dcf_columnar'] = _seconds
+    _compared_num['dcf_columnar'] = len(_each_candidate_commuting_flow_dict)
+    if _each_candidate_commuting_flow_dict:
+        _diff_dict['dcf_columnar'] = diff_daily_commuting_flows(_reference_dcf_df, _fast_dcf_df, _dcf_tolerance)
+
+    if _window_days is not None and len(_record_df):
+        (_compared_num['stream_window'], _diff_dict['stream_window'], _reference_seconds['stream_window'],
+         _fast_seconds['stream_window']) = _diff_streaming_windows(
+            _record_df, _public_station_k_tree, _public_station_df, _params, _window_days, _window_check_days,
+            _dcf_tolerance, _max_incremental_rate)
+    _approximate_stage_set = set(APPROXIMATE_STAGE_LIST) | ({'stream_window'} if _max_incremental_rate > 0 else set())
+
+    _report_df = pd.DataFrame({
+        'stage': HARNESS_STAGE_LIST,
+        'compared_num': [_compared_num[_stage] for _stage in HARNESS_STAGE_LIST],
+        # A window of stream_window is part of the key, so that a user is counted once per window
+        'different_num': [len({_uid for _uid, _ in _diff_dict[_stage]}) for _stage in HARNESS_STAGE_LIST],
+        'is_exact': [_stage not in _approximate_stage_set for _stage in HARNESS_STAGE_LIST],
+        'reference_seconds': [_reference_seconds[_stage] for _stage in HARNESS_STAGE_LIST],
+        'fast_seconds': [_fast_seconds[_stage] for _stage in HARNESS_STAGE_LIST]})
+    _report_df.insert(3, 'different_rate', _report_df['different_num'] / _report_df['compared_num'].clip(lower=1))
+    _report_df['speed_up'] = _report_df['reference_seconds'] / _report_df['fast_seconds']
+    return _report_df, _diff_dict
+
+
+def _build_dcf_df(_dcf_dict):
+    # An empty result still has the uid field, so that it can be diffed
+    return build_daily_commuting_flow_df(_dcf_dict) if _dcf_dict else pd.DataFrame({'uid': []})
+
+
+def _diff_streaming_windows(_record_df, _public_station_k_tree, _public_station_df, _params, _window_days,
+                            _window_check_days, _dcf_tolerance, _max_incremental_rate):
+    """
+    Stream the ride records day by day through StreamingCommutingMonitor, and diff its daily commuting flows with the ones of
+    process_all_users on the ride records of the same window at every _window_check_days days counted back from the last date.
+    The ride records are ordered by date for both modes, keeping their order within the same date.
+    Returns:
+        tuple: The number of compared user-windows, the list of (window end date and uid, description) of the differences,
+            the estimated time of the batch mode over all days and the time of the streaming mode.
+    """
+    _record_df = _record_df.sort_values('date', kind='stable')
+    _date_record_dict = {_date: _df.to_dict(orient='records') for _date, _df in _record_df.groupby('date', sort=False)}
+    _first_date = datetime.date.fromisoformat(_record_df['date'].iloc[0])
+    _last_date = datetime.date.fromisoformat(_record_df['date'].iloc[-1])
+    _check_date_set = {(_last_date - datetime.timedelta(days=_d)).isoformat()
+                       for _d in range(0, (_last_date - _first_date).days + 1, _window_check_days)}
+
+    _monitor = StreamingCommutingMonitor(_public_station_k_tree, _public_station_df, _window_days, _params,
+                                         _max_incremental_rate=_max_incremental_rate)
+    _compared_num = 0
+    _diff_list = []
+    _batch_seconds_list = []
+    _stream_seconds = 0.0
+    _step_num = (_last_date - _first_date).days + 1
+    for _day in range(_step_num):
+        _date = (_first_date + datetime.timedelta(days=_day)).isoformat()
+        _start = time.perf_counter()
+        _monitor.step(_date, _date_record_dict.get(_date, []))
+        _stream_seconds += time.perf_counter() - _start
+        if _date not in _check_date_set:
+            continue
+        _window_start_date = (datetime.date.fromisoformat(_date) - datetime.timedelta(days=_window_days - 1)).isoformat()
+        _start = time.perf_counter()
+        _batch_result_dict = process_all_users(
+            _record_df[(_record_df['date'] >= _window_start_date) & (_record_df['date'] <= _date)],
+            _public_station_k_tree, _public_station_df, _params)
+        _batch_seconds_list.append(time.perf_counter() - _start)
+        _batch_dcf_dict = {_uid: _r['dcf'] for _uid, _r in _batch_result_dict.items() if _r['dcf'] is not None}
+        _compared_num += len(set(_batch_result_dict) | set(_monitor.user_state_dict))
+        _diff_list += [(f'{_date} {_uid}', _d) for _uid, _d in diff_daily_commuting_flows(
+            _build_dcf_df(_batch_dcf_dict), _build_dcf_df(_monitor.dcf_dict), _dcf_tolerance)]
+    return _compared_num, _diff_list, np.mean(_batch_seconds_list) * _step_num, _stream_seconds
+
+
+if __name__ == '__main__':
+    import scipy.spatial as spt
+    _data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    _metro_df = pd.read_csv(os.path.join(_data_dir, 'metro_entrance_2021.csv'))
+    _metro_k_tree = spt.KDTree(list(zip(_metro_df['x_coord'], _metro_df['y_coord'])))
+    # Usage: python equivalence_harness_fuc.py [synthetic user number] [ride records per user] [random seed]
+    _user_num = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    _record_num = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    _seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    _has_difference = False
+    for _name, _record_df in [('sample_bike_records.csv', pd.read_csv(os.path.join(_data_dir, 'sample_bike_records.csv'))),
+                              (f'synthetic {_user_num} users x {_record_num} records, seed {_seed}',
+                               make_synthetic_records(_user_num, _record_num, _seed, _public_station_df=_metro_df))]:
+        _report_df, _diff_dict = run_equivalence_harness(_record_df, _metro_k_tree, _metro_df)
+        print(f'== {_name}')
+        print(_report_df.to_string(index=False))
+        for _stage, _diff_list in _diff_dict.items():
+            for _uid, _description in _diff_list[:10]:
+                print(f'{_stage} {_uid}: {_description}')
+        # Only the exact stages decide the exit code, the approximate ones are reported for information
+        _has_difference = _has_difference or bool(_report_df.loc[_report_df['is_exact'], 'different_num'].sum())
+    sys.exit(1 if _has_difference else 0)
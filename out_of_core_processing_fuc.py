@@ -0,0 +1,424 @@
+# encoding: utf-8
+# Process bike-sharing records that are larger than RAM by hash-partitioning them by uid into on-disk shards,
+# so that every shard holds the complete ride records of its users and can be processed independently
+
+import os
+import json
+import math
+import hashlib
+import pandas as pd
+from chinese_calendar import is_workday
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters, extract_heavy_user_spatial_flow_clusters
+from spatiotemporal_flow_clustering_fuc import extract_spatiotemporal_flow_clusters, \
+    extract_heavy_user_spatiotemporal_flow_clusters
+from ruled_base_decision_tress_fuc import extract_candidate_commuting_flows, identify_user_commuting_category
+
+# Only the fields used by the two-layer framework are read from the raw records
+RECORD_COLUMN_DTYPES = {'uid': str, 'uuid': str, 'origin_x': float, 'origin_y': float, 'destination_x': float,
+                        'destination_y': float, 'date': str, 'start_time': str, 'end_time': str}
+
+# The clustering and decision-tree parameters used in our study
+DEFAULT_PIPELINE_PARAMS = {'size_coefficient': 0.3, 'max_circle_boundary_radius': 200, 'expansion_coefficient': 0.5,
+                           'boundary_circle_radius': 200, 'working_hours_threshold': 4,
+                           'transfer_distance_threshold': 60}
+
+# The ratio between the peak memory of processing a shard and its size on disk. Measured with tracemalloc on the synthetic
+# records of equivalence_harness_fuc, it is about 1 for a shard of many light users, whose records only live in the
+# DataFrame, and about 13 for a shard of a single user with 3000 records, whose per-record dicts are copied into every
+# spatial and spatiotemporal flow cluster; 8 keeps the shards of heavy users within the ceiling in most cases
+SHARD_MEMORY_EXPANSION_FACTOR = 8
+
+# Users with at least this many weekday ride records are clustered with the parallel heavy-user functions when workers are given
+HEAVY_USER_RECORD_NUM = 2000
+
+_SHARD_NAME_TEMPLATE = 'shard_{0}.csv'
+_MANIFEST_NAME = 'completed_shards.txt'
+_RESULT_DIR_NAME = 'results'
+
+
+def iter_record_chunks(_input_path, _chunk_size=500000, _columns=None):
+    """
+    Read the raw ride records chunk by chunk, only keeping the required columns.
+    Parameters:
+        _input_path (str): Path of the raw records, a CSV file or a Parquet file.
+        _chunk_size (int): The number of records in each chunk, default is 500000.
+        _columns (list): The columns to be read, default is the keys of RECORD_COLUMN_DTYPES.
+    Returns:
+        generator: DataFrames with at most _chunk_size records.
+    """
+    _columns = list(RECORD_COLUMN_DTYPES.keys()) if _columns is None else _columns
+    if _input_path.endswith('.parquet'):
+        # pyarrow is only required when the raw records are stored in Parquet
+        import pyarrow.parquet as pq
+        _parquet_file = pq.ParquetFile(_input_path)
+        for _batch in _parquet_file.iter_batches(batch_size=_chunk_size, columns=_columns):
+            yield _batch.to_pandas().astype({_c: RECORD_COLUMN_DTYPES[_c] for _c in _columns if _c in RECORD_COLUMN_DTYPES})
+    else:
+        _dtype = {_c: RECORD_COLUMN_DTYPES[_c] for _c in _columns if _c in RECORD_COLUMN_DTYPES}
+        for _chunk in pd.read_csv(_input_path, usecols=_columns, dtype=_dtype, chunksize=_chunk_size):
+            yield _chunk
+
+
+def assign_uid_shard(_uid_series, _shard_num, _hash_divisor=1):
+    """
+    Map each uid to a shard index with a stable hash, so that all the records of a user fall into the same shard.
+    Parameters:
+        _uid_series (Series): The uid of each record.
+        _shard_num (int): The number of shards.
+        _hash_divisor (int): Divisor applied to the hash before the modulo, used to re-partition an existing shard with independent bits, default is 1.
+    Returns:
+        ndarray: The shard index of each record.
+    """
+    _hash_values = pd.util.hash_pandas_object(_uid_series, index=False).to_numpy()
+    return (_hash_values // _hash_divisor) % _shard_num
+
+
+def partition_records_by_uid(_input_path, _shard_dir, _shard_num=64, _chunk_size=500000):
+    """
+    Hash-partition the raw ride records by uid into on-disk shards in one streaming pass.
+    Parameters:
+        _input_path (str): Path of the raw records, a CSV file or a Parquet file.
+        _shard_dir (str): The directory where the shards are written, any existing shard in it is overwritten.
+        _shard_num (int): The number of shards, default is 64.
+        _chunk_size (int): The number of records read at a time, default is 500000.
+    Returns:
+        list: Paths of the non-empty shards.
+    """
+    os.makedirs(_shard_dir, exist_ok=True)
+    _shard_path_dict = {}
+    for _chunk in iter_record_chunks(_input_path, _chunk_size):
+        _shard_index = assign_uid_shard(_chunk['uid'], _shard_num)
+        for _index, _shard_chunk in _chunk.groupby(_shard_index):
+            _shard_path = os.path.join(_shard_dir, _SHARD_NAME_TEMPLATE.format(str(_index).zfill(4)))
+            _shard_chunk.to_csv(_shard_path, mode='a' if _shard_path in _shard_path_dict else 'w',
+                                header=_shard_path not in _shard_path_dict, index=False)
+            _shard_path_dict[_shard_path] = True
+    return sorted(_shard_path_dict.keys())
+
+
+def split_oversized_shards(_shard_path_list, _max_memory_mb, _chunk_size=500000,
+                           _memory_expansion_factor=SHARD_MEMORY_EXPANSION_FACTOR, _max_split_depth=3):
+    """
+    Re-partition the shards whose estimated in-memory size exceeds the memory ceiling into smaller sub-shards.
+    The in-memory size of a shard is estimated from its size on disk, since the per-record dicts and cluster objects take several times more space than the CSV text.
+    Parameters:
+        _shard_path_list (list): Paths of the shards.
+        _max_memory_mb (float): The memory ceiling of processing one shard, in MB.
+        _chunk_size (int): The number of records read at a time, default is 500000.
+        _memory_expansion_factor (float): The ratio between the in-memory size and the on-disk size of a shard, default is SHARD_MEMORY_EXPANSION_FACTOR.
+        _max_split_depth (int): The maximum number of times a shard is re-partitioned, a shard holding a single heavy user cannot be split any further, default is 3.
+    Returns:
+        list: Paths of the shards that should be processed.
+    """
+    _final_shard_path_list = []
+    _pending_shard_list = [(_shard_path, 0, 1) for _shard_path in _shard_path_list]
+    while _pending_shard_list:
+        _shard_path, _depth, _hash_divisor = _pending_shard_list.pop(0)
+        _estimated_memory_mb = os.path.getsize(_shard_path) * _memory_expansion_factor / 1024 / 1024
+        if _estimated_memory_mb <= _max_memory_mb or _depth >= _max_split_depth:
+            _final_shard_path_list.append(_shard_path)
+            continue
+        _sub_shard_num = math.ceil(_estimated_memory_mb / _max_memory_mb)
+        _sub_shard_dir = _shard_path[:-len('.csv')]
+        # The shards of the previous level were taken with a modulo of the hash, so the sub-shards use the quotient to stay independent
+        _sub_hash_divisor = _hash_divisor * (2 ** 16)
+        _sub_shard_path_dict = {}
+        for _chunk in iter_record_chunks(_shard_path, _chunk_size):
+            _sub_shard_index = assign_uid_shard(_chunk['uid'], _sub_shard_num, _sub_hash_divisor)
+            for _index, _sub_shard_chunk in _chunk.groupby(_sub_shard_index):
+                os.makedirs(_sub_shard_dir, exist_ok=True)
+                _sub_shard_path = os.path.join(_sub_shard_dir, _SHARD_NAME_TEMPLATE.format(str(_index).zfill(4)))
+                _sub_shard_chunk.to_csv(_sub_shard_path, mode='a' if _sub_shard_path in _sub_shard_path_dict else 'w',
+                                        header=_sub_shard_path not in _sub_shard_path_dict, index=False)
+                _sub_shard_path_dict[_sub_shard_path] = True
+        os.remove(_shard_path)
+        if len(_sub_shard_path_dict) == 1:
+            # All the records belong to users that cannot be separated, such as a single heavy user
+            _final_shard_path_list.extend(_sub_shard_path_dict.keys())
+            continue
+        _pending_shard_list.extend(
+            [(_sub_shard_path, _depth + 1, _sub_hash_divisor) for _sub_shard_path in sorted(_sub_shard_path_dict)])
+    return _final_shard_path_list
+
+
+def run_user_pipeline(_record_list, _activity_weekdays, _public_station_k_tree, _public_station_df, _params=None,
+                      _workers=None, _keep_detail=True, _spatial_flow_cluster_dict=None):
+    """
+    Run the two-layer framework on the weekday ride records of one user and keep the results of every stage.
+    Unless _keep_detail is True, each stage is reduced to the summaries of its clusters as soon as the next stage has used it,
+    and the details of the ride records are released, so that no cluster object outlives the user.
+    Parameters:
+        _record_list (list): A list of the user's weekday ride records, where each record is a dictionary.
+        _activity_weekdays (int): The number of activity weekdays of the user.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used by the neighbour search of a heavy user, -1 or any other non-positive value means all the CPUs,
+            default is None, which clusters every user with the original functions.
+        _keep_detail (bool): Whether to keep the full cluster objects, e.g. for plotting, default is True.
+        _spatial_flow_cluster_dict (dict): The spatial flow clusters of the user if they were extracted elsewhere, e.g. by extract_compact_spatial_flow_cluster_objects,
+            in which case _record_list is not used and the spatiotemporal flow clusters are extracted with extract_heavy_user_spatiotemporal_flow_clusters, default is None.
+    Returns:
+        tuple: The spatial flow clusters, the spatiotemporal flow clusters, the candidate commuting flows and the daily commuting flow (None if no candidate commuting flow is identified) of the user.
+        The first three are dicts of objects if _keep_detail is True, otherwise lists of summaries.
+    """
+    _params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+    if _spatial_flow_cluster_dict is not None or (_workers is not None and len(_record_list) >= HEAVY_USER_RECORD_NUM):
+        # The heavy-user spatiotemporal flow clustering gives the same results and only vectorizes the large spatial flow clusters
+        if _spatial_flow_cluster_dict is None:
+            _spatial_flow_cluster_dict = extract_heavy_user_spatial_flow_clusters(
+                _record_list, _activity_weekdays, _size_coefficient=_params['size_coefficient'],
+                _max_circle_boundary_radius=_params['max_circle_boundary_radius'], _workers=_workers)
+        _spatiotemporal_flow_cluster_dict = extract_heavy_user_spatiotemporal_flow_clusters(
+            _spatial_flow_cluster_dict, _expansion_coefficient=_params['expansion_coefficient'],
+            _size_coefficient=_params['size_coefficient'],
+            _max_circle_boundary_radius=_params['max_circle_boundary_radius'])
+    else:
+        _spatial_flow_cluster_dict = extract_spatial_flow_clusters(
+            _record_list, _activity_weekdays, _size_coefficient=_params['size_coefficient'],
+            _max_circle_boundary_radius=_params['max_circle_boundary_radius'])
+        _spatiotemporal_flow_cluster_dict = extract_spatiotemporal_flow_clusters(
+            _spatial_flow_cluster_dict, _expansion_coefficient=_params['expansion_coefficient'],
+            _size_coefficient=_params['size_coefficient'],
+            _max_circle_boundary_radius=_params['max_circle_boundary_radius'])
+    if not _keep_detail:
+        _spatial_flow_cluster_dict = [_sfc_obj.to_summary(_with_record_uuid=False)
+                                      for _sfc_obj in _spatial_flow_cluster_dict.values()]
+        for _stfc_obj in _spatiotemporal_flow_cluster_dict.values():
+            _stfc_obj.release_record_detail()
+    _candidate_commuting_flow_dict = extract_candidate_commuting_flows(
+        _spatiotemporal_flow_cluster_dict, _public_station_k_tree, _public_station_df,
+        _boundary_circle_radius=_params['boundary_circle_radius'],
+        _working_hours_threshold=_params['working_hours_threshold'],
+        _transfer_distance_threshold=_params['transfer_distance_threshold'])
+    _dcf_obj = identify_user_commuting_category(_candidate_commuting_flow_dict) if _candidate_commuting_flow_dict else None
+    if not _keep_detail:
+        _spatiotemporal_flow_cluster_dict = [_stfc_obj.to_summary(_with_record_uuid=False)
+                                             for _stfc_obj in _spatiotemporal_flow_cluster_dict.values()]
+        for _cf_obj in _candidate_commuting_flow_dict.values():
+            _cf_obj.release_stfc()
+        _candidate_commuting_flow_dict = [_cf_obj.to_summary() for _cf_obj in _candidate_commuting_flow_dict.values()]
+    return _spatial_flow_cluster_dict, _spatiotemporal_flow_cluster_dict, _candidate_commuting_flow_dict, _dcf_obj
+
+
+def process_user_records(_record_list, _activity_weekdays, _public_station_k_tree, _public_station_df, _params=None,
+                         _workers=None, _cache=None):
+    """
+    Run the two-layer framework on the weekday ride records of one user.
+    Parameters:
+        _record_list (list): A list of the user's weekday ride records, where each record is a dictionary.
+        _activity_weekdays (int): The number of activity weekdays of the user.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used for a heavy user, default is None, which clusters every user serially.
+        _cache (UserResultCache): The cache of the results of unchanged users, default is None, which disables caching.
+    Returns:
+        DailyCommutingFlow: The daily commuting flow of the user, or None if no candidate commuting flow is identified.
+    """
+    _params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+    if _cache is not None:
+        _cache_key = _cache.make_key(_record_list, _activity_weekdays, _params)
+        _cached_result = _cache.get(_cache_key)
+        if _cached_result is not None:
+            return _cached_result['dcf']
+    _sfc_summary_list, _stfc_summary_list, _, _dcf_obj = run_user_pipeline(
+        _record_list, _activity_weekdays, _public_station_k_tree, _public_station_df, _params, _workers,
+        _keep_detail=False)
+    if _cache is not None:
+        _cache.put(_cache_key, _dcf_obj, _sfc_summary_list, _stfc_summary_list)
+    return _dcf_obj
+
+
+def process_all_users(_record_df, _public_station_k_tree, _public_station_df, _params=None, _workers=None,
+                      _debug=False, _unit_per_meter=None):
+    """
+    Run the two-layer framework on the ride records of all users in memory.
+    By default each stage of a user is reduced to the summaries of its clusters as soon as the next stage has used it,
+    so the memory kept per user is bounded by the summaries instead of the full clusters, though it still grows with the number of users;
+    the debug mode keeps the full cluster objects of every user, which are needed by the plotting functions.
+    Parameters:
+        _record_df (DataFrame): The ride records of all users.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used for a heavy user, default is None.
+        _debug (bool): Whether to keep the full cluster objects, default is False.
+        _unit_per_meter (int): The fixed-point unit of the compact storage, see compact_storage_fuc.CoordinateFrame, default is None, which uses the float records.
+            If given, the weekday ride records are kept in a CompactRecordTable and the spatial flow clusters are extracted from it,
+            which is approximate, while the spatiotemporal flow clustering and the decision trees run on the decoded ride records.
+    Returns:
+        dict: The results of each user, where the keys are uids and the values are dicts with the 'sfc', 'stfc', 'cf' and 'dcf' stages.
+    """
+    _params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(_record_df)
+    _each_user_result_dict = {}
+    if _unit_per_meter is not None and len(_weekday_record_df):
+        # compact_storage_fuc is only loaded by the compact storage mode
+        from compact_storage_fuc import CompactRecordTable, extract_compact_spatial_flow_cluster_objects
+        _compact_table = CompactRecordTable.from_df(_weekday_record_df, _unit_per_meter=_unit_per_meter)
+        for _uid in _weekday_record_df['uid'].unique():
+            _spatial_flow_cluster_dict = extract_compact_spatial_flow_cluster_objects(
+                _compact_table, _uid, _activity_weekdays_dict[_uid], _size_coefficient=_params['size_coefficient'],
+                _max_circle_boundary_radius=_params['max_circle_boundary_radius'])
+            _result = run_user_pipeline(None, _activity_weekdays_dict[_uid], _public_station_k_tree, _public_station_df,
+                                        _params, _workers, _keep_detail=_debug,
+                                        _spatial_flow_cluster_dict=_spatial_flow_cluster_dict)
+            _each_user_result_dict[_uid] = dict(zip(['sfc', 'stfc', 'cf', 'dcf'], _result))
+        return _each_user_result_dict
+    for _uid, _user_record_df in _weekday_record_df.groupby('uid', sort=False):
+        _result = run_user_pipeline(_user_record_df.to_dict(orient='records'), _activity_weekdays_dict[_uid],
+                                    _public_station_k_tree, _public_station_df, _params, _workers,
+                                    _keep_detail=_debug)
+        _each_user_result_dict[_uid] = dict(zip(['sfc', 'stfc', 'cf', 'dcf'], _result))
+    return _each_user_result_dict
+
+
+def select_weekday_records(_record_df):
+    """
+    Keep the weekday ride records and count the number of activity weekdays for each user.
+    Parameters:
+        _record_df (DataFrame): The ride records, including the uid and date fields.
+    Returns:
+        tuple: The weekday ride records and a dictionary of the number of activity weekdays for each uid.
+    """
+    # Each date is checked only once, since there are far fewer dates than records
+    _unique_date_list = _record_df['date'].unique()
+    _is_weekday_dict = dict(zip(_unique_date_list, [is_workday(_d) for _d in pd.to_datetime(_unique_date_list)]))
+    _weekday_record_df = _record_df[_record_df['date'].map(_is_weekday_dict).astype(bool)]
+    _activity_weekdays_dict = _weekday_record_df.groupby('uid')['date'].nunique().to_dict()
+    return _weekday_record_df, _activity_weekdays_dict
+
+
+def process_record_shard(_shard_path, _public_station_k_tree, _public_station_df, _params=None, _workers=None,
+                         _cache=None):
+    """
+    Identify the daily commuting flow of every user in a shard.
+    Parameters:
+        _shard_path (str): Path of the shard.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used for a heavy user, default is None.
+        _cache (UserResultCache): The cache of the results of unchanged users, default is None.
+    Returns:
+        DataFrame: One row per user with an identified daily commuting flow.
+    """
+    _shard_df = pd.read_csv(_shard_path, dtype=RECORD_COLUMN_DTYPES)
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(_shard_df)
+    del _shard_df
+    _dcf_record_list = []
+    for _uid, _user_record_df in _weekday_record_df.groupby('uid', sort=False):
+        _dcf_obj = process_user_records(_user_record_df.to_dict(orient='records'), _activity_weekdays_dict[_uid],
+                                        _public_station_k_tree, _public_station_df, _params, _workers, _cache)
+        if _dcf_obj is not None:
+            _dcf_record_list.append({'uid': _uid, **_dcf_obj.to_record()})
+    return pd.DataFrame(_dcf_record_list)
+
+
+def _get_shard_result_path(_result_dir, _shard_dir, _shard_path):
+    # Sub-shards live in sub-directories of the shard directory, so the relative path is flattened into a unique file name
+    return os.path.join(_result_dir, os.path.relpath(_shard_path, _shard_dir).replace(os.sep, '__'))
+
+
+def _write_csv_atomically(_df, _path):
+    # The file only appears under its final name once it is complete, so a crash never leaves a partial result behind
+    _temp_path = _path + '.tmp'
+    _df.to_csv(_temp_path, index=False)
+    os.replace(_temp_path, _path)
+
+
+def _concat_shard_results(_result_path_list, _output_path):
+    """
+    Concatenate the result files of the shards into the output file line by line without loading them into memory.
+    """
+    _temp_path = _output_path + '.tmp'
+    _header = None
+    with open(_temp_path, 'w', encoding='utf-8', newline='') as _output_file:
+        for _result_path in _result_path_list:
+            with open(_result_path, 'r', encoding='utf-8', newline='') as _result_file:
+                _this_header = _result_file.readline()
+                # A shard without any daily commuting flow is written as an empty file
+                if not _this_header.strip():
+                    continue
+                if _header is None:
+                    _header = _this_header
+                    _output_file.write(_header)
+                for _line in _result_file:
+                    _output_file.write(_line)
+    os.replace(_temp_path, _output_path)
+
+
+def _get_manifest_header(_input_path, _params):
+    """
+    Get the first line of the manifest, which records the input file and the parameters of the run, so that a working directory
+    is only resumed by a run on the same input with the same parameters.
+    """
+    _params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+    _stat = os.stat(_input_path)
+    return 'partitioned ' + json.dumps({
+        'input_path': os.path.abspath(_input_path), 'size': _stat.st_size, 'mtime_ns': _stat.st_mtime_ns,
+        'params_digest': hashlib.sha256(json.dumps(sorted(_params.items())).encode('utf-8')).hexdigest()}, sort_keys=True)
+
+
+def run_out_of_core_pipeline(_input_path, _work_dir, _output_path, _public_station_k_tree, _public_station_df,
+                             _shard_num=64, _chunk_size=500000, _max_memory_mb=1024, _params=None, _workers=None,
+                             _cache=None):
+    """
+    Identify the daily commuting flows of all users from raw records that do not fit in memory.
+    The raw records are partitioned into shards by uid, and the results of each shard are written to their own file in the working directory,
+    which is renamed into place before the shard is recorded as completed in the manifest. An interrupted run resumes from the first unfinished shard,
+    and a shard interrupted between the two steps is processed again and overwrites its result file, so no result is ever duplicated.
+    The manifest also records the path, size and modification time of the input file and a digest of the parameters, and resuming with
+    a different input file or different parameters raises a ValueError instead of returning the results of the previous run.
+    The output file is assembled from the result files of all the shards once every shard is completed.
+    Parameters:
+        _input_path (str): Path of the raw records, a CSV file or a Parquet file.
+        _work_dir (str): The directory where the shards, their results and the manifest are kept.
+        _output_path (str): Path of the output CSV file of the daily commuting flows.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _shard_num (int): The number of shards, default is 64.
+        _chunk_size (int): The number of records read at a time, default is 500000.
+        _max_memory_mb (float): The memory ceiling of processing one shard, in MB, default is 1024.
+        _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+        _workers (int): The number of threads used for a heavy user, default is None.
+        _cache (UserResultCache): The cache of the results of unchanged users, whose stale entries are evicted at the end of the run, default is None.
+    Returns:
+        str: Path of the output CSV file.
+    """
+    _manifest_path = os.path.join(_work_dir, _MANIFEST_NAME)
+    _shard_dir = os.path.join(_work_dir, 'shards')
+    _result_dir = os.path.join(_work_dir, _RESULT_DIR_NAME)
+    _manifest_header = _get_manifest_header(_input_path, _params)
+    if os.path.exists(_manifest_path):
+        with open(_manifest_path, 'r', encoding='utf-8') as _f:
+            _manifest_lines = _f.read().splitlines()
+        if not _manifest_lines or _manifest_lines[0] != _manifest_header:
+            raise ValueError(f'The working directory {_work_dir} belongs to a run on another input file or with other parameters, '
+                             f'expected the manifest header {_manifest_header!r} but got '
+                             f'{_manifest_lines[0] if _manifest_lines else ""!r}, use an empty working directory instead.')
+        _all_shard_path_list = [_line for _line in _manifest_lines[1:] if not _line.startswith('done ')]
+        _completed_shard_set = set(_line[len('done '):] for _line in _manifest_lines if _line.startswith('done '))
+    else:
+        _all_shard_path_list = partition_records_by_uid(_input_path, _shard_dir, _shard_num, _chunk_size)
+        _all_shard_path_list = split_oversized_shards(_all_shard_path_list, _max_memory_mb, _chunk_size)
+        _completed_shard_set = set()
+        os.makedirs(_result_dir, exist_ok=True)
+        # The first line marks that the partitioning has finished, followed by the shards to be processed
+        with open(_manifest_path, 'w', encoding='utf-8') as _f:
+            _f.write('\n'.join([_manifest_header] + _all_shard_path_list) + '\n')
+
+    for _shard_path in _all_shard_path_list:
+        if _shard_path in _completed_shard_set:
+            continue
+        _dcf_df = process_record_shard(_shard_path, _public_station_k_tree, _public_station_df, _params, _workers,
+                                       _cache)
+        _write_csv_atomically(_dcf_df, _get_shard_result_path(_result_dir, _shard_dir, _shard_path))
+        with open(_manifest_path, 'a', encoding='utf-8') as _f:
+            _f.write(f'done {_shard_path}\n')
+    _concat_shard_results([_get_shard_result_path(_result_dir, _shard_dir, _shard_path)
+                           for _shard_path in _all_shard_path_list], _output_path)
+    if _cache is not None:
+        _cache.evict()
+    return _output_path
@@ -0,0 +1,285 @@
+# encoding: utf-8
+# Cluster the flows pooled across all users to find city-wide cycling corridors, using the same spatial dissimilarity as
+# the individual spatial flow clustering, which follows the original population-level method of Gao et al.(2020):
+# https://doi.org/10.1109/ACCESS.2020.3040852
+
+import os
+import numpy as np
+import pandas as pd
+from spatial_flow_clustering_fuc import calculate_spatial_dissimilarity_array
+from out_of_core_processing_fuc import iter_record_chunks
+
+POPULATION_CLUSTER_COLUMNS = ['pfc_id', 'origin_x', 'origin_y', 'destination_x', 'destination_y', 'flow_num']
+
+
+def load_population_flows(_input_path, _chunk_size=500000):
+    """
+    Load the OD points of the ride records of all users, only reading the coordinate columns chunk by chunk.
+    All the flows are held in memory, about 32 bytes per flow, so the ride records of a whole city should be clustered with cluster_population_flows_from_file instead.
+    Parameters:
+        _input_path (str): Path of the raw records, a CSV file or a Parquet file.
+        _chunk_size (int): The number of records read at a time, default is 500000.
+    Returns:
+        tuple: The origins and destinations of all the flows, each with shape (n, 2).
+    """
+    _origin_chunk_list, _destination_chunk_list = [], []
+    for _chunk in iter_record_chunks(_input_path, _chunk_size,
+                                     ['origin_x', 'origin_y', 'destination_x', 'destination_y']):
+        _origin_chunk_list.append(_chunk[['origin_x', 'origin_y']].to_numpy(dtype=float))
+        _destination_chunk_list.append(_chunk[['destination_x', 'destination_y']].to_numpy(dtype=float))
+    if not _origin_chunk_list:
+        return np.empty((0, 2)), np.empty((0, 2))
+    return np.concatenate(_origin_chunk_list), np.concatenate(_destination_chunk_list)
+
+
+class _ActiveClusterState:
+    """
+    The sums and counts of the population flow clusters that can still receive flows, stored in reusable slots so that the memory is bounded by the number of active clusters.
+    Each active cluster is indexed by the tiles of its mean origin and destination.
+    """
+
+    def __init__(self, _tile_size, _capacity=1024):
+        self.tile_size = _tile_size
+        self.od_sum = np.zeros((_capacity, 4))
+        self.flow_num = np.zeros(_capacity, dtype=np.int64)
+        self.pfc_id = np.full(_capacity, -1, dtype=np.int64)
+        self.od_tile = {}
+        self.free_slot_list = list(range(_capacity - 1, -1, -1))
+        # origin tile x -> {(origin tile y, destination tile x, destination tile y): [slots]}
+        self.tile_index = {}
+
+    def get_mean_od(self, _slot_array):
+        return self.od_sum[_slot_array] / self.flow_num[_slot_array, None]
+
+    def get_tile(self, _mean_od):
+        return tuple(int(_t) for _t in np.floor(_mean_od / self.tile_size))
+
+    def register(self, _slot):
+        _tile = self.get_tile(self.get_mean_od(_slot))
+        self.od_tile[_slot] = _tile
+        self.tile_index.setdefault(_tile[0], {}).setdefault(_tile[1:], []).append(_slot)
+
+    def unregister(self, _slot):
+        _tile = self.od_tile.pop(_slot)
+        _slot_list = self.tile_index[_tile[0]][_tile[1:]]
+        _slot_list.remove(_slot)
+        if not _slot_list:
+            del self.tile_index[_tile[0]][_tile[1:]]
+
+    def create(self, _pfc_id, _od):
+        if not self.free_slot_list:
+            _capacity = len(self.flow_num)
+            self.od_sum = np.concatenate([self.od_sum, np.zeros((_capacity, 4))])
+            self.flow_num = np.concatenate([self.flow_num, np.zeros(_capacity, dtype=np.int64)])
+            self.pfc_id = np.concatenate([self.pfc_id, np.full(_capacity, -1, dtype=np.int64)])
+            self.free_slot_list = list(range(2 * _capacity - 1, _capacity - 1, -1))
+        _slot = self.free_slot_list.pop()
+        self.od_sum[_slot] = _od
+        self.flow_num[_slot] = 1
+        self.pfc_id[_slot] = _pfc_id
+        self.register(_slot)
+        return _slot
+
+    def update_tile(self, _slot):
+        if self.get_tile(self.get_mean_od(_slot)) != self.od_tile[_slot]:
+            self.unregister(_slot)
+            self.register(_slot)
+
+    def get_candidate_slot_array(self, _od_tile):
+        _candidate_slot_list = []
+        for _otx in range(_od_tile[0] - 1, _od_tile[0] + 2):
+            _sub_index = self.tile_index.get(_otx)
+            if not _sub_index:
+                continue
+            for _oty in range(_od_tile[1] - 1, _od_tile[1] + 2):
+                for _dtx in range(_od_tile[2] - 1, _od_tile[2] + 2):
+                    for _dty in range(_od_tile[3] - 1, _od_tile[3] + 2):
+                        _candidate_slot_list.extend(_sub_index.get((_oty, _dtx, _dty), ()))
+        return np.array(_candidate_slot_list, dtype=np.int64)
+
+    def flush(self, _max_origin_tile_x):
+        """
+        Release the clusters whose origin tile x is not larger than the given one and return their summaries.
+        """
+        _flushed_slot_list = []
+        for _otx in [_otx for _otx in self.tile_index.keys() if _otx <= _max_origin_tile_x]:
+            for _slot_list in self.tile_index.pop(_otx).values():
+                _flushed_slot_list.extend(_slot_list)
+        _flushed_slot_array = np.array(sorted(_flushed_slot_list, key=lambda _slot: self.pfc_id[_slot]), dtype=np.int64)
+        _summary = (self.pfc_id[_flushed_slot_array].copy(), self.get_mean_od(_flushed_slot_array),
+                    self.flow_num[_flushed_slot_array].copy())
+        for _slot in _flushed_slot_array:
+            del self.od_tile[_slot]
+            self.pfc_id[_slot] = -1
+            self.free_slot_list.append(_slot)
+        return _summary
+
+
+class _PopulationFlowSweep:
+    """
+    The sweep of cluster_population_flows, which is fed with the flows of whole origin x tiles in ascending order of the tiles,
+    so that the flows can be read from disk band by band while giving the same clusters as sweeping all the flows at once.
+    """
+
+    def __init__(self, _size_coefficient, _max_circle_boundary_radius, _min_flow_num, _flush_callback, _block_size):
+        self.size_coefficient = _size_coefficient
+        self.max_circle_boundary_radius = _max_circle_boundary_radius
+        self.min_flow_num = _min_flow_num
+        self.flush_callback = _flush_callback
+        self.block_size = _block_size
+        self.state = _ActiveClusterState(_max_circle_boundary_radius)
+        self.collected_cluster_df_list = []
+        self.next_pfc_id = 0
+        self.current_origin_tile_x = None
+
+    def release(self, _max_origin_tile_x):
+        _pfc_id_array, _mean_od_array, _flow_num_array = self.state.flush(_max_origin_tile_x)
+        _keep = _flow_num_array >= self.min_flow_num
+        if not _keep.any():
+            return
+        _cluster_df = pd.DataFrame(_mean_od_array[_keep], columns=POPULATION_CLUSTER_COLUMNS[1:5])
+        _cluster_df.insert(0, 'pfc_id', _pfc_id_array[_keep])
+        _cluster_df['flow_num'] = _flow_num_array[_keep]
+        if self.flush_callback is None:
+            self.collected_cluster_df_list.append(_cluster_df)
+        else:
+            self.flush_callback(_cluster_df)
+
+    def add_flows(self, _od_array):
+        """
+        Cluster a band of flows with shape (n, 4), which must hold all the flows of its origin x tiles, and return their population flow cluster IDs.
+        """
+        _label_array = np.full(len(_od_array), -1, dtype=np.int64)
+        if len(_od_array) == 0:
+            return _label_array
+        _state = self.state
+        _size_coefficient, _max_circle_boundary_radius = self.size_coefficient, self.max_circle_boundary_radius
+        _length_array = np.sqrt((_od_array[:, 0] - _od_array[:, 2]) ** 2 + (_od_array[:, 1] - _od_array[:, 3]) ** 2)
+        _tile_array = np.floor(_od_array / _max_circle_boundary_radius).astype(np.int64)
+        _sorted_index = np.lexsort((_tile_array[:, 3], _tile_array[:, 2], _tile_array[:, 1], _tile_array[:, 0]))
+        # Flows with the same OD tiles are processed as one group
+        _sorted_tile_array = _tile_array[_sorted_index]
+        _group_start_array = np.flatnonzero(np.r_[True, np.any(_sorted_tile_array[1:] != _sorted_tile_array[:-1], axis=1)])
+        _group_end_array = np.r_[_group_start_array[1:], len(_sorted_index)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for _group_start, _group_end in zip(_group_start_array, _group_end_array):
+                _od_tile = tuple(int(_t) for _t in _sorted_tile_array[_group_start])
+                if self.current_origin_tile_x is not None and _od_tile[0] > self.current_origin_tile_x:
+                    self.release(_od_tile[0] - 2)
+                self.current_origin_tile_x = _od_tile[0]
+                for _block_start in range(_group_start, _group_end, self.block_size):
+                    _flow_index = _sorted_index[_block_start:min(_block_start + self.block_size, _group_end)]
+                    _unassigned_flow_index = _flow_index
+                    # Score the whole block against the existing clusters at once
+                    _candidate_slot_array = _state.get_candidate_slot_array(_od_tile)
+                    if len(_candidate_slot_array) > 0:
+                        _candidate_od = _state.get_mean_od(_candidate_slot_array)
+                        _candidate_length = np.sqrt((_candidate_od[:, 0] - _candidate_od[:, 2]) ** 2 +
+                                                    (_candidate_od[:, 1] - _candidate_od[:, 3]) ** 2)
+                        _flows_sd = calculate_spatial_dissimilarity_array(
+                            _od_array[_flow_index, None, :2], _od_array[_flow_index, None, 2:], _length_array[_flow_index, None],
+                            _candidate_od[:, :2], _candidate_od[:, 2:], _candidate_length, _size_coefficient,
+                            _max_circle_boundary_radius)
+                        _flows_sd = np.where(np.isnan(_flows_sd), np.inf, _flows_sd)
+                        _best_position = np.argmin(_flows_sd, axis=1)
+                        _is_assigned = _flows_sd[np.arange(len(_flow_index)), _best_position] <= 1
+                        _assigned_slot_array = _candidate_slot_array[_best_position[_is_assigned]]
+                        np.add.at(_state.od_sum, _assigned_slot_array, _od_array[_flow_index[_is_assigned]])
+                        np.add.at(_state.flow_num, _assigned_slot_array, 1)
+                        _label_array[_flow_index[_is_assigned]] = _state.pfc_id[_assigned_slot_array]
+                        for _slot in np.unique(_assigned_slot_array):
+                            _state.update_tile(_slot)
+                        _unassigned_flow_index = _flow_index[~_is_assigned]
+                    # The remaining flows are clustered one by one among the clusters created in this block
+                    _new_slot_list = []
+                    for _index in _unassigned_flow_index:
+                        if _new_slot_list:
+                            _new_slot_array = np.array(_new_slot_list, dtype=np.int64)
+                            _new_od = _state.get_mean_od(_new_slot_array)
+                            _new_length = np.sqrt((_new_od[:, 0] - _new_od[:, 2]) ** 2 + (_new_od[:, 1] - _new_od[:, 3]) ** 2)
+                            _flows_sd = calculate_spatial_dissimilarity_array(
+                                _od_array[_index, :2], _od_array[_index, 2:], _length_array[_index], _new_od[:, :2],
+                                _new_od[:, 2:], _new_length, _size_coefficient, _max_circle_boundary_radius)
+                            _flows_sd = np.where(np.isnan(_flows_sd), np.inf, _flows_sd)
+                            _best_position = int(np.argmin(_flows_sd))
+                            if _flows_sd[_best_position] <= 1:
+                                _slot = _new_slot_list[_best_position]
+                                _state.od_sum[_slot] += _od_array[_index]
+                                _state.flow_num[_slot] += 1
+                                _label_array[_index] = _state.pfc_id[_slot]
+                                _state.update_tile(_slot)
+                                continue
+                        _new_slot_list.append(_state.create(self.next_pfc_id, _od_array[_index]))
+                        _label_array[_index] = self.next_pfc_id
+                        self.next_pfc_id += 1
+        return _label_array
+
+    def finish(self):
+        """
+        Release all the remaining clusters and return the collected ones.
+        """
+        self.release(np.iinfo(np.int64).max)
+        if self.collected_cluster_df_list:
+            _population_flow_cluster_df = pd.concat(self.collected_cluster_df_list, ignore_index=True)
+            return _population_flow_cluster_df.sort_values('pfc_id', ignore_index=True)
+        return pd.DataFrame(columns=POPULATION_CLUSTER_COLUMNS)
+
+
+def cluster_population_flows(_origin_array, _destination_array, _size_coefficient=0.3, _max_circle_boundary_radius=200,
+                             _min_flow_num=2, _flush_callback=None, _block_size=4096):
+    """
+    Cluster the flows of all users into population flow clusters in one pass.
+    The flows are sorted by the tiles of their OD points, with the tile size equal to the maximum circle boundary radius, so a flow can only be merged into the clusters in the neighbouring OD tiles.
+    Each flow joins the least dissimilar cluster whose spatial dissimilarity, as defined by calculate_spatial_dissimilarity, is not larger than 1, otherwise it creates a new cluster.
+    Clusters are released as soon as the sweep along the origin x tiles has passed them, so only a narrow band of clusters is kept in memory.
+    The flows themselves are held in memory, see cluster_population_flows_from_file for the flows that do not fit in memory.
+    Parameters:
+        _origin_array, _destination_array (ndarray): The OD points of the flows, each with shape (n, 2).
+        _size_coefficient (float): The size coefficient used to calculate the circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the circle boundary radius and the tile size, default is 200.
+        _min_flow_num (int): The minimum number of flows of a population flow cluster to be reported, default is 2.
+        _flush_callback (callable): Called with a DataFrame of the released clusters, e.g. to append them to a file; if None, all the clusters are collected and returned.
+        _block_size (int): The maximum number of flows scored together against the candidate clusters, default is 4096.
+    Returns:
+        tuple: A DataFrame of the population flow clusters (empty when _flush_callback is given or there is no flow) and the population flow cluster ID of each flow.
+    """
+    _od_array = np.hstack([np.reshape(_origin_array, (-1, 2)), np.reshape(_destination_array, (-1, 2))]).astype(float)
+    _sweep = _PopulationFlowSweep(_size_coefficient, _max_circle_boundary_radius, _min_flow_num, _flush_callback,
+                                  _block_size)
+    _label_array = _sweep.add_flows(_od_array)
+    return _sweep.finish(), _label_array
+
+
+def cluster_population_flows_from_file(_input_path, _work_dir, _size_coefficient=0.3, _max_circle_boundary_radius=200,
+                                       _min_flow_num=2, _flush_callback=None, _block_size=4096, _chunk_size=500000,
+                                       _band_tile_num=50):
+    """
+    Cluster the flows of all users stored in a file that does not fit in memory, which gives the same population flow clusters as cluster_population_flows.
+    The OD points are partitioned in one streaming pass into on-disk bands of _band_tile_num origin x tiles, and the bands are swept in ascending order,
+    so only one band of flows and the active clusters are kept in memory.
+    Parameters:
+        _input_path (str): Path of the raw records, a CSV file or a Parquet file.
+        _work_dir (str): The directory where the bands are written, any existing band in it is overwritten.
+        _size_coefficient, _max_circle_boundary_radius, _min_flow_num, _flush_callback, _block_size: See cluster_population_flows.
+        _chunk_size (int): The number of records read at a time, default is 500000.
+        _band_tile_num (int): The number of origin x tiles in each band, default is 50, i.e. 10 km with the default tile size.
+    Returns:
+        DataFrame: The population flow clusters, empty when _flush_callback is given or there is no flow.
+    """
+    os.makedirs(_work_dir, exist_ok=True)
+    _band_path_dict = {}
+    for _chunk in iter_record_chunks(_input_path, _chunk_size, ['origin_x', 'origin_y', 'destination_x', 'destination_y']):
+        _od_array = _chunk[['origin_x', 'origin_y', 'destination_x', 'destination_y']].to_numpy(dtype=np.float64)
+        _band_array = np.floor(_od_array[:, 0] / _max_circle_boundary_radius).astype(np.int64) // _band_tile_num
+        for _band in np.unique(_band_array):
+            _band_path = os.path.join(_work_dir, f'band_{_band}.bin')
+            # The flows are appended in the order of the file, which keeps the order of the flows within each OD tile
+            with open(_band_path, 'ab' if _band in _band_path_dict else 'wb') as _f:
+                _od_array[_band_array == _band].tofile(_f)
+            _band_path_dict[_band] = _band_path
+    _sweep = _PopulationFlowSweep(_size_coefficient, _max_circle_boundary_radius, _min_flow_num, _flush_callback,
+                                  _block_size)
+    for _band in sorted(_band_path_dict.keys()):
+        _sweep.add_flows(np.fromfile(_band_path_dict[_band], dtype=np.float64).reshape(-1, 4))
+        os.remove(_band_path_dict[_band])
+    return _sweep.finish()
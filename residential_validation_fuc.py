@@ -0,0 +1,95 @@
+# encoding: utf-8
+# Validate the identified home and work locations by their proximity to the actual residential land boundaries
+
+import json
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from shapely.geometry import shape
+
+LOCATION_TYPE_LIST = ['home_location', 'work_location']
+
+
+def wgs84_to_webmercator_array(_coord_array):
+    """
+    Convert an array of coordinates from the WGS84 coordinate system to the Web Mercator coordinate system, which is the vectorized version of utils.wgs84_to_webmercator.
+    Parameters:
+        _coord_array (ndarray): Longitudes and latitudes, with shape (n, 2).
+    Returns:
+        ndarray: x and y coordinates in the Web Mercator coordinate system, with shape (n, 2).
+    """
+    _x = _coord_array[:, 0] * 20037508.342789 / 180
+    _y = np.log(np.tan((90 + _coord_array[:, 1]) * np.pi / 360)) / (np.pi / 180)
+    _y = _y * 20037508.34789 / 180
+    return np.column_stack([_x, _y])
+
+
+def load_land_use_polygons(_land_use_path, _land_use_field=None, _residential_value_list=None, _is_wgs84=True):
+    """
+    Load the residential land polygons from a local file.
+    Parameters:
+        _land_use_path (str): Path of the land use file. GeoJSON is read directly, other formats such as Shapefile require geopandas.
+        _land_use_field (str): The attribute field of the land use type, default is None, which keeps all the polygons.
+        _residential_value_list (list): The values of _land_use_field that represent residential land, required if and only if _land_use_field is given, default is None.
+        _is_wgs84 (bool): Whether the polygons are in the WGS84 coordinate system and need to be converted to Web Mercator, default is True.
+    Returns:
+        ndarray: The residential land polygons in the Web Mercator coordinate system.
+    """
+    if (_land_use_field is None) != (_residential_value_list is None):
+        raise ValueError('land_use_field and residential_value_list must be given together, '
+                         f'got {_land_use_field!r} and {_residential_value_list!r}')
+    if _land_use_path.endswith('.geojson') or _land_use_path.endswith('.json'):
+        with open(_land_use_path, 'r', encoding='utf-8') as _f:
+            _feature_list = json.load(_f)['features']
+        _polygon_list = [shape(_feature['geometry']) for _feature in _feature_list
+                         if _land_use_field is None or _feature['properties'].get(_land_use_field) in _residential_value_list]
+        _polygon_array = np.array(_polygon_list, dtype=object)
+    else:
+        # geopandas is only required for the land use formats other than GeoJSON
+        import geopandas as gpd
+        _land_use_gdf = gpd.read_file(_land_use_path)
+        if _land_use_field is not None:
+            _land_use_gdf = _land_use_gdf[_land_use_gdf[_land_use_field].isin(_residential_value_list)]
+        _polygon_array = _land_use_gdf.geometry.to_numpy()
+    if _is_wgs84:
+        _polygon_array = shapely.transform(_polygon_array, wgs84_to_webmercator_array)
+    return _polygon_array
+
+
+def validate_commuting_locations(_dcf_df, _residential_polygon_array, _distance_threshold_list=(50, 100, 200)):
+    """
+    Check whether the identified home and work locations of all users fall within or near the residential land, with bulk queries on an STRtree.
+    Parameters:
+        _dcf_df (DataFrame): The daily commuting flows of all users, as returned by build_daily_commuting_flow_df.
+        _residential_polygon_array (ndarray): The residential land polygons in the Web Mercator coordinate system.
+        _distance_threshold_list (tuple): The distances (m) to the nearest residential land within which a location is regarded as a hit, default is (50, 100, 200).
+    Returns:
+        tuple: A DataFrame of the containment and the nearest distance of each location, and a DataFrame of the hit rates by commuting category and location type.
+    """
+    _residential_tree = STRtree(_residential_polygon_array)
+    _location_df_list = []
+    for _location_type in LOCATION_TYPE_LIST:
+        _location_df = _dcf_df.loc[_dcf_df[f'{_location_type}_x'].notna(), ['uid', 'commuting_category']].copy()
+        _location_df['location_type'] = _location_type
+        _point_array = shapely.points(_dcf_df.loc[_location_df.index, f'{_location_type}_x'].to_numpy(dtype=float),
+                                      _dcf_df.loc[_location_df.index, f'{_location_type}_y'].to_numpy(dtype=float))
+        _is_within = np.zeros(len(_point_array), dtype=bool)
+        _nearest_distance = np.full(len(_point_array), np.nan)
+        if len(_point_array) > 0 and len(_residential_polygon_array) > 0:
+            _is_within[_residential_tree.query(_point_array, predicate='within')[0]] = True
+            (_point_index, _), _distance = _residential_tree.query_nearest(_point_array, return_distance=True,
+                                                                           all_matches=False)
+            _nearest_distance[_point_index] = _distance
+        _location_df['is_within_residential'] = _is_within
+        _location_df['nearest_residential_distance'] = _nearest_distance
+        _location_df_list.append(_location_df)
+    _location_df = pd.concat(_location_df_list, ignore_index=True)
+
+    _aggregation_dict = {'location_num': ('uid', 'size'), 'within_rate': ('is_within_residential', 'mean'),
+                         'median_distance': ('nearest_residential_distance', 'median')}
+    for _distance_threshold in _distance_threshold_list:
+        _location_df[f'is_within_{_distance_threshold}m'] = _location_df['nearest_residential_distance'] <= _distance_threshold
+        _aggregation_dict[f'within_{_distance_threshold}m_rate'] = (f'is_within_{_distance_threshold}m', 'mean')
+    _hit_rate_df = _location_df.groupby(['commuting_category', 'location_type']).agg(**_aggregation_dict).reset_index()
+    return _location_df, _hit_rate_df
@@ -0,0 +1,134 @@
+# encoding: utf-8
+# Cache the results of each user on disk, keyed by the content of his/her ride records and the parameters,
+# so that a rerun only pays for the users whose inputs have changed
+
+import os
+import time
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+# Bump this version when a change of the code changes the results, so that all the existing entries become stale.
+# Version 2 keys the ride records in the order they are clustered instead of sorted by uuid
+CACHE_VERSION = 2
+
+# The fields of a ride record that affect the results
+_RECORD_KEY_FIELDS = ['uuid', 'origin_x', 'origin_y', 'destination_x', 'destination_y', 'date', 'start_time', 'end_time']
+
+
+class UserResultCache:
+    def __init__(self, _cache_dir, _public_station_df=None, _max_size_mb=None, _max_age_days=None):
+        """
+        Parameters:
+            _cache_dir (str): The directory of the cache.
+            _public_station_df (DataFrame): The public transport stations used to identify transfers, which are part of the key of every entry, default is None.
+            _max_size_mb (float): The maximum total size of the cache, the least recently used entries are evicted beyond it, default is None.
+            _max_age_days (float): The maximum number of days since an entry was last used, default is None.
+        """
+        self.cache_dir = _cache_dir
+        self.max_size_mb = _max_size_mb
+        self.max_age_days = _max_age_days
+        if _public_station_df is None:
+            self.station_digest = ''
+        else:
+            self.station_digest = hashlib.sha256(
+                pd.util.hash_pandas_object(_public_station_df, index=True).to_numpy().tobytes()).hexdigest()
+        self.stats = {'hit': 0, 'miss': 0, 'write': 0, 'evict': 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, _record_list, _activity_weekdays, _params):
+        """
+        Make the key of a user from his/her ride records in the order they are clustered and the parameters.
+        The greedy spatial and spatiotemporal flow clustering depends on the order of the ride records,
+        so the same ride records in another order are another key rather than a hit on a result they would not produce.
+        Parameters:
+            _record_list (list): A list of the user's weekday ride records in the order they are clustered, where each record is a dictionary.
+            _activity_weekdays (int): The number of activity weekdays of the user.
+            _params (dict): The clustering and decision-tree parameters.
+        Returns:
+            str: The hexadecimal SHA-256 digest.
+        """
+        _hash = hashlib.sha256()
+        _hash.update(json.dumps([CACHE_VERSION, self.station_digest, int(_activity_weekdays),
+                                 sorted(_params.items())]).encode('utf-8'))
+        for _record in _record_list:
+            _hash.update('\x1f'.join(str(_record[_field]) for _field in _RECORD_KEY_FIELDS).encode('utf-8'))
+            _hash.update(b'\x1e')
+        return _hash.hexdigest()
+
+    def _get_path(self, _key):
+        return os.path.join(self.cache_dir, _key[:2], f'{_key}.pkl')
+
+    def get(self, _key):
+        """
+        Get the cached result of a key.
+        Returns:
+            dict: The daily commuting flow ('dcf') and the summaries of the spatial and spatiotemporal flow clusters ('sfc' and 'stfc'), or None on a miss.
+        """
+        _path = self._get_path(_key)
+        try:
+            with open(_path, 'rb') as _f:
+                _result = pickle.load(_f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError):
+            # A missing entry, or a broken one that is overwritten by the next put
+            self.stats['miss'] += 1
+            return None
+        # Touch the entry so that the eviction by age and size follows the last use
+        os.utime(_path)
+        self.stats['hit'] += 1
+        return _result
+
+    def put(self, _key, _dcf_obj, _sfc_summary_list, _stfc_summary_list):
+        """
+        Cache the daily commuting flow and the summaries of the flow clusters of a user.
+        """
+        _result = {'dcf': _dcf_obj, 'sfc': _sfc_summary_list, 'stfc': _stfc_summary_list}
+        _path = self._get_path(_key)
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        # Write to a temporary file first so that an interrupted write never leaves a broken entry
+        _temp_path = f'{_path}.{os.getpid()}.tmp'
+        with open(_temp_path, 'wb') as _f:
+            pickle.dump(_result, _f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(_temp_path, _path)
+        self.stats['write'] += 1
+
+    def evict(self):
+        """
+        Evict the entries unused for more than max_age_days, then the least recently used entries until the cache is within max_size_mb.
+        Returns:
+            int: The number of evicted entries.
+        """
+        _entry_list = []
+        for _root, _, _file_name_list in os.walk(self.cache_dir):
+            for _file_name in _file_name_list:
+                if _file_name.endswith('.pkl'):
+                    _path = os.path.join(_root, _file_name)
+                    _stat = os.stat(_path)
+                    _entry_list.append((_stat.st_mtime, _stat.st_size, _path))
+        _entry_list.sort()
+        _evicted_path_list = []
+        if self.max_age_days is not None:
+            _expired_time = time.time() - self.max_age_days * 86400
+            _evicted_path_list = [_path for _mtime, _, _path in _entry_list if _mtime < _expired_time]
+            _entry_list = [_entry for _entry in _entry_list if _entry[0] >= _expired_time]
+        if self.max_size_mb is not None:
+            _total_size = sum(_size for _, _size, _ in _entry_list)
+            for _, _size, _path in _entry_list:
+                if _total_size <= self.max_size_mb * 1024 * 1024:
+                    break
+                _evicted_path_list.append(_path)
+                _total_size -= _size
+        for _path in _evicted_path_list:
+            os.remove(_path)
+        self.stats['evict'] += len(_evicted_path_list)
+        return len(_evicted_path_list)
+
+    def report(self):
+        """
+        Report the hit and miss statistics of the cache.
+        Returns:
+            dict: The numbers of hits, misses, writes and evictions, and the hit rate.
+        """
+        _lookup_num = self.stats['hit'] + self.stats['miss']
+        return {**self.stats, 'hit_rate': self.stats['hit'] / _lookup_num if _lookup_num else 0.0}
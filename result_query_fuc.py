@@ -0,0 +1,205 @@
+# encoding: utf-8
+# Query the daily commuting flows and flow clusters of all users in milliseconds through in-memory indexes,
+# optionally exposed by a local HTTP server
+
+import json
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from columnar_decision_tree_fuc import time_str_to_hour
+
+SPATIAL_INDEX_FIELD_LIST = ['home_location', 'work_location', 'to_transit_location', 'from_transit_location']
+TIME_INDEX_FIELD_LIST = ['moment_leave_home', 'moment_leave_work']
+# Riding to the station happens after leaving home, and riding back to the station happens after leaving work
+_TRANSFER_DIRECTION_DICT = {'to_transit': 'moment_leave_home', 'from_transit': 'moment_leave_work'}
+
+
+def _df_to_json_records(_df):
+    return _df.astype(object).where(_df.notna(), None).to_dict(orient='records')
+
+
+class CommutingResultIndex:
+    def __init__(self, _dcf_df, _each_user_result_dict=None):
+        """
+        Build the indexes over the results of the pipeline.
+        Parameters:
+            _dcf_df (DataFrame): The daily commuting flows of all users, as returned by build_daily_commuting_flow_df or identify_commuting_category_table, or read from the output of run_out_of_core_pipeline.
+            _each_user_result_dict (dict): The results of each user returned by process_all_users, used to show the clusters of a user, default is None.
+        """
+        self.dcf_df = _dcf_df.reset_index(drop=True)
+        self.each_user_result_dict = {} if _each_user_result_dict is None else _each_user_result_dict
+        # Hash indexes
+        self.uid_index = pd.Series(np.arange(len(self.dcf_df)), index=self.dcf_df['uid']).groupby(level=0).first().to_dict()
+        self.station_index = {}
+        for _direction in _TRANSFER_DIRECTION_DICT.keys():
+            _station_series = self.dcf_df[f'{_direction}_station_id'].dropna()
+            self.station_index[_direction] = {_station_id: _row_array.to_numpy() for _station_id, _row_array in
+                                              pd.Series(_station_series.index, index=_station_series.values).groupby(level=0)}
+        # Spatial indexes, which only hold the users with the given location
+        self.spatial_index = {}
+        for _field in SPATIAL_INDEX_FIELD_LIST:
+            _location_df = self.dcf_df[[f'{_field}_x', f'{_field}_y']].dropna()
+            _point_array = _location_df.to_numpy(dtype=float)
+            self.spatial_index[_field] = (cKDTree(_point_array) if len(_point_array) else None, _location_df.index.to_numpy(),
+                                          _point_array)
+        # Sorted time indexes of the hours of the day
+        self.time_index = {}
+        for _field in TIME_INDEX_FIELD_LIST:
+            _time_series = self.dcf_df[_field].dropna()
+            _hour_array = time_str_to_hour(_time_series) if len(_time_series) else np.array([])
+            _order = np.argsort(_hour_array, kind='stable')
+            self.time_index[_field] = (_hour_array[_order], _time_series.index.to_numpy()[_order])
+
+    def _get_rows(self, _row_array):
+        return self.dcf_df.iloc[np.sort(np.asarray(_row_array, dtype=np.int64))]
+
+    def _query_time_rows(self, _field, _start_hour, _end_hour):
+        _hour_array, _row_array = self.time_index[_field]
+        if _start_hour <= _end_hour:
+            return _row_array[np.searchsorted(_hour_array, _start_hour, 'left'):np.searchsorted(_hour_array, _end_hour, 'right')]
+        # The time window spans midnight
+        return np.concatenate([_row_array[np.searchsorted(_hour_array, _start_hour, 'left'):],
+                               _row_array[:np.searchsorted(_hour_array, _end_hour, 'right')]])
+
+    def get_user(self, _uid):
+        """
+        Get the daily commuting flow and, if available, the flow clusters of a user.
+        Returns:
+            dict: The 'dcf' record and the 'sfc', 'stfc' and 'cf' results of the user, or None if the user is unknown.
+        """
+        if _uid not in self.uid_index and _uid not in self.each_user_result_dict:
+            return None
+        _user_result = {'dcf': None}
+        if _uid in self.uid_index:
+            _user_result['dcf'] = _df_to_json_records(self.dcf_df.iloc[[self.uid_index[_uid]]])[0]
+        _stage_result = self.each_user_result_dict.get(_uid, {})
+        for _stage in ['sfc', 'stfc', 'cf']:
+            _value = _stage_result.get(_stage)
+            # The full cluster objects of the debug mode are summarized in the same form as the summary-only mode
+            if isinstance(_value, dict):
+                _value = [_obj.to_summary() for _obj in _value.values()]
+            _user_result[_stage] = _value
+        return _user_result
+
+    def query_by_time(self, _field, _start_hour, _end_hour):
+        """
+        Get the users whose moment_leave_home or moment_leave_work falls in a time window, which may span midnight.
+        """
+        return self._get_rows(self._query_time_rows(_field, _start_hour, _end_hour))
+
+    def query_station_transfers(self, _station_id, _start_hour=None, _end_hour=None, _direction=None):
+        """
+        Get the users who transfer at a public transport station, optionally within a time window.
+        Parameters:
+            _station_id (str): The ID of the station, e.g. the pid of a metro entrance.
+            _start_hour, _end_hour (float): The time window in hours of the day, compared with moment_leave_home for riding to the station and with moment_leave_work for riding from the station, default is None.
+            _direction (str): 'to_transit' or 'from_transit', default is None, which includes both.
+        Returns:
+            DataFrame: The daily commuting flows of the users.
+        """
+        _row_array_list = []
+        for _this_direction, _time_field in _TRANSFER_DIRECTION_DICT.items():
+            if _direction is not None and _direction != _this_direction:
+                continue
+            _row_array = self.station_index[_this_direction].get(_station_id, np.array([], dtype=np.int64))
+            if _start_hour is not None and _end_hour is not None:
+                _row_array = np.intersect1d(_row_array, self._query_time_rows(_time_field, _start_hour, _end_hour))
+            _row_array_list.append(_row_array)
+        return self._get_rows(np.unique(np.concatenate(_row_array_list)) if _row_array_list else [])
+
+    def query_near_point(self, _field, _x, _y, _radius):
+        """
+        Get the users whose given location is within a radius (m) of a point in the Web Mercator coordinate system.
+        """
+        _tree, _row_array, _ = self.spatial_index[_field]
+        if _tree is None:
+            return self._get_rows([])
+        return self._get_rows(_row_array[_tree.query_ball_point([_x, _y], _radius)])
+
+    def query_near_polygon(self, _field, _polygon, _distance=0):
+        """
+        Get the users whose given location is within a distance (m) of a polygon in the Web Mercator coordinate system.
+        The candidates are taken from the k-d tree around the bounding circle of the polygon and then checked exactly.
+        """
+        _tree, _row_array, _point_array = self.spatial_index[_field]
+        if _tree is None:
+            return self._get_rows([])
+        _min_x, _min_y, _max_x, _max_y = _polygon.bounds
+        _candidate_index = np.array(_tree.query_ball_point(
+            [(_min_x + _max_x) / 2, (_min_y + _max_y) / 2],
+            np.hypot(_max_x - _min_x, _max_y - _min_y) / 2 + _distance), dtype=np.int64)
+        if len(_candidate_index) == 0:
+            return self._get_rows([])
+        import shapely
+        _candidate_point = shapely.points(_point_array[_candidate_index])
+        _is_near = shapely.distance(_candidate_point, _polygon) <= _distance
+        return self._get_rows(_row_array[_candidate_index[_is_near]])
+
+
+def make_result_query_server(_result_index, _host='127.0.0.1', _port=8765):
+    """
+    Create a local HTTP server that answers the queries of a CommutingResultIndex as JSON, without starting it.
+    Endpoints:
+        /user?uid=...
+        /time?field=moment_leave_home&start=7&end=9
+        /station?id=...&start=7&end=9&direction=to_transit
+        /near?field=home_location&x=...&y=...&radius=500
+        /polygon?field=home_location&wkt=POLYGON((...))&distance=500
+    Parameters:
+        _result_index (CommutingResultIndex): The indexes to be served.
+        _host (str): The host to bind, default is '127.0.0.1', which only accepts local connections.
+        _port (int): The port to bind, default is 8765, and 0 picks a free port, which is then given by server_address.
+    Returns:
+        ThreadingHTTPServer: The server, which is started with serve_forever and stopped with shutdown.
+    """
+
+    import shapely
+
+    class _ResultQueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            _url = urlparse(self.path)
+            _query = {_k: _v[0] for _k, _v in parse_qs(_url.query).items()}
+            _optional_float = lambda _k: float(_query[_k]) if _k in _query else None
+            try:
+                if _url.path == '/user':
+                    _result = _result_index.get_user(_query['uid'])
+                elif _url.path == '/time':
+                    _result = _df_to_json_records(_result_index.query_by_time(
+                        _query['field'], float(_query['start']), float(_query['end'])))
+                elif _url.path == '/station':
+                    _result = _df_to_json_records(_result_index.query_station_transfers(
+                        _query['id'], _optional_float('start'), _optional_float('end'), _query.get('direction')))
+                elif _url.path == '/near':
+                    _result = _df_to_json_records(_result_index.query_near_point(
+                        _query['field'], float(_query['x']), float(_query['y']), float(_query['radius'])))
+                elif _url.path == '/polygon':
+                    _result = _df_to_json_records(_result_index.query_near_polygon(
+                        _query['field'], shapely.from_wkt(_query['wkt']), float(_query.get('distance', 0))))
+                else:
+                    self.send_error(404, 'unknown endpoint')
+                    return
+            except (KeyError, ValueError, shapely.errors.GEOSException) as _e:
+                self.send_error(400, str(_e))
+                return
+            _body = json.dumps(_result).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(_body)))
+            self.end_headers()
+            self.wfile.write(_body)
+
+    return ThreadingHTTPServer((_host, _port), _ResultQueryHandler)
+
+
+def serve_result_index(_result_index, _host='127.0.0.1', _port=8765):
+    """
+    Serve the queries of a CommutingResultIndex as JSON over a local HTTP server, until interrupted. See make_result_query_server for the endpoints.
+    Parameters:
+        _result_index (CommutingResultIndex): The indexes to be served.
+        _host (str): The host to bind, default is '127.0.0.1', which only accepts local connections.
+        _port (int): The port to bind, default is 8765.
+    """
+    with make_result_query_server(_result_index, _host, _port) as _server:
+        _server.serve_forever()
@@ -1,8 +1,6 @@
 # encoding: utf-8
 # Visualizing the results of spatial flow clusters, spatiotemporal flow clusters and daily commuting flows
 
-import folium
-from folium.plugins import AntPath, Fullscreen
 from utils import webmercator_to_wgs84, get_distance
 from spatial_flow_clustering_fuc import SpatialClusterFlow
 from spatiotemporal_flow_clustering_fuc import SpatioTemporalFlowCluster
@@ -32,6 +30,13 @@ _html_template = '''
 </div>'''
 
 
+def _load_folium():
+    # folium is only loaded when a map is first drawn, so that the headless runs never pay for it
+    import folium
+    from folium.plugins import AntPath, Fullscreen
+    return folium, AntPath, Fullscreen
+
+
 def plot_sfc_obj(_sfc_obj, _uid='Test'):
     """
     Plot the origin and destination of a SpatialClusterFlow object on a folium map, along with related flow information.
@@ -44,6 +49,7 @@ def plot_sfc_obj(_sfc_obj, _uid='Test'):
         TypeError: If _sfc_obj is not an instance of SpatialClusterFlow.
     """
     if isinstance(_sfc_obj, SpatialClusterFlow):
+        folium, AntPath, Fullscreen = _load_folium()
         _wgs84_sfc_origin = webmercator_to_wgs84(
             *_sfc_obj.origin)
         _wgs84_sfc_destination = webmercator_to_wgs84(
@@ -109,6 +115,7 @@ def plot_stfc_obj(_stfc_obj, _uid='Test'):
         TypeError: If _stfc_obj is not an instance of SpatioTemporalFlowCluster.
     """
     if isinstance(_stfc_obj, SpatioTemporalFlowCluster):
+        folium, AntPath, Fullscreen = _load_folium()
         _wgs84_stfc_origin = webmercator_to_wgs84(
             *_stfc_obj.flow.coords[0])
         _wgs84_stfc_destination = webmercator_to_wgs84(
@@ -181,6 +188,7 @@ def plot_dcf_obj(_dcf_obj, _uid='Test'):
         TypeError: If _dcf_obj is not an instance of DailyCommutingFlow.
     """
     if isinstance(_dcf_obj, DailyCommutingFlow):
+        folium, AntPath, Fullscreen = _load_folium()
         _m = folium.Map(zoom_start=8)
         _lon_list, _lat_list = [], []
         if _dcf_obj.home_location:
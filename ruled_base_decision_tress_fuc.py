@@ -1,9 +1,7 @@
 # encoding: utf-8
 # Construct multiple decision trees to identify users' commuting patterns and commuting categories from their spatiotemporal flow clusters
 
-from scipy.optimize import brent
-from shapely import LineString
-from utils import time_to_hour, get_distance, are_endpoints_far_apart
+from utils import time_to_hour, get_distance, are_endpoints_far_apart, FlowLine
 
 
 class SimplifiedCommutingFlow:
@@ -33,7 +31,28 @@ class SimplifiedCommutingFlow:
                    (_earlier_origin[1] * _self_weight + _later_destination[1] * _another_weight)]
         _destination = [(_earlier_destination[0] * _self_weight + _later_origin[0] * _another_weight),
                         (_earlier_destination[1] * _self_weight + _later_origin[1] * _another_weight)]
-        return LineString([_origin, _destination])
+        return FlowLine([_origin, _destination])
+
+    # The decision trees only use the attributes of the commuting flow itself, so the two spatiotemporal flow clusters can be replaced by their summaries
+    def release_stfc(self):
+        if not isinstance(self.earlier_stfc, dict):
+            self.earlier_stfc = self.earlier_stfc.to_summary(_with_record_uuid=False)
+            self.later_stfc = self.later_stfc.to_summary(_with_record_uuid=False)
+
+    def to_summary(self):
+        """
+        Summarize the commuting flow with the IDs of its spatiotemporal flow clusters.
+        Returns:
+            dict: The IDs, OD points, travel times, numbers of ride records and transfer information of the commuting flow.
+        """
+        _earlier_stfc_id = self.earlier_stfc['stfc_id'] if isinstance(self.earlier_stfc, dict) else self.earlier_stfc.stfc_id
+        _later_stfc_id = self.later_stfc['stfc_id'] if isinstance(self.later_stfc, dict) else self.later_stfc.stfc_id
+        _origin, _destination = self.flow.coords
+        return {'cf_id': self.cf_id, 'earlier_stfc_id': _earlier_stfc_id, 'later_stfc_id': _later_stfc_id,
+                'origin': list(_origin), 'destination': list(_destination),
+                'earlier_travel_time': self.earlier_travel_time, 'later_travel_time': self.later_travel_time,
+                'total_record_num': self.total_record_num, 'cycling_round_trip_rate': self.cycling_round_trip_rate,
+                'transfer_type': self.transfer_type, 'transfer_station_id': self.transfer_station_id}
 
 
 class DailyCommutingFlow:
@@ -146,6 +165,21 @@ class DailyCommutingFlow:
         else:
             raise ValueError('Only input one SimplifiedCommutingFlow or two SimplifiedCommutingFlows')
 
+    def to_record(self):
+        """
+        Convert the daily commuting flow into a flat record, where each location is split into its x and y coordinates.
+        Returns:
+            dict: The attributes of the daily commuting flow, suitable for building a DataFrame row.
+        """
+        _record = {}
+        for _key, _value in self.__dict__.items():
+            if _key.endswith('_location'):
+                _record[f'{_key}_x'] = None if _value is None else float(_value[0])
+                _record[f'{_key}_y'] = None if _value is None else float(_value[1])
+            else:
+                _record[_key] = _value
+        return _record
+
 
 def identify_candidate_commuting_flow(_stfc1_obj, _stfc2_obj, _boundary_circle_radius=200, _working_hours_threshold=4):
     """
@@ -218,6 +252,41 @@ def identify_transfer_commuting_flow(_cf_obj, _public_station_k_tree, _public_st
     return _cf_obj
 
 
+def extract_candidate_commuting_flows(_spatiotemporal_flow_cluster_dict, _public_station_k_tree, _public_station_df,
+                                      _boundary_circle_radius=200, _working_hours_threshold=4,
+                                      _transfer_distance_threshold=60):
+    """
+    Identify the candidate commuting flows of one user from his/her spatiotemporal flow clusters, and determine if they transfer to public transport.
+    Parameters:
+        _spatiotemporal_flow_cluster_dict (dict): The spatiotemporal flow clusters of the user, where the keys are STFC IDs and the values are SpatioTemporalFlowCluster objects.
+        _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+        _public_station_df: A DataFrame containing information about metro entrances or bus station.
+        _boundary_circle_radius (int): See identify_candidate_commuting_flow, default is 200.
+        _working_hours_threshold (int): See identify_candidate_commuting_flow, default is 4.
+        _transfer_distance_threshold (int): See identify_transfer_commuting_flow, default is 60.
+    Returns:
+        dict: The candidate commuting flows of the user, where the keys are CF IDs and the values are SimplifiedCommutingFlow objects.
+    """
+    _candidate_commuting_flow_dict = {}
+    # The stfc sets in descending order according to the number of included ride records to ensure that the most representative cycling trajectories are traversed first
+    _sorted_stfc = sorted(_spatiotemporal_flow_cluster_dict.items(), key=lambda i: i[1].stfc_record_num, reverse=True)
+    _has_traversed_stfc_id_list = []
+    for _this_stfc_id, _stfc_obj in _sorted_stfc:
+        _this_sfc_id = _stfc_obj.sfc_id
+        if _this_stfc_id not in _has_traversed_stfc_id_list:
+            for _another_stfc_id, _another_stfc_obj in _sorted_stfc:
+                if _this_stfc_id != _another_stfc_id and _another_stfc_id not in _has_traversed_stfc_id_list and _this_sfc_id != _another_stfc_obj.sfc_id:
+                    _commuting_flow = identify_candidate_commuting_flow(_stfc_obj, _another_stfc_obj,
+                                                                        _boundary_circle_radius=_boundary_circle_radius,
+                                                                        _working_hours_threshold=_working_hours_threshold)
+                    if _commuting_flow:
+                        _commuting_flow = identify_transfer_commuting_flow(_commuting_flow, _public_station_k_tree,
+                                                                           _public_station_df,
+                                                                           _transfer_distance_threshold=_transfer_distance_threshold)
+                        _candidate_commuting_flow_dict[_commuting_flow.cf_id] = _commuting_flow
+    return _candidate_commuting_flow_dict
+
+
 def identify_user_commuting_category(_cf_set_dict):
     """
     Identify the user's commuting category based on their commuting flows set.
@@ -271,3 +340,16 @@ def find_another_daily_commuting_flow(_dcf_obj, _cf_set_dict):
                         return _cf_obj
 
     return False
+
+
+def build_daily_commuting_flow_df(_dcf_dict):
+    """
+    Collect the daily commuting flows of all users into one DataFrame.
+    Parameters:
+        _dcf_dict (dict): The daily commuting flow of each user, where the keys are uids and the values are DailyCommutingFlow objects.
+    Returns:
+        DataFrame: One row per user, with the fields returned by DailyCommutingFlow.to_record.
+    """
+    # pandas is only required when the results are collected into a table
+    import pandas as pd
+    return pd.DataFrame([{'uid': _uid, **_dcf_obj.to_record()} for _uid, _dcf_obj in _dcf_dict.items()])
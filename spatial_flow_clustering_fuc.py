@@ -2,10 +2,11 @@
 # The original spatial flow clustering method we used was proposed by Gao et al.(2020). The article is linked as follows:
 # https://doi.org/10.1109/ACCESS.2020.3040852
 
+import os
 import math
 import numpy as np
-from shapely import Point, LineString
-from utils import get_distance
+from scipy.spatial import cKDTree
+from utils import get_distance, FlowLine
 
 class SpatialClusterFlow:
     def __init__(self, _sfc_id, _flow_geom, _record_detail):
@@ -31,7 +32,7 @@ class SpatialClusterFlow:
             _flow_destination_list.append(_record_info['destination'])
         self.origin = np.mean(_flow_origin_list, axis=0)
         self.destination = np.mean(_flow_destination_list, axis=0)
-        self.flow = LineString([self.origin, self.destination])
+        self.flow = FlowLine([self.origin, self.destination])
 
     def add_flow(self, _another_record_detail):
         if not isinstance(_another_record_detail, dict):
@@ -44,6 +45,25 @@ class SpatialClusterFlow:
                     self.including_record_detail[_uuid] = _another_record_detail[_uuid]
             self.record_num = len(self.including_record_detail)
 
+    def to_summary(self, _with_record_uuid=True):
+        """
+        Summarize the spatial flow cluster without the details of its ride records.
+        Parameters:
+            _with_record_uuid (bool): Whether to keep the UUIDs of the ride records, default is True.
+        Returns:
+            dict: The ID, OD points, number of ride records and UUIDs of the ride records of the spatial flow cluster.
+        """
+        _summary = {'sfc_id': self.sfc_id, 'origin': [float(self.origin[0]), float(self.origin[1])],
+                    'destination': [float(self.destination[0]), float(self.destination[1])],
+                    'record_num': self.record_num}
+        if _with_record_uuid:
+            _summary['record_uuid_list'] = list(self.including_record_detail.keys())
+        return _summary
+
+    # Only the UUIDs of the ride records are kept, the spatial flow cluster can no longer be plotted or merged afterwards
+    def release_record_detail(self):
+        self.including_record_detail = dict.fromkeys(self.including_record_detail)
+
 
 #
 def init_bike_record_with_sfc_obj(_record_list):
@@ -60,7 +80,7 @@ def init_bike_record_with_sfc_obj(_record_list):
         _uuid = _record_info['uuid']
         _origin = [_record_info['origin_x'], _record_info['origin_y']]
         _destination = [_record_info['destination_x'], _record_info['destination_y']]
-        _flow_geom = LineString([_origin, _destination])
+        _flow_geom = FlowLine([_origin, _destination])
 
         _init_spatial_flow_cluster = SpatialClusterFlow(
             int(_row), _flow_geom, {
@@ -130,3 +150,157 @@ def calculate_spatial_dissimilarity(_sf1, _sf2, _size_coefficient=0.3, _max_circ
     sd_1 = get_distance(_sf1_destination, _sf2_destination) / _circle_boundary_radius
     return math.sqrt(sd_0 ** 2 + sd_1 ** 2)
 
+
+
+def extract_spatial_flow_clusters(_record_list, _activity_weekdays, _size_coefficient=0.3, _max_circle_boundary_radius=200):
+    """
+    Extract the spatial flow clusters of one user from his/her weekday ride records.
+    Parameters:
+        _record_list (list): A list of the user's weekday ride records, where each record is a dictionary (as returned by DataFrame.to_dict(orient='records')).
+        _activity_weekdays (int): The number of activity weekdays of the user, used to filter out the occasional spatial flow clusters.
+        _size_coefficient (float): The coefficient for the neighbourhood and circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the circle boundary radius, default is 200.
+    Returns:
+        dict: The final spatial flow clusters of the user, where the keys are SFC IDs and the values are SpatialClusterFlow objects.
+    """
+    _bike_record_dict, _init_bike_record_with_sfc_dict = init_bike_record_with_sfc_obj(_record_list)
+    for _uuid in _bike_record_dict.keys():
+        _this_spatial_flow_cluster = _init_bike_record_with_sfc_dict[_uuid]
+        _near_record_uuid_list = get_near_record_uuid_list(_bike_record_dict, _uuid, _this_spatial_flow_cluster.sfc_id,
+                                                           _size_coefficient)
+        for _near_uuid in _near_record_uuid_list:
+            _near_spatial_flow_cluster = _init_bike_record_with_sfc_dict[_near_uuid]
+            if _this_spatial_flow_cluster.sfc_id != _near_spatial_flow_cluster.sfc_id:
+                _flows_sd = calculate_spatial_dissimilarity(
+                    _this_spatial_flow_cluster, _near_spatial_flow_cluster, _size_coefficient=_size_coefficient,
+                    _max_circle_boundary_radius=_max_circle_boundary_radius)
+                if _flows_sd <= 1:
+                    _this_spatial_flow_cluster.add_flow(_near_spatial_flow_cluster.including_record_detail)
+                    for _including_record_uuid in _near_spatial_flow_cluster.including_record_detail.keys():
+                        _init_bike_record_with_sfc_dict[_including_record_uuid] = _this_spatial_flow_cluster
+                        _bike_record_dict[_including_record_uuid]['sfc_id'] = _this_spatial_flow_cluster.sfc_id
+
+    _final_spatial_flow_cluster_dict = {}
+    _min_sfc_threshold = _activity_weekdays / 5
+    for _uuid, _sfc_obj in _init_bike_record_with_sfc_dict.items():
+        _this_sfc_id = _sfc_obj.sfc_id
+        if _this_sfc_id not in _final_spatial_flow_cluster_dict.keys() and _sfc_obj.record_num >= _min_sfc_threshold:
+            _final_spatial_flow_cluster_dict[_this_sfc_id] = _sfc_obj
+    return _final_spatial_flow_cluster_dict
+
+
+def get_near_record_index_list(_centroid_array, _distance_array, _size_coefficient=0.3, _workers=-1):
+    """
+    Get the indexes of the ride records near each ride record at once, which gives the same neighbours as get_near_record_uuid_list before any ride record is clustered.
+    The candidates are searched with a k-d tree in parallel threads and then filtered with the same distance threshold as get_near_record_uuid_list.
+    Parameters:
+        _centroid_array (ndarray): The centroids of the ride records, with shape (n, 2).
+        _distance_array (ndarray): The lengths of the ride records, with shape (n,).
+        _size_coefficient (float): The coefficient for the distance threshold, default is 0.3.
+        _workers (int): The number of threads used by the k-d tree query, -1 or any other non-positive value means all the CPUs, default is -1.
+    Returns:
+        list: The sorted indexes of the nearby ride records of each ride record.
+    """
+    _workers = (os.cpu_count() or 1) if _workers <= 0 else _workers
+    _distance_threshold_array = 1.4142 * _distance_array * _size_coefficient
+    # The search radius is slightly enlarged so that the exact comparison below decides the records on the boundary
+    _candidate_index_list = cKDTree(_centroid_array).query_ball_point(
+        _centroid_array, _distance_threshold_array * (1 + 1e-9) + 1e-6, workers=_workers, return_sorted=True)
+    _near_record_index_list = []
+    for _this_index, _candidate_index in enumerate(_candidate_index_list):
+        _candidate_index = np.asarray(_candidate_index, dtype=np.int64)
+        _candidate_index = _candidate_index[_candidate_index != _this_index]
+        _candidate_distance = np.sqrt((_centroid_array[_candidate_index, 0] - _centroid_array[_this_index, 0]) ** 2 +
+                                      (_centroid_array[_candidate_index, 1] - _centroid_array[_this_index, 1]) ** 2)
+        _near_record_index_list.append(_candidate_index[_candidate_distance <= _distance_threshold_array[_this_index]])
+    return _near_record_index_list
+
+
+def calculate_spatial_dissimilarity_array(_sf1_origin, _sf1_destination, _sf1_distance, _origin_array, _destination_array,
+                                          _distance_array, _size_coefficient=0.3, _max_circle_boundary_radius=200):
+    """
+    Calculate the spatial dissimilarity coefficients between one spatial flow cluster and an array of spatial flow clusters, which is the vectorized version of calculate_spatial_dissimilarity.
+    The inputs follow the NumPy broadcasting rules on all but the last axis of the OD points, e.g. first spatial flow clusters with shape (m, 1, 2) and (m, 1) give a matrix with shape (m, n).
+    Parameters:
+        _sf1_origin, _sf1_destination: The OD points of the first spatial flow cluster.
+        _sf1_distance (float): The length of the first spatial flow cluster.
+        _origin_array, _destination_array (ndarray): The OD points of the other spatial flow clusters, with shape (n, 2).
+        _distance_array (ndarray): The lengths of the other spatial flow clusters, with shape (n,).
+        _size_coefficient: float, the size coefficient used to calculate the circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius: int, the maximum value for the circle boundary radius, default is 200.
+    Returns:
+        ndarray, the spatial dissimilarity coefficients, with shape (n,).
+    """
+    _sf1_origin = np.asarray(_sf1_origin, dtype=float)
+    _sf1_destination = np.asarray(_sf1_destination, dtype=float)
+    _circle_boundary_radius = np.array(np.minimum(_distance_array, _sf1_distance) * _size_coefficient, dtype=float)
+    _circle_boundary_radius[_circle_boundary_radius >= _max_circle_boundary_radius] = _max_circle_boundary_radius
+    sd_0 = np.sqrt((_sf1_origin[..., 0] - _origin_array[..., 0]) ** 2 + (
+            _sf1_origin[..., 1] - _origin_array[..., 1]) ** 2) / _circle_boundary_radius
+    sd_1 = np.sqrt((_sf1_destination[..., 0] - _destination_array[..., 0]) ** 2 + (
+            _sf1_destination[..., 1] - _destination_array[..., 1]) ** 2) / _circle_boundary_radius
+    return np.sqrt(sd_0 ** 2 + sd_1 ** 2)
+
+
+def extract_heavy_user_spatial_flow_clusters(_record_list, _activity_weekdays, _size_coefficient=0.3,
+                                             _max_circle_boundary_radius=200, _workers=-1):
+    """
+    Extract the spatial flow clusters of a user with a large number of ride records, which gives the same results as extract_spatial_flow_clusters.
+    The neighbour search is done for all the ride records at once in parallel threads, and the greedy merging is kept in the original order,
+    where the dissimilarities between the current spatial flow cluster and all its remaining neighbours are calculated together until the first one to be merged is found.
+    Parameters:
+        _record_list (list): A list of the user's weekday ride records, where each record is a dictionary.
+        _activity_weekdays (int): The number of activity weekdays of the user.
+        _size_coefficient (float): The coefficient for the neighbourhood and circle boundary radius, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the circle boundary radius, default is 200.
+        _workers (int): The number of threads used by the neighbour search, -1 or any other non-positive value means all the CPUs, default is -1.
+    Returns:
+        dict: The final spatial flow clusters of the user, where the keys are SFC IDs and the values are SpatialClusterFlow objects.
+    """
+    _bike_record_dict, _init_bike_record_with_sfc_dict = init_bike_record_with_sfc_obj(_record_list)
+    _uuid_list = list(_bike_record_dict.keys())
+    if len(_uuid_list) == 0:
+        return {}
+    _centroid_array = np.array([_bike_record_dict[_uuid]['centroid'] for _uuid in _uuid_list], dtype=float)
+    _distance_array = np.array([_bike_record_dict[_uuid]['distance'] for _uuid in _uuid_list], dtype=float)
+    _near_record_index_list = get_near_record_index_list(_centroid_array, _distance_array, _size_coefficient, _workers)
+
+    # Each spatial flow cluster is labelled by the index of the ride record that created it
+    _label_array = np.arange(len(_uuid_list))
+    _sfc_obj_list = [_init_bike_record_with_sfc_dict[_uuid] for _uuid in _uuid_list]
+    _origin_array = np.array([_sfc_obj.origin for _sfc_obj in _sfc_obj_list], dtype=float)
+    _destination_array = np.array([_sfc_obj.destination for _sfc_obj in _sfc_obj_list], dtype=float)
+    _length_array = np.array([_sfc_obj.flow.length for _sfc_obj in _sfc_obj_list], dtype=float)
+    for _this_index, _near_record_index in enumerate(_near_record_index_list):
+        _this_label = _label_array[_this_index]
+        _this_spatial_flow_cluster = _sfc_obj_list[_this_label]
+        _near_record_index = _near_record_index[_label_array[_near_record_index] != _this_label]
+        _position = 0
+        while _position < len(_near_record_index):
+            _near_label_array = _label_array[_near_record_index[_position:]]
+            _flows_sd = calculate_spatial_dissimilarity_array(
+                _origin_array[_this_label], _destination_array[_this_label], _length_array[_this_label],
+                _origin_array[_near_label_array], _destination_array[_near_label_array], _length_array[_near_label_array],
+                _size_coefficient, _max_circle_boundary_radius)
+            _hit_position_array = np.nonzero((_near_label_array != _this_label) & (_flows_sd <= 1))[0]
+            if len(_hit_position_array) == 0:
+                break
+            _near_label = _near_label_array[_hit_position_array[0]]
+            _near_spatial_flow_cluster = _sfc_obj_list[_near_label]
+            _this_spatial_flow_cluster.add_flow(_near_spatial_flow_cluster.including_record_detail)
+            for _including_record_uuid in _near_spatial_flow_cluster.including_record_detail.keys():
+                _init_bike_record_with_sfc_dict[_including_record_uuid] = _this_spatial_flow_cluster
+                _bike_record_dict[_including_record_uuid]['sfc_id'] = _this_spatial_flow_cluster.sfc_id
+            _label_array[_label_array == _near_label] = _this_label
+            _origin_array[_this_label] = _this_spatial_flow_cluster.origin
+            _destination_array[_this_label] = _this_spatial_flow_cluster.destination
+            _length_array[_this_label] = _this_spatial_flow_cluster.flow.length
+            _position += _hit_position_array[0] + 1
+
+    _final_spatial_flow_cluster_dict = {}
+    _min_sfc_threshold = _activity_weekdays / 5
+    for _uuid, _sfc_obj in _init_bike_record_with_sfc_dict.items():
+        _this_sfc_id = _sfc_obj.sfc_id
+        if _this_sfc_id not in _final_spatial_flow_cluster_dict.keys() and _sfc_obj.record_num >= _min_sfc_threshold:
+            _final_spatial_flow_cluster_dict[_this_sfc_id] = _sfc_obj
+    return _final_spatial_flow_cluster_dict
@@ -2,8 +2,13 @@
 # The original spatiotemporal flow clustering method we used was proposed by Yao et al.(2018). The article is linked as follows:
 # https://doi.org/10.1109/ACCESS.2018.2864662
 
-from shapely import Point, LineString
-from utils import time_to_hour, hour_to_time
+import numpy as np
+from utils import time_to_hour, hour_to_time, get_distance, FlowLine
+
+# Spatial flow clusters with at least this many ride records are clustered with cluster_heavy_sfc_into_stfc, below which
+# the overhead of the NumPy calls outweighs the vectorized comparisons, as measured on the synthetic records of
+# equivalence_harness_fuc (about 0.2 times as fast with 10 records, 1.0 with 100 to 150 and 2 to 3 times with 300 or more)
+HEAVY_SFC_RECORD_NUM = 150
 
 
 class SpatioTemporalFlowCluster:
@@ -58,12 +63,35 @@ class SpatioTemporalFlowCluster:
                           (_self_origin[1] + _neighbor_stfc_origin[1]) / 2]
         _merged_destination = [(_self_destination[0] + _neighbor_stfc_destination[0]) / 2,
                                (_self_destination[1] + _neighbor_stfc_destination[1]) / 2]
-        self.flow = LineString([_merged_origin, _merged_destination])
+        self.flow = FlowLine([_merged_origin, _merged_destination])
         self.add_flow(_neighbor_stfc.including_record_detail)
         self.sfc_record_num += _neighbor_stfc.sfc_record_num
         self.sfc_id = f'{self.sfc_id}_and_{_neighbor_stfc.sfc_id}'
         self.has_merged = True
 
+    def to_summary(self, _with_record_uuid=True):
+        """
+        Summarize the spatiotemporal flow cluster without the details of its ride records.
+        Parameters:
+            _with_record_uuid (bool): Whether to keep the UUIDs of the ride records, default is True.
+        Returns:
+            dict: The IDs, OD points, time span, numbers of ride records and UUIDs of the ride records of the spatiotemporal flow cluster.
+        """
+        _origin, _destination = self.flow.coords
+        _summary = {'stfc_id': self.stfc_id, 'sfc_id': self.sfc_id, 'origin': list(_origin),
+                    'destination': list(_destination), 'start_time': self.start_time, 'end_time': self.end_time,
+                    'time_span': list(self.time_span), 'sfc_record_num': self.sfc_record_num,
+                    'stfc_record_num': self.stfc_record_num, 'has_merged': self.has_merged}
+        if _with_record_uuid:
+            _summary['record_uuid_list'] = list(self.including_record_detail.keys())
+        return _summary
+
+    # Only the UUIDs of the ride records are kept, the spatiotemporal flow cluster can no longer be plotted or merged afterwards
+    def release_record_detail(self):
+        self.including_record_detail = dict.fromkeys(self.including_record_detail)
+        self.record_start_time_list = None
+        self.record_end_time_list = None
+
 
 def init_bike_record_with_stfc_obj(_sfc_obj):
     """
@@ -161,3 +189,198 @@ def calculate_temporal_similarity(_time_span1, _time_span2, _expansion_coefficie
         _earlier_flow_start_time = min(_extended_time_span1[0], _extended_time_span2[0])
         return get_time_different(_earlier_flow_end_time, _laser_flow_start_time) / get_time_different(_earlier_flow_start_time,
                                                                                              _laser_flow_end_time)
+
+
+def calculate_temporal_similarity_array(_time_span1, _time_span_array, _expansion_coefficient=0.5):
+    """
+    Calculate the temporal similarity coefficients between one ride record and an array of ride records, which is the vectorized version of calculate_temporal_similarity.
+    Parameters:
+        _time_span1: list, represents the time span of the first ride record.
+        _time_span_array: ndarray, represents the time spans of the other ride records, with shape (n, 2).
+        _expansion_coefficient: float, the expansion coefficient for the time span, default is 0.5.
+    Returns:
+        ndarray, the temporal similarity coefficients, with shape (n,).
+    """
+    _extended_time_span1 = [_time_span1[0] - _expansion_coefficient, _time_span1[1] + _expansion_coefficient]
+    if _extended_time_span1[0] - _expansion_coefficient < 0:
+        _extended_time_span1[0] += 24
+    if _extended_time_span1[1] + _expansion_coefficient >= 24:
+        _extended_time_span1[1] -= 24
+    _s1, _e1 = _extended_time_span1
+    _s2 = _time_span_array[:, 0] - _expansion_coefficient
+    _e2 = _time_span_array[:, 1] + _expansion_coefficient
+    _s2 = np.where(_s2 - _expansion_coefficient < 0, _s2 + 24, _s2)
+    _e2 = np.where(_e2 + _expansion_coefficient >= 24, _e2 - 24, _e2)
+
+    def _is_earlier(_t1, _t2):
+        _d = _t1 - _t2
+        return ((12 > _d) & (_d >= 0)) | (_d < -12)
+
+    def _time_different(_t1, _t2):
+        return np.minimum(np.abs(_t1 - _t2), 24 - np.abs(_t1 - _t2))
+
+    _start_earlier = _is_earlier(_s1, _s2)
+    _end_earlier = _is_earlier(_e1, _e2)
+    _is_case1 = _start_earlier & ~_end_earlier
+    _is_case2 = ~_start_earlier & _end_earlier & ~_is_case1
+    _is_disjoint = (~_is_earlier(_e1, _s2) | ~_is_earlier(_e2, _s1)) & ~_is_case1 & ~_is_case2
+    _span1 = _time_different(_s1, _e1)
+    _span2 = _time_different(_s2, _e2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        _overlap = _time_different(np.minimum(_e1, _e2), np.maximum(_s1, _s2)) / _time_different(np.minimum(_s1, _s2),
+                                                                                                 np.maximum(_e1, _e2))
+    _similarity = np.where(_is_disjoint, 0.0, _overlap)
+    _similarity = np.where(_is_case2, (_span2 < _span1).astype(float), _similarity)
+    return np.where(_is_case1, (_span1 < _span2).astype(float), _similarity)
+
+
+def cluster_heavy_sfc_into_stfc(_sfc_obj, _expansion_coefficient=0.5):
+    """
+    Cluster the ride records of one spatial flow cluster into spatiotemporal flow clusters, which gives the same results as the double loop in extract_spatiotemporal_flow_clusters.
+    The greedy merging is kept in the original order, where the temporal similarities between the current spatiotemporal flow cluster and all the remaining ones are calculated together until the first one to be merged is found.
+    Parameters:
+        _sfc_obj (SpatialClusterFlow): A given spatial flow cluster object.
+        _expansion_coefficient (float): The expansion coefficient for the time span, default is 0.5.
+    Returns:
+        dict: The spatiotemporal flow cluster corresponding to each ride record UUID after clustering.
+    """
+    _init_bike_record_with_stfc_dict = init_bike_record_with_stfc_obj(_sfc_obj)
+    _uuid_list = list(_init_bike_record_with_stfc_dict.keys())
+    _stfc_obj_list = [_init_bike_record_with_stfc_dict[_uuid] for _uuid in _uuid_list]
+    # Each spatiotemporal flow cluster is labelled by the index of the ride record that created it
+    _label_array = np.arange(len(_uuid_list))
+    _time_span_array = np.array([_stfc_obj.time_span for _stfc_obj in _stfc_obj_list], dtype=float).reshape(-1, 2)
+    for _this_index in range(len(_uuid_list)):
+        _this_label = _label_array[_this_index]
+        _stfc_obj = _stfc_obj_list[_this_label]
+        _position = 0
+        while _position < len(_uuid_list):
+            _another_label_array = _label_array[_position:]
+            _flows_ts = calculate_temporal_similarity_array(_stfc_obj.time_span, _time_span_array[_another_label_array],
+                                                            _expansion_coefficient)
+            _hit_position_array = np.nonzero((_another_label_array != _this_label) & (_flows_ts >= 0.5))[0]
+            if len(_hit_position_array) == 0:
+                break
+            _another_index = _position + _hit_position_array[0]
+            _stfc_obj.add_flow(_stfc_obj_list[_label_array[_another_index]].including_record_detail)
+            # Only the visited ride record is redirected to the current cluster, the same as the original double loop
+            _init_bike_record_with_stfc_dict[_uuid_list[_another_index]] = _stfc_obj
+            _label_array[_another_index] = _this_label
+            _time_span_array[_this_label] = _stfc_obj.time_span
+            _position = _another_index + 1
+    return _init_bike_record_with_stfc_dict
+
+
+def extract_heavy_user_spatiotemporal_flow_clusters(_spatial_flow_cluster_dict, _expansion_coefficient=0.5,
+                                                    _size_coefficient=0.3, _max_circle_boundary_radius=200):
+    """
+    Extract the spatiotemporal flow clusters of a user with a large number of ride records, which gives the same results as extract_spatiotemporal_flow_clusters.
+    The spatial flow clusters with at least HEAVY_SFC_RECORD_NUM ride records are clustered with cluster_heavy_sfc_into_stfc, and the others with the original double loop.
+    The clustering is bound by the Python interpreter, so it is done serially in the original order of the spatial flow clusters.
+    Parameters:
+        _spatial_flow_cluster_dict (dict): The spatial flow clusters of the user, as returned by extract_spatial_flow_clusters.
+        _expansion_coefficient (float): The expansion coefficient for the time span, default is 0.5.
+        _size_coefficient (float): The coefficient for the merging distance threshold, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the merging distance threshold, default is 200.
+    Returns:
+        dict: The final spatiotemporal flow clusters of the user, where the keys are STFC IDs and the values are SpatioTemporalFlowCluster objects.
+    """
+    _unmerged_spatiotemporal_flow_cluster_dict = {}
+    for _spatial_flow_cluster_obj in _spatial_flow_cluster_dict.values():
+        if _spatial_flow_cluster_obj.record_num >= HEAVY_SFC_RECORD_NUM:
+            _init_bike_record_with_stfc_dict = cluster_heavy_sfc_into_stfc(_spatial_flow_cluster_obj, _expansion_coefficient)
+        else:
+            _init_bike_record_with_stfc_dict = cluster_sfc_into_stfc(_spatial_flow_cluster_obj, _expansion_coefficient)
+        for _uuid, _stfc_obj in _init_bike_record_with_stfc_dict.items():
+            if _stfc_obj.stfc_id not in _unmerged_spatiotemporal_flow_cluster_dict.keys():
+                _unmerged_spatiotemporal_flow_cluster_dict[_stfc_obj.stfc_id] = _stfc_obj
+    return merge_neighbor_spatiotemporal_flow_clusters(_unmerged_spatiotemporal_flow_cluster_dict, _expansion_coefficient,
+                                                       _size_coefficient, _max_circle_boundary_radius)
+
+
+def cluster_sfc_into_stfc(_sfc_obj, _expansion_coefficient=0.5):
+    """
+    Cluster the ride records of one spatial flow cluster into spatiotemporal flow clusters with the original double loop.
+    Parameters:
+        _sfc_obj (SpatialClusterFlow): A given spatial flow cluster object.
+        _expansion_coefficient (float): The expansion coefficient for the time span, default is 0.5.
+    Returns:
+        dict: The spatiotemporal flow cluster corresponding to each ride record UUID after clustering.
+    """
+    _init_bike_record_with_stfc_dict = init_bike_record_with_stfc_obj(_sfc_obj)
+    for _uuid, _stfc_obj in _init_bike_record_with_stfc_dict.items():
+        for _another_uuid, _another_stfc_obj in _init_bike_record_with_stfc_dict.items():
+            if _uuid != _another_uuid and _stfc_obj.stfc_id != _another_stfc_obj.stfc_id:
+                _flows_ts = calculate_temporal_similarity(_stfc_obj.time_span, _another_stfc_obj.time_span,
+                                                          _expansion_coefficient=_expansion_coefficient)
+                if _flows_ts >= 0.5:
+                    _stfc_obj.add_flow(_another_stfc_obj.including_record_detail)
+                    _init_bike_record_with_stfc_dict[_another_uuid] = _stfc_obj
+    return _init_bike_record_with_stfc_dict
+
+
+def extract_spatiotemporal_flow_clusters(_spatial_flow_cluster_dict, _expansion_coefficient=0.5, _size_coefficient=0.3,
+                                         _max_circle_boundary_radius=200):
+    """
+    Extract the spatiotemporal flow clusters of one user from his/her spatial flow clusters, and merge the neighbouring ones.
+    Parameters:
+        _spatial_flow_cluster_dict (dict): The spatial flow clusters of the user, as returned by extract_spatial_flow_clusters.
+        _expansion_coefficient (float): The expansion coefficient for the time span, default is 0.5.
+        _size_coefficient (float): The coefficient for the merging distance threshold, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the merging distance threshold, default is 200.
+    Returns:
+        dict: The final spatiotemporal flow clusters of the user, where the keys are STFC IDs and the values are SpatioTemporalFlowCluster objects.
+    """
+    _unmerged_spatiotemporal_flow_cluster_dict = {}
+    for _spatial_flow_cluster_obj in _spatial_flow_cluster_dict.values():
+        _init_bike_record_with_stfc_dict = cluster_sfc_into_stfc(_spatial_flow_cluster_obj, _expansion_coefficient)
+        for _uuid, _stfc_obj in _init_bike_record_with_stfc_dict.items():
+            if _stfc_obj.stfc_id not in _unmerged_spatiotemporal_flow_cluster_dict.keys():
+                _unmerged_spatiotemporal_flow_cluster_dict[_stfc_obj.stfc_id] = _stfc_obj
+
+    return merge_neighbor_spatiotemporal_flow_clusters(_unmerged_spatiotemporal_flow_cluster_dict, _expansion_coefficient,
+                                                       _size_coefficient, _max_circle_boundary_radius)
+
+
+def merge_neighbor_spatiotemporal_flow_clusters(_unmerged_spatiotemporal_flow_cluster_dict, _expansion_coefficient=0.5,
+                                                _size_coefficient=0.3, _max_circle_boundary_radius=200):
+    """
+    Merge the neighbouring spatiotemporal flow clusters that belong to different spatial flow clusters, and filter out the occasional ones.
+    Parameters:
+        _unmerged_spatiotemporal_flow_cluster_dict (dict): The unmerged spatiotemporal flow clusters of the user, where the keys are STFC IDs.
+        _expansion_coefficient (float): The expansion coefficient for the time span, default is 0.5.
+        _size_coefficient (float): The coefficient for the merging distance threshold, default is 0.3.
+        _max_circle_boundary_radius (int): The maximum value for the merging distance threshold, default is 200.
+    Returns:
+        dict: The final spatiotemporal flow clusters of the user, where the keys are STFC IDs and the values are SpatioTemporalFlowCluster objects.
+    """
+    # The unmerged stfc sets in descending order according to the number of included ride records to ensure that the most representative cycling trajectories are traversed first
+    _sorted_unmerged_spatiotemporal_flow_cluster = sorted(_unmerged_spatiotemporal_flow_cluster_dict.items(),
+                                                          key=lambda item: item[1].stfc_record_num, reverse=True)
+    _merged_spatiotemporal_flow_cluster_dict = {}
+    _has_traversed_stfc_id_list = []
+    for _this_stfc_id, _this_stfc_obj in _sorted_unmerged_spatiotemporal_flow_cluster:
+        _this_sfc_id = _this_stfc_obj.sfc_id
+        _has_traversed_stfc_id_list.append(_this_stfc_id)
+        for _another_stfc_id, _another_stfc_obj in _unmerged_spatiotemporal_flow_cluster_dict.items():
+            if _another_stfc_id != _this_stfc_id and _another_stfc_id not in _has_traversed_stfc_id_list and _another_stfc_obj.sfc_id != _this_sfc_id:
+                _dist_threshold = min([_this_stfc_obj.flow.length, _another_stfc_obj.flow.length]) * _size_coefficient
+                _dist_threshold = _max_circle_boundary_radius if _dist_threshold >= _max_circle_boundary_radius else _dist_threshold
+                _origin_dist = get_distance(_this_stfc_obj.flow.coords[0], _another_stfc_obj.flow.coords[0])
+                _destination_dist = get_distance(_this_stfc_obj.flow.coords[1], _another_stfc_obj.flow.coords[1])
+                _flow_ts = calculate_temporal_similarity(_this_stfc_obj.time_span, _another_stfc_obj.time_span,
+                                                         _expansion_coefficient=_expansion_coefficient)
+                if _flow_ts >= 0.5 and _origin_dist < _dist_threshold * 2 and _destination_dist < _dist_threshold * 2:
+                    _this_stfc_obj.merge_neighbor_tfc(_another_stfc_obj)
+                    _has_traversed_stfc_id_list.append(_another_stfc_id)
+                    _merged_spatiotemporal_flow_cluster_dict[_another_stfc_id] = _this_stfc_obj
+                    _merged_spatiotemporal_flow_cluster_dict[_this_stfc_id] = _this_stfc_obj
+        if _this_stfc_obj.has_merged is False:
+            _merged_spatiotemporal_flow_cluster_dict[_this_stfc_id] = _this_stfc_obj
+
+    _final_spatiotemporal_flow_cluster_dict = {}
+    for _, _stfc_obj in _merged_spatiotemporal_flow_cluster_dict.items():
+        if _stfc_obj.stfc_id not in _final_spatiotemporal_flow_cluster_dict.keys():
+            if _stfc_obj.stfc_record_num >= _stfc_obj.sfc_record_num * 0.3:
+                _final_spatiotemporal_flow_cluster_dict[_stfc_obj.stfc_id] = _stfc_obj
+    return _final_spatiotemporal_flow_cluster_dict
@@ -0,0 +1,66 @@
+# encoding: utf-8
+# Measure the import time and memory paid at startup, and check that the headless core does not load the optional
+# plotting and geometry dependencies
+
+import os
+import sys
+import json
+import subprocess
+
+# The clustering and decision-tree modules, which only need NumPy and SciPy
+HEADLESS_MODULE_LIST = ['spatial_flow_clustering_fuc', 'spatiotemporal_flow_clustering_fuc', 'ruled_base_decision_tress_fuc']
+# The dependencies that are only loaded when they are first used
+LAZY_DEPENDENCY_LIST = ['pandas', 'shapely', 'folium', 'geopandas', 'pyarrow']
+
+_PROFILE_SCRIPT = '''
+import sys, json, time, importlib
+from startup_profile_fuc import get_current_rss_mb, LAZY_DEPENDENCY_LIST
+_rss_before = get_current_rss_mb()
+_start = time.perf_counter()
+for _module_name in json.loads(sys.argv[1]):
+    importlib.import_module(_module_name)
+_import_seconds = time.perf_counter() - _start
+print(json.dumps({'import_seconds': _import_seconds, 'rss_mb_before': _rss_before, 'rss_mb_after': get_current_rss_mb(),
+                  'loaded_lazy_dependency_list': [_d for _d in LAZY_DEPENDENCY_LIST if _d in sys.modules]}))
+'''
+
+
+def get_current_rss_mb():
+    """
+    Get the resident set size of the current process, falling back to the peak resident set size where /proc is not available.
+    Returns:
+        float: The resident set size in MB.
+    """
+    try:
+        with open('/proc/self/status', 'r') as _f:
+            for _line in _f:
+                if _line.startswith('VmRSS:'):
+                    return int(_line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    _max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return _max_rss / 1024 / 1024 if sys.platform == 'darwin' else _max_rss / 1024
+
+
+def measure_startup(_module_name_list=None):
+    """
+    Measure the cost of importing modules in a fresh interpreter, as paid by every process-pool worker and short CLI invocation.
+    Parameters:
+        _module_name_list (list): The modules to be imported, default is HEADLESS_MODULE_LIST.
+    Returns:
+        dict: The import time in seconds, the resident set size in MB before and after the imports, and the lazily loaded dependencies that were loaded anyway.
+    """
+    _module_name_list = HEADLESS_MODULE_LIST if _module_name_list is None else _module_name_list
+    _result = subprocess.run([sys.executable, '-c', _PROFILE_SCRIPT, json.dumps(_module_name_list)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    return json.loads(_result.stdout)
+
+
+if __name__ == '__main__':
+    for _module_name_list in [HEADLESS_MODULE_LIST, ['out_of_core_processing_fuc'], ['results_plot_fuc']]:
+        _profile = measure_startup(_module_name_list)
+        print(f"{', '.join(_module_name_list)}: {_profile['import_seconds']:.3f} s, "
+              f"RSS {_profile['rss_mb_before']:.1f} -> {_profile['rss_mb_after']:.1f} MB, "
+              f"lazy dependencies loaded: {_profile['loaded_lazy_dependency_list']}")
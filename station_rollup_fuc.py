@@ -0,0 +1,180 @@
+# encoding: utf-8
+# Roll up the transfer commuting flows by public transport station into first- and last-mile catchments and time profiles.
+# A rollup only holds counts on fixed bins, so the rollups of any shards of the results can be merged by summation
+
+import numpy as np
+import pandas as pd
+from columnar_decision_tree_fuc import time_str_to_hour
+from out_of_core_processing_fuc import iter_record_chunks
+
+# Riding to the station starts from home and riding from the station ends at work
+TRANSFER_DIRECTION_DICT = {'to_transit': 'home_location', 'from_transit': 'work_location'}
+# The fixed bins shared by all the rollups, hourly for the time of day and 25 m for the catchment distance up to 10 km,
+# where the last bin also holds the longer distances
+HOUR_BIN_EDGES = np.arange(0, 25, 1)
+DISTANCE_BIN_EDGES = np.arange(0, 10025, 25)
+
+_COUNT_COLUMNS = ['user_num', 'catchment_distance_sum']
+_LEAVE_HOME_COLUMNS = [f'leave_home_h{_h:02d}' for _h in HOUR_BIN_EDGES[:-1]]
+_LEAVE_WORK_COLUMNS = [f'leave_work_h{_h:02d}' for _h in HOUR_BIN_EDGES[:-1]]
+_DISTANCE_COLUMNS = [f'catchment_d{_d:05d}' for _d in DISTANCE_BIN_EDGES[:-1]]
+STATION_ROLLUP_COLUMNS = _COUNT_COLUMNS + _LEAVE_HOME_COLUMNS + _LEAVE_WORK_COLUMNS + _DISTANCE_COLUMNS
+
+# The columns of the daily commuting flows required by the rollup
+_DCF_ROLLUP_FIELDS = ['moment_leave_home', 'moment_leave_work'] + [
+    _f for _direction, _anchor in TRANSFER_DIRECTION_DICT.items() for _f in
+    [f'{_direction}_station_id', f'{_direction}_station_location_x', f'{_direction}_station_location_y',
+     f'{_anchor}_x', f'{_anchor}_y']]
+
+
+def _count_bins(_group_code, _group_num, _value_array, _bin_edges):
+    """
+    Count the values of each group on fixed bins, dropping the missing values and putting the values beyond the last edge into the last bin.
+    """
+    _is_valid = ~np.isnan(_value_array)
+    _bin_index = np.clip(np.searchsorted(_bin_edges, _value_array[_is_valid], side='right') - 1, 0, len(_bin_edges) - 2)
+    _bin_num = len(_bin_edges) - 1
+    return np.bincount(_group_code[_is_valid] * _bin_num + _bin_index,
+                       minlength=_group_num * _bin_num).reshape(_group_num, _bin_num)
+
+
+def _get_hour_array(_time_series):
+    _hour_array = np.full(len(_time_series), np.nan)
+    _is_valid = _time_series.notna().to_numpy()
+    if _is_valid.any():
+        _hour_array[_is_valid] = time_str_to_hour(_time_series[_is_valid])
+    return _hour_array
+
+
+def build_station_rollup(_dcf_df):
+    """
+    Roll up the daily commuting flows that transfer at public transport stations.
+    Parameters:
+        _dcf_df (DataFrame): The daily commuting flows, as returned by build_daily_commuting_flow_df or identify_commuting_category_table, or a chunk of the output of run_out_of_core_pipeline.
+    Returns:
+        DataFrame: Indexed by station_id and direction, with the number of users, the sum of their catchment distances and the counts on the fixed bins of STATION_ROLLUP_COLUMNS.
+            The catchment distance is the distance from the home (riding to the station) or the work location (riding from the station) to the station.
+    """
+    _rollup_df_list = []
+    for _direction, _anchor in TRANSFER_DIRECTION_DICT.items():
+        _transfer_df = _dcf_df[_dcf_df[f'{_direction}_station_id'].notna()]
+        if _transfer_df.empty:
+            continue
+        _station_code, _station_id_array = pd.factorize(_transfer_df[f'{_direction}_station_id'])
+        _station_num = len(_station_id_array)
+        _catchment_distance = np.hypot(
+            _transfer_df[f'{_anchor}_x'].to_numpy(dtype=float) - _transfer_df[f'{_direction}_station_location_x'].to_numpy(dtype=float),
+            _transfer_df[f'{_anchor}_y'].to_numpy(dtype=float) - _transfer_df[f'{_direction}_station_location_y'].to_numpy(dtype=float))
+        _count_array = np.column_stack([
+            np.bincount(_station_code, minlength=_station_num),
+            np.bincount(_station_code, weights=np.nan_to_num(_catchment_distance), minlength=_station_num),
+            _count_bins(_station_code, _station_num, _get_hour_array(_transfer_df['moment_leave_home']), HOUR_BIN_EDGES),
+            _count_bins(_station_code, _station_num, _get_hour_array(_transfer_df['moment_leave_work']), HOUR_BIN_EDGES),
+            _count_bins(_station_code, _station_num, _catchment_distance, DISTANCE_BIN_EDGES)])
+        _rollup_df_list.append(pd.DataFrame(
+            _count_array, columns=STATION_ROLLUP_COLUMNS,
+            index=pd.MultiIndex.from_arrays([_station_id_array, [_direction] * _station_num],
+                                            names=['station_id', 'direction'])))
+    if not _rollup_df_list:
+        return pd.DataFrame(columns=STATION_ROLLUP_COLUMNS, index=pd.MultiIndex.from_arrays(
+            [[], []], names=['station_id', 'direction']), dtype=float)
+    return pd.concat(_rollup_df_list)
+
+
+def merge_station_rollups(_rollup_df_list):
+    """
+    Merge the rollups of several shards of the results, which only requires summing the counts of the same station and direction.
+    """
+    return pd.concat(_rollup_df_list).groupby(level=['station_id', 'direction']).sum()
+
+
+def build_station_rollup_from_file(_dcf_path, _chunk_size=500000):
+    """
+    Roll up the daily commuting flows stored in a file chunk by chunk, e.g. the output of run_out_of_core_pipeline.
+    """
+    return merge_station_rollups([build_station_rollup(_chunk) for _chunk in
+                                  iter_record_chunks(_dcf_path, _chunk_size, _DCF_ROLLUP_FIELDS)])
+
+
+def get_histogram_percentile(_count_array, _bin_edges, _percentile):
+    """
+    Estimate a percentile of each row of binned counts, interpolating linearly within the bin.
+    Parameters:
+        _count_array (ndarray): The counts of each row on the bins, with shape (n, number of bins).
+        _bin_edges (ndarray): The edges of the bins.
+        _percentile (float): The percentile between 0 and 100.
+    Returns:
+        ndarray: The estimated percentile of each row, NaN for the rows without any count.
+    """
+    _cumulative_count = np.cumsum(_count_array, axis=1)
+    _target = _cumulative_count[:, -1] * _percentile / 100
+    _bin_index = np.minimum((_cumulative_count < _target[:, None]).sum(axis=1), _count_array.shape[1] - 1)
+    _row_index = np.arange(len(_count_array))
+    _previous_count = _cumulative_count[_row_index, _bin_index] - _count_array[_row_index, _bin_index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        _fraction = np.clip((_target - _previous_count) / _count_array[_row_index, _bin_index], 0, 1)
+        _percentile_array = _bin_edges[_bin_index] + _fraction * np.diff(_bin_edges)[_bin_index]
+    _percentile_array[_cumulative_count[:, -1] == 0] = np.nan
+    return _percentile_array
+
+
+def summarize_station_rollup(_rollup_df, _public_station_df, _level='entrance', _percentile_list=(50, 75, 90)):
+    """
+    Summarize a rollup per station entrance or per metro station.
+    Parameters:
+        _rollup_df (DataFrame): The rollup returned by build_station_rollup or merge_station_rollups.
+        _public_station_df (DataFrame): The metro entrances, with the fields of metro_entrance_2021.csv.
+        _level (str): 'entrance' to summarize by pid, or 'station' to summarize the entrances of the same metro station together, default is 'entrance'.
+        _percentile_list (tuple): The percentiles of the catchment distance, default is (50, 75, 90).
+    Returns:
+        DataFrame: One row per entrance or station, with the number of users, the hourly histograms of moment_leave_home and moment_leave_work,
+            and the mean and percentiles of the catchment distance, all by direction. The stations of the rollup that are missing from _public_station_df,
+            e.g. the bus stations, are kept under their station_id in the pid or metro field, with is_matched False and without the other fields.
+    """
+    if _level == 'entrance':
+        _key_fields = ['pid', 'name', 'metro', 'metro_en', 'x_coord', 'y_coord']
+        _group_field = 'pid'
+    elif _level == 'station':
+        _key_fields = ['metro', 'metro_en']
+        _group_field = 'metro'
+    else:
+        raise ValueError(f'level must be entrance or station, got {_level}')
+    _rollup_df = _rollup_df.reset_index().merge(_public_station_df[['pid', 'metro']].rename(columns={'pid': '_pid'}),
+                                                left_on='station_id', right_on='_pid', how='left')
+    _rollup_df['pid'] = _rollup_df['station_id']
+    # The stations missing from _public_station_df are grouped under their station_id rather than dropped
+    _is_unmatched = _rollup_df['_pid'].isna()
+    _rollup_df.loc[_is_unmatched, 'metro'] = _rollup_df.loc[_is_unmatched, 'station_id']
+    _rollup_df = _rollup_df.groupby([_group_field, 'direction'])[STATION_ROLLUP_COLUMNS].sum()
+    _summary_df = pd.concat([
+        _public_station_df[_key_fields].drop_duplicates(_group_field).assign(is_matched=True),
+        pd.DataFrame({_group_field: _rollup_df.index.get_level_values(_group_field)[
+            ~_rollup_df.index.get_level_values(_group_field).isin(_public_station_df[_group_field])].unique(),
+                      'is_matched': False})]).set_index(_group_field)
+
+    _time_columns = _LEAVE_HOME_COLUMNS + _LEAVE_WORK_COLUMNS
+    _direction_summary_df_list = []
+    for _direction in TRANSFER_DIRECTION_DICT.keys():
+        if _direction in _rollup_df.index.get_level_values('direction'):
+            _direction_df = _rollup_df.xs(_direction, level='direction')
+        else:
+            _direction_df = pd.DataFrame(columns=STATION_ROLLUP_COLUMNS, dtype=float)
+        _direction_summary_df = pd.DataFrame({f'{_direction}_user_num': _direction_df['user_num']})
+        with np.errstate(invalid='ignore', divide='ignore'):
+            _direction_summary_df[f'{_direction}_catchment_mean'] = \
+                _direction_df['catchment_distance_sum'] / _direction_df['user_num']
+        _distance_count_array = _direction_df[_DISTANCE_COLUMNS].to_numpy(dtype=float)
+        for _percentile in _percentile_list:
+            _direction_summary_df[f'{_direction}_catchment_p{_percentile}'] = get_histogram_percentile(
+                _distance_count_array, DISTANCE_BIN_EDGES, _percentile) if len(_direction_df) else []
+        # The time profile of each direction is kept apart, the same as the catchment
+        _direction_time_columns = [f'{_direction}_{_column}' for _column in _time_columns]
+        _direction_summary_df = pd.concat([_direction_summary_df, pd.DataFrame(
+            _direction_df[_time_columns].to_numpy(), columns=_direction_time_columns, index=_direction_df.index)], axis=1)
+        _direction_summary_df_list.append(_direction_summary_df.reindex(_summary_df.index))
+    _summary_df = pd.concat([_summary_df] + _direction_summary_df_list, axis=1)
+    _count_columns = [_c for _c in _summary_df.columns if _c.endswith('user_num') or '_leave_' in _c]
+    _summary_df = pd.concat([_summary_df.drop(columns=_count_columns), _summary_df[_count_columns].fillna(0).astype(int)],
+                            axis=1)[_summary_df.columns]
+    _summary_df['transfer_user_num'] = _summary_df[[f'{_d}_user_num' for _d in TRANSFER_DIRECTION_DICT.keys()]].sum(axis=1)
+    return _summary_df[_summary_df['transfer_user_num'] > 0].reset_index()
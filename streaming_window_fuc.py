@@ -0,0 +1,411 @@
+# encoding: utf-8
+# Monitor the commuting patterns of users over a sliding window of days. Each user keeps the spatial flow clusters of its
+# weekday ride records in the window, with the sums of their OD points, and the unmerged spatiotemporal flow clusters of each
+# of them. A new ride record joins the least dissimilar spatial flow cluster or starts one of its own, and an expired ride
+# record leaves its spatial flow cluster. At each evaluation only the spatial flow clusters that gained or lost ride records,
+# together with their neighbours, are re-clustered with the batch greedy clustering, and only their spatiotemporal flow
+# clusters are extracted again. The activity_weekdays / 5 threshold, the merging of the neighbouring spatiotemporal flow
+# clusters and the decision tree are applied to the whole user, as in the batch mode.
+#
+# The greedy clustering depends on all the ride records at once, so the spatial flow clusters kept this way may differ from
+# the ones of the batch mode, e.g. when a new ride record bridges two spatial flow clusters that are not neighbours. The
+# difference is bounded by re-clustering a user from scratch, which gives the same results as process_all_users on the ride
+# records of the window ordered by date, once the ride records added or expired since its last full re-clustering exceed
+# _max_incremental_rate of its ride records in the window. See DEFAULT_MAX_INCREMENTAL_RATE for the measured difference.
+
+import copy
+import datetime
+import numpy as np
+from chinese_calendar import is_workday
+from utils import get_distance
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters, extract_heavy_user_spatial_flow_clusters, \
+    calculate_spatial_dissimilarity_array
+from spatiotemporal_flow_clustering_fuc import cluster_sfc_into_stfc, cluster_heavy_sfc_into_stfc, \
+    merge_neighbor_spatiotemporal_flow_clusters, HEAVY_SFC_RECORD_NUM
+from ruled_base_decision_tress_fuc import extract_candidate_commuting_flows, identify_user_commuting_category
+from out_of_core_processing_fuc import DEFAULT_PIPELINE_PARAMS, HEAVY_USER_RECORD_NUM
+
+# Measured with diff_daily_commuting_flows against process_all_users on the synthetic records of equivalence_harness_fuc
+# (40 users x 300 ride records, seed 5, a window of 28 days checked every 7 days, 520 user-windows): none of the rates 0,
+# 0.5 and 1 gives any difference, while streaming all the days takes 23.8, 17.3 and 13.9 s respectively
+DEFAULT_MAX_INCREMENTAL_RATE = 0.5
+
+# The unchanged spatial flow clusters re-clustered together with a changed one. The batch greedy clustering merges two
+# spatial flow clusters within a spatial dissimilarity of 1 of each other, and a ride record at the edge of one of them
+# can bridge it to a spatial flow cluster about twice as far, which a neighbourhood of 1 misses (116 of the 520
+# user-windows measured for DEFAULT_MAX_INCREMENTAL_RATE differ with it)
+_NEIGHBOUR_SPATIAL_DISSIMILARITY = 2
+
+
+class _WindowSpatialCluster:
+    def __init__(self):
+        """
+        A spatial flow cluster of the window, which keeps the sums of the OD points of its ride records, so that its mean flow
+        follows the ride records that join and leave it without re-clustering.
+        """
+        self.uuid_set = set()
+        self.origin_sum = np.zeros(2)
+        self.destination_sum = np.zeros(2)
+        # The SpatialClusterFlow object of the last re-clustering, its unmerged spatiotemporal flow clusters and the ride
+        # record that names it, all reset once its ride records change
+        self.sfc_obj = None
+        self.stfc_obj_list = None
+        self.lead_uuid = None
+
+    @property
+    def record_num(self):
+        return len(self.uuid_set)
+
+    @property
+    def origin(self):
+        return self.origin_sum / self.record_num
+
+    @property
+    def destination(self):
+        return self.destination_sum / self.record_num
+
+    def add_record(self, _uuid, _origin, _destination):
+        self.uuid_set.add(_uuid)
+        self.origin_sum += _origin
+        self.destination_sum += _destination
+        self.sfc_obj = None
+        self.stfc_obj_list = None
+
+    def remove_record(self, _uuid, _origin, _destination):
+        self.uuid_set.discard(_uuid)
+        self.origin_sum -= _origin
+        self.destination_sum -= _destination
+        self.sfc_obj = None
+        self.stfc_obj_list = None
+
+
+def _copy_stfc(_stfc_obj):
+    # The merging replaces the flow and the IDs and extends the ride records and the time lists, while the details of the
+    # ride records are shared, so only the containers are copied
+    _copied_stfc_obj = copy.copy(_stfc_obj)
+    _copied_stfc_obj.including_record_detail = dict(_stfc_obj.including_record_detail)
+    _copied_stfc_obj.record_start_time_list = list(_stfc_obj.record_start_time_list)
+    _copied_stfc_obj.record_end_time_list = list(_stfc_obj.record_end_time_list)
+    _copied_stfc_obj.time_span = list(_stfc_obj.time_span)
+    return _copied_stfc_obj
+
+
+def _get_od(_record):
+    return (np.array([_record['origin_x'], _record['origin_y']], dtype=float),
+            np.array([_record['destination_x'], _record['destination_y']], dtype=float))
+
+
+class UserWindowState:
+    def __init__(self, _params=None, _workers=None):
+        """
+        The weekday ride records of one user in the window, in the order they were added, and their spatial flow clusters.
+        Parameters:
+            _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+            _workers (int): The number of threads used to re-cluster a large group of ride records, default is None.
+        """
+        self.params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+        self.workers = _workers
+        self.record_dict = {}
+        self.date_record_num = {}
+        self.cluster_dict = {}
+        self.record_cluster_dict = {}
+        self.changed_cluster_key_set = set()
+        # The number of ride records added or expired since the last full re-clustering
+        self.incremental_record_num = 0
+        self._next_cluster_key = 0
+
+    @property
+    def activity_weekdays(self):
+        return len(self.date_record_num)
+
+    def _new_cluster(self):
+        _cluster_key = self._next_cluster_key
+        self._next_cluster_key += 1
+        self.cluster_dict[_cluster_key] = _WindowSpatialCluster()
+        return _cluster_key
+
+    def _get_dissimilarity_array(self, _origin, _destination, _cluster_key_list):
+        _cluster_list = [self.cluster_dict[_key] for _key in _cluster_key_list]
+        _record_num_array = np.array([_cluster.record_num for _cluster in _cluster_list], dtype=float)[:, None]
+        _origin_array = np.array([_cluster.origin_sum for _cluster in _cluster_list]).reshape(-1, 2) / _record_num_array
+        _destination_array = np.array([_cluster.destination_sum for _cluster in _cluster_list]).reshape(-1, 2) / _record_num_array
+        _length_array = np.hypot(*(_destination_array - _origin_array).T)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return calculate_spatial_dissimilarity_array(
+                _origin, _destination, get_distance(_origin, _destination), _origin_array, _destination_array, _length_array,
+                self.params['size_coefficient'], self.params['max_circle_boundary_radius'])
+
+    def add_record(self, _record):
+        """
+        Add a weekday ride record of the user to the window, into the least dissimilar spatial flow cluster within a spatial
+        dissimilarity of 1, or into a spatial flow cluster of its own.
+        Returns:
+            bool: Whether the ride record is new.
+        """
+        _uuid = _record['uuid']
+        if _uuid in self.record_dict:
+            return False
+        self.record_dict[_uuid] = _record
+        self.date_record_num[_record['date']] = self.date_record_num.get(_record['date'], 0) + 1
+        _origin, _destination = _get_od(_record)
+        _cluster_key_list = list(self.cluster_dict.keys())
+        _cluster_key = None
+        if _cluster_key_list:
+            _flows_sd = self._get_dissimilarity_array(_origin, _destination, _cluster_key_list)
+            if np.nanmin(_flows_sd, initial=np.inf) <= 1:
+                _cluster_key = _cluster_key_list[int(np.nanargmin(_flows_sd))]
+        if _cluster_key is None:
+            _cluster_key = self._new_cluster()
+        self.cluster_dict[_cluster_key].add_record(_uuid, _origin, _destination)
+        self.record_cluster_dict[_uuid] = _cluster_key
+        self.changed_cluster_key_set.add(_cluster_key)
+        self.incremental_record_num += 1
+        return True
+
+    def expire_record(self, _uuid):
+        """
+        Remove a ride record of the user from the window and from its spatial flow cluster.
+        Returns:
+            bool: Whether the ride record was in the window.
+        """
+        _record = self.record_dict.pop(_uuid, None)
+        if _record is None:
+            return False
+        _date = _record['date']
+        self.date_record_num[_date] -= 1
+        if self.date_record_num[_date] == 0:
+            del self.date_record_num[_date]
+        _cluster_key = self.record_cluster_dict.pop(_uuid)
+        _cluster = self.cluster_dict[_cluster_key]
+        _cluster.remove_record(_uuid, *_get_od(_record))
+        if _cluster.record_num == 0:
+            del self.cluster_dict[_cluster_key]
+            self.changed_cluster_key_set.discard(_cluster_key)
+        else:
+            self.changed_cluster_key_set.add(_cluster_key)
+        self.incremental_record_num += 1
+        return True
+
+    def get_record_list(self):
+        """
+        Get the ride records of the user in the window ordered by date, keeping the order they were added within the same date,
+        so that a late ride record is clustered in the same order as in the batch mode.
+        Returns:
+            list: The ride records, where each record is a dictionary.
+        """
+        return sorted(self.record_dict.values(), key=lambda _record: _record['date'])
+
+    def _recluster(self, _cluster_key_list, _record_list):
+        """
+        Replace the given spatial flow clusters with the ones of the batch greedy clustering of their ride records in the order of _record_list.
+        """
+        _uuid_set = set().union(*[self.cluster_dict.pop(_key).uuid_set for _key in _cluster_key_list])
+        _group_record_list = [_record for _record in _record_list if _record['uuid'] in _uuid_set]
+        # No threshold is applied here, since the activity weekdays change with the window
+        if self.workers is not None and len(_group_record_list) >= HEAVY_USER_RECORD_NUM:
+            _sfc_obj_dict = extract_heavy_user_spatial_flow_clusters(
+                _group_record_list, 0, _size_coefficient=self.params['size_coefficient'],
+                _max_circle_boundary_radius=self.params['max_circle_boundary_radius'], _workers=self.workers)
+        else:
+            _sfc_obj_dict = extract_spatial_flow_clusters(
+                _group_record_list, 0, _size_coefficient=self.params['size_coefficient'],
+                _max_circle_boundary_radius=self.params['max_circle_boundary_radius'])
+        for _sfc_obj in _sfc_obj_dict.values():
+            _cluster_key = self._new_cluster()
+            _cluster = self.cluster_dict[_cluster_key]
+            for _uuid in _sfc_obj.including_record_detail.keys():
+                _cluster.add_record(_uuid, *_get_od(self.record_dict[_uuid]))
+                self.record_cluster_dict[_uuid] = _cluster_key
+            # The batch mode names a spatial flow cluster after the row of the ride record that gathered it
+            _cluster.sfc_obj = _sfc_obj
+            _cluster.lead_uuid = _group_record_list[int(_sfc_obj.sfc_id[3:])]['uuid']
+
+    def update_clusters(self, _max_incremental_rate=DEFAULT_MAX_INCREMENTAL_RATE):
+        """
+        Re-cluster the spatial flow clusters that changed since the last update, together with the unchanged spatial flow clusters
+        within _NEIGHBOUR_SPATIAL_DISSIMILARITY of them, or all the ride records once the ride records added or expired since the
+        last full re-clustering exceed _max_incremental_rate of the ride records in the window.
+        Parameters:
+            _max_incremental_rate (float): The rate of changed ride records that triggers a full re-clustering, default is DEFAULT_MAX_INCREMENTAL_RATE.
+        Returns:
+            list: The ride records of the user in the window, ordered as by get_record_list.
+        """
+        _record_list = self.get_record_list()
+        if self.incremental_record_num > _max_incremental_rate * len(_record_list):
+            _cluster_key_list = list(self.cluster_dict.keys())
+            self.incremental_record_num = 0
+        else:
+            _cluster_key_set = set(self.changed_cluster_key_set)
+            _unchanged_key_list = [_key for _key in self.cluster_dict.keys() if _key not in _cluster_key_set]
+            for _key in self.changed_cluster_key_set:
+                if not _unchanged_key_list:
+                    break
+                _cluster = self.cluster_dict[_key]
+                _flows_sd = self._get_dissimilarity_array(_cluster.origin, _cluster.destination, _unchanged_key_list)
+                _cluster_key_set.update(np.array(_unchanged_key_list)[_flows_sd <= _NEIGHBOUR_SPATIAL_DISSIMILARITY].tolist())
+            _cluster_key_list = sorted(_cluster_key_set)
+            # Re-clustering all the spatial flow clusters, e.g. of a new user, is a full re-clustering
+            if len(_cluster_key_list) == len(self.cluster_dict):
+                self.incremental_record_num = 0
+        if _cluster_key_list:
+            self._recluster(_cluster_key_list, _record_list)
+        self.changed_cluster_key_set = set()
+        return _record_list
+
+    def get_spatiotemporal_flow_clusters(self, _max_incremental_rate=DEFAULT_MAX_INCREMENTAL_RATE):
+        """
+        Update the spatial flow clusters and get the final spatiotemporal flow clusters of the user, where the spatiotemporal flow
+        clusters of the unchanged spatial flow clusters are reused.
+        Parameters:
+            _max_incremental_rate (float): The rate of changed ride records that triggers a full re-clustering, default is DEFAULT_MAX_INCREMENTAL_RATE.
+        Returns:
+            dict: The final spatiotemporal flow clusters of the user, where the keys are STFC IDs and the values are SpatioTemporalFlowCluster objects.
+        """
+        _record_list = self.update_clusters(_max_incremental_rate)
+        _row_dict = {_record['uuid']: _row for _row, _record in enumerate(_record_list)}
+        _min_sfc_threshold = self.activity_weekdays / 5
+        _unmerged_spatiotemporal_flow_cluster_dict = {}
+        # The spatial flow clusters are visited in the order of their first ride records, as in the batch mode
+        for _cluster in sorted(self.cluster_dict.values(), key=lambda _c: min(_row_dict[_uuid] for _uuid in _c.uuid_set)):
+            if _cluster.record_num < _min_sfc_threshold:
+                continue
+            _sfc_id = f'sfc{str(_row_dict[_cluster.lead_uuid]).zfill(3)}'
+            if _cluster.stfc_obj_list is None:
+                if _cluster.record_num >= HEAVY_SFC_RECORD_NUM:
+                    _init_bike_record_with_stfc_dict = cluster_heavy_sfc_into_stfc(
+                        _cluster.sfc_obj, self.params['expansion_coefficient'])
+                else:
+                    _init_bike_record_with_stfc_dict = cluster_sfc_into_stfc(
+                        _cluster.sfc_obj, self.params['expansion_coefficient'])
+                _cluster.stfc_obj_list = list({_stfc_obj.stfc_id: _stfc_obj for _stfc_obj in
+                                               _init_bike_record_with_stfc_dict.values()}.values())
+            # The merging changes the spatiotemporal flow clusters, so it works on copies renamed after the current row
+            for _stfc_obj in map(_copy_stfc, _cluster.stfc_obj_list):
+                _stfc_obj.stfc_id = f"{_stfc_obj.stfc_id.split('_')[0]}_{_sfc_id}"
+                _stfc_obj.sfc_id = _sfc_id
+                _unmerged_spatiotemporal_flow_cluster_dict[_stfc_obj.stfc_id] = _stfc_obj
+        return merge_neighbor_spatiotemporal_flow_clusters(
+            _unmerged_spatiotemporal_flow_cluster_dict, _expansion_coefficient=self.params['expansion_coefficient'],
+            _size_coefficient=self.params['size_coefficient'],
+            _max_circle_boundary_radius=self.params['max_circle_boundary_radius'])
+
+
+class StreamingCommutingMonitor:
+    def __init__(self, _public_station_k_tree, _public_station_df, _window_days=28, _params=None, _workers=None,
+                 _max_incremental_rate=DEFAULT_MAX_INCREMENTAL_RATE):
+        """
+        Keep the daily commuting flows of all users up to date over a sliding window of days.
+        Parameters:
+            _public_station_k_tree: A k-d tree data structure for quickly querying the nearest metro entrances or bus station.
+            _public_station_df: A DataFrame containing information about metro entrances or bus station.
+            _window_days (int): The number of days in the window, default is 28.
+            _params (dict): The clustering and decision-tree parameters, default is DEFAULT_PIPELINE_PARAMS.
+            _workers (int): The number of threads used to re-cluster a large group of ride records, default is None.
+            _max_incremental_rate (float): The rate of the ride records of a user added or expired since its last full re-clustering
+                that triggers a full re-clustering, default is DEFAULT_MAX_INCREMENTAL_RATE. 0 re-clusters every changed user from
+                scratch, which gives the same results as process_all_users.
+        """
+        self.public_station_k_tree = _public_station_k_tree
+        self.public_station_df = _public_station_df
+        self.window_days = _window_days
+        self.params = DEFAULT_PIPELINE_PARAMS if _params is None else {**DEFAULT_PIPELINE_PARAMS, **_params}
+        self.workers = _workers
+        self.max_incremental_rate = _max_incremental_rate
+        self.current_date = None
+        self.user_state_dict = {}
+        # date -> [(uid, uuid)], used to expire the ride records of a whole day at once
+        self.date_record_dict = {}
+        self.changed_uid_set = set()
+        self.dcf_dict = {}
+        self._is_weekday_dict = {}
+
+    def _is_weekday(self, _date):
+        if _date not in self._is_weekday_dict:
+            self._is_weekday_dict[_date] = is_workday(datetime.date.fromisoformat(_date))
+        return self._is_weekday_dict[_date]
+
+    def _get_window_start_date(self):
+        return (datetime.date.fromisoformat(self.current_date) - datetime.timedelta(days=self.window_days - 1)).isoformat()
+
+    def add_records(self, _record_list):
+        """
+        Add the ride records to the windows of their users, ignoring the ones on non-working days or before the window.
+        Parameters:
+            _record_list (list): The ride records, where each record is a dictionary with the fields of RECORD_COLUMN_DTYPES.
+        Returns:
+            int: The number of added ride records.
+        """
+        _added_record_num = 0
+        for _record in _record_list:
+            _date = _record['date']
+            if not self._is_weekday(_date) or (self.current_date is not None and _date < self._get_window_start_date()):
+                continue
+            _uid = _record['uid']
+            if _uid not in self.user_state_dict:
+                self.user_state_dict[_uid] = UserWindowState(self.params, self.workers)
+            if self.user_state_dict[_uid].add_record(_record):
+                self.date_record_dict.setdefault(_date, []).append((_uid, _record['uuid']))
+                self.changed_uid_set.add(_uid)
+                _added_record_num += 1
+        return _added_record_num
+
+    def advance_to(self, _date):
+        """
+        Move the end of the window to the given date and expire the ride records that fall out of the window.
+        Parameters:
+            _date (str): The last date of the window, in the format YYYY-MM-DD.
+        Returns:
+            int: The number of expired ride records.
+        """
+        self.current_date = _date
+        _window_start_date = self._get_window_start_date()
+        _expired_record_num = 0
+        for _expired_date in [_d for _d in self.date_record_dict.keys() if _d < _window_start_date]:
+            for _uid, _uuid in self.date_record_dict.pop(_expired_date):
+                _user_state = self.user_state_dict[_uid]
+                if _user_state.expire_record(_uuid):
+                    self.changed_uid_set.add(_uid)
+                    _expired_record_num += 1
+                if not _user_state.record_dict:
+                    del self.user_state_dict[_uid]
+        return _expired_record_num
+
+    def evaluate(self):
+        """
+        Update the clusters of the users whose ride records changed since the last evaluation and re-evaluate their daily commuting flows.
+        Returns:
+            dict: The re-evaluated users, where the keys are uids and the values are DailyCommutingFlow objects, or None if no candidate commuting flow is identified.
+        """
+        _evaluated_dcf_dict = {}
+        for _uid in self.changed_uid_set:
+            _dcf_obj = None
+            if _uid in self.user_state_dict:
+                _spatiotemporal_flow_cluster_dict = self.user_state_dict[_uid].get_spatiotemporal_flow_clusters(
+                    self.max_incremental_rate)
+                _candidate_commuting_flow_dict = extract_candidate_commuting_flows(
+                    _spatiotemporal_flow_cluster_dict, self.public_station_k_tree, self.public_station_df,
+                    _boundary_circle_radius=self.params['boundary_circle_radius'],
+                    _working_hours_threshold=self.params['working_hours_threshold'],
+                    _transfer_distance_threshold=self.params['transfer_distance_threshold'])
+                if _candidate_commuting_flow_dict:
+                    _dcf_obj = identify_user_commuting_category(_candidate_commuting_flow_dict)
+            if _dcf_obj is None:
+                self.dcf_dict.pop(_uid, None)
+            else:
+                self.dcf_dict[_uid] = _dcf_obj
+            _evaluated_dcf_dict[_uid] = _dcf_obj
+        self.changed_uid_set = set()
+        return _evaluated_dcf_dict
+
+    def step(self, _date, _record_list):
+        """
+        Advance the window by one day: expire the ride records before the window, add the ride records of the day and re-evaluate the changed users.
+        Parameters:
+            _date (str): The date of the new ride records, which becomes the last date of the window, in the format YYYY-MM-DD.
+            _record_list (list): The ride records of the day, where each record is a dictionary.
+        Returns:
+            dict: The re-evaluated users, as returned by evaluate.
+        """
+        self.advance_to(_date)
+        self.add_records(_record_list)
+        return self.evaluate()
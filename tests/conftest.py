@@ -0,0 +1,21 @@
+# encoding: utf-8
+# The modules of the framework are kept at the root of the repository, so it is put on the path of the tests
+
+import os
+import sys
+import pandas as pd
+import pytest
+import scipy.spatial as spt
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture(scope='session')
+def public_station_df():
+    return pd.read_csv(os.path.join(ROOT_DIR, 'data', 'metro_entrance_2021.csv'))
+
+
+@pytest.fixture(scope='session')
+def public_station_k_tree(public_station_df):
+    return spt.cKDTree(public_station_df[['x_coord', 'y_coord']].to_numpy())
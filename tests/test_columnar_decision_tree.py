@@ -0,0 +1,44 @@
+# encoding: utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+from utils import time_to_hour
+from columnar_decision_tree_fuc import time_str_to_hour, build_candidate_commuting_flow_table, \
+    identify_commuting_category_table, benchmark_commuting_category_table, DAILY_COMMUTING_FLOW_COLUMNS
+from out_of_core_processing_fuc import process_all_users
+from ruled_base_decision_tress_fuc import build_daily_commuting_flow_df
+from equivalence_harness_fuc import make_synthetic_records, diff_daily_commuting_flows
+
+
+@pytest.fixture(scope='module')
+def each_candidate_commuting_flow_dict(public_station_k_tree, public_station_df):
+    _each_user_result_dict = process_all_users(make_synthetic_records(40, 150, _seed=3, _public_station_df=public_station_df),
+                                               public_station_k_tree, public_station_df, _debug=True)
+    return {_uid: _result['cf'] for _uid, _result in _each_user_result_dict.items() if _result['cf']}
+
+
+@pytest.mark.parametrize('_time_str_list', [['00:00:00', '07:05:03', '23:59:59'], ['7:05:03', '12:00:00'],
+                                            ['107:05:03', '08:30:00'], []])
+def test_time_str_to_hour(_time_str_list):
+    np.testing.assert_array_equal(time_str_to_hour(pd.Series(_time_str_list, dtype=object)),
+                                  np.array([time_to_hour(_t) for _t in _time_str_list], dtype=float))
+
+
+def test_columnar_matches_per_user(each_candidate_commuting_flow_dict):
+    from ruled_base_decision_tress_fuc import identify_user_commuting_category
+    _reference_dcf_df = build_daily_commuting_flow_df({_uid: identify_user_commuting_category(_cf_set_dict) for
+                                                       _uid, _cf_set_dict in each_candidate_commuting_flow_dict.items()})
+    _columnar_dcf_df = identify_commuting_category_table(build_candidate_commuting_flow_table(each_candidate_commuting_flow_dict))
+    assert diff_daily_commuting_flows(_reference_dcf_df, _columnar_dcf_df) == []
+
+
+def test_empty_table():
+    assert list(identify_commuting_category_table(build_candidate_commuting_flow_table({})).columns) == \
+           ['uid'] + DAILY_COMMUTING_FLOW_COLUMNS
+
+
+def test_benchmark(each_candidate_commuting_flow_dict):
+    _benchmark_df = benchmark_commuting_category_table(each_candidate_commuting_flow_dict, (10, 100))
+    assert _benchmark_df['user_num'].tolist() == [10, 100]
+    assert (_benchmark_df[['reference_seconds', 'table_seconds', 'columnar_seconds']] > 0).all().all()
@@ -0,0 +1,60 @@
+# encoding: utf-8
+
+import numpy as np
+import pytest
+from compact_storage_fuc import CoordinateFrame, CompactRecordTable, extract_compact_spatial_flow_clusters, \
+    DEFAULT_UNIT_PER_METER
+from out_of_core_processing_fuc import select_weekday_records
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters
+from equivalence_harness_fuc import make_synthetic_records, diff_spatial_flow_clusters
+
+
+def test_coordinate_frame_round_trip():
+    _frame = CoordinateFrame(12685000, 2575000)
+    _point_array = np.array([[12685000.1234, 2575000.9876], [12600000.0, 2500000.0]])
+    _decoded_array = _frame.decode(_frame.encode(_point_array[:, 0], _point_array[:, 1]))
+    np.testing.assert_allclose(_decoded_array, _point_array, rtol=0, atol=0.5 / DEFAULT_UNIT_PER_METER + 1e-9)
+    with pytest.raises(ValueError):
+        _frame.encode([12685000 + 3e6], [2575000])
+
+
+def test_user_slices(public_station_df):
+    _record_df = make_synthetic_records(3, 50, _seed=1, _public_station_df=public_station_df).sample(frac=1, random_state=0)
+    _table = CompactRecordTable.from_df(_record_df)
+    for _uid, _user_record_df in _record_df.groupby('uid'):
+        _record_list = _table.get_user_record_list(_uid)
+        assert sorted(_r['uuid'] for _r in _record_list) == sorted(_user_record_df['uuid'])
+        _record_dict = {_r['uuid']: _r for _r in _record_list}
+        for _, _row in _user_record_df.iterrows():
+            assert _record_dict[_row['uuid']]['start_time'] == _row['start_time']
+            assert abs(_record_dict[_row['uuid']]['origin_x'] - _row['origin_x']) <= 0.5 / DEFAULT_UNIT_PER_METER + 1e-6
+
+
+def test_compact_spatial_flow_clusters_at_default_unit(public_station_df):
+    # 5 x 800 is the case where one user differs from the float path with centimetres
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(
+        make_synthetic_records(5, 800, _public_station_df=public_station_df))
+    _table = CompactRecordTable.from_df(_weekday_record_df)
+    for _uid, _user_record_df in _weekday_record_df.groupby('uid', sort=False):
+        assert diff_spatial_flow_clusters(
+            extract_spatial_flow_clusters(_user_record_df.to_dict(orient='records'), _activity_weekdays_dict[_uid]),
+            extract_compact_spatial_flow_clusters(_table, _uid, _activity_weekdays_dict[_uid]),
+            1 / DEFAULT_UNIT_PER_METER) == []
+
+
+@pytest.mark.parametrize('_user_num, _record_num, _seed', [(8, 150, 3), (3, 400, 2), (0, 0, 0)])
+def test_process_all_users_with_compact_storage(public_station_k_tree, public_station_df, _user_num, _record_num, _seed):
+    from out_of_core_processing_fuc import process_all_users
+    from ruled_base_decision_tress_fuc import build_daily_commuting_flow_df
+    from equivalence_harness_fuc import diff_daily_commuting_flows
+    _record_df = make_synthetic_records(_user_num, _record_num, _seed, _public_station_df=public_station_df)
+    _float_result_dict = process_all_users(_record_df, public_station_k_tree, public_station_df)
+    _compact_result_dict = process_all_users(_record_df, public_station_k_tree, public_station_df,
+                                             _unit_per_meter=DEFAULT_UNIT_PER_METER)
+    assert list(_compact_result_dict) == list(_float_result_dict)
+    _float_dcf_dict = {_uid: _r['dcf'] for _uid, _r in _float_result_dict.items() if _r['dcf'] is not None}
+    _compact_dcf_dict = {_uid: _r['dcf'] for _uid, _r in _compact_result_dict.items() if _r['dcf'] is not None}
+    assert list(_compact_dcf_dict) == list(_float_dcf_dict)
+    if _float_dcf_dict:
+        assert diff_daily_commuting_flows(build_daily_commuting_flow_df(_float_dcf_dict),
+                                          build_daily_commuting_flow_df(_compact_dcf_dict), 1e-3) == []
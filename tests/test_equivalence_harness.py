@@ -0,0 +1,53 @@
+# encoding: utf-8
+
+import pytest
+from equivalence_harness_fuc import make_synthetic_records, run_equivalence_harness, HARNESS_STAGE_LIST
+from streaming_window_fuc import DEFAULT_MAX_INCREMENTAL_RATE
+
+
+def _get_different_num_dict(_report_df):
+    return dict(zip(_report_df['stage'], _report_df['different_num']))
+
+
+@pytest.mark.parametrize('_user_num, _record_num, _seed', [(5, 800, 0), (3, 400, 2), (6, 120, 3)])
+def test_harness_without_stream(public_station_k_tree, public_station_df, _user_num, _record_num, _seed):
+    # 5 x 800 with seed 0 is the case where the compact storage differs from the float path with centimetres
+    _report_df, _diff_dict = run_equivalence_harness(
+        make_synthetic_records(_user_num, _record_num, _seed, _public_station_df=public_station_df),
+        public_station_k_tree, public_station_df, _window_days=None)
+    assert _report_df['stage'].tolist() == HARNESS_STAGE_LIST
+    assert _report_df.set_index('stage')['compared_num']['sfc_heavy_user'] == _user_num
+    assert _report_df['different_num'].sum() == 0, _diff_dict
+
+
+@pytest.mark.parametrize('_max_incremental_rate', [0, DEFAULT_MAX_INCREMENTAL_RATE])
+@pytest.mark.parametrize('_user_num, _record_num, _seed', [(8, 150, 5), (4, 300, 1)])
+def test_harness_with_stream(public_station_k_tree, public_station_df, _user_num, _record_num, _seed, _max_incremental_rate):
+    _report_df, _diff_dict = run_equivalence_harness(
+        make_synthetic_records(_user_num, _record_num, _seed, _public_station_df=public_station_df),
+        public_station_k_tree, public_station_df, _window_check_days=14, _max_incremental_rate=_max_incremental_rate)
+    _report_df = _report_df.set_index('stage')
+    assert _report_df['compared_num']['stream_window'] > 0
+    # The incremental updates are only exact when every changed user is re-clustered from scratch
+    assert _report_df['is_exact']['stream_window'] == (_max_incremental_rate == 0)
+    assert _report_df['different_num'].sum() == 0, _diff_dict
+
+
+def test_harness_reports_approximate_compact_storage(public_station_k_tree, public_station_df):
+    _report_df, _diff_dict = run_equivalence_harness(
+        make_synthetic_records(5, 800, _public_station_df=public_station_df), public_station_k_tree, public_station_df,
+        _unit_per_meter=100, _window_days=None)
+    _report_df = _report_df.set_index('stage')
+    assert not _report_df['is_exact']['sfc_compact']
+    assert _report_df['different_num']['sfc_compact'] > 0
+    assert _report_df.loc[_report_df['is_exact'], 'different_num'].sum() == 0
+
+
+@pytest.mark.parametrize('_user_num, _record_num', [(0, 0), (3, 0)])
+def test_harness_empty(public_station_k_tree, public_station_df, _user_num, _record_num):
+    _report_df, _diff_dict = run_equivalence_harness(
+        make_synthetic_records(_user_num, _record_num, _public_station_df=public_station_df),
+        public_station_k_tree, public_station_df)
+    assert _get_different_num_dict(_report_df) == dict.fromkeys(HARNESS_STAGE_LIST, 0)
+    assert _report_df['compared_num'].sum() == 0
+    assert all(_diff_list == [] for _diff_list in _diff_dict.values())
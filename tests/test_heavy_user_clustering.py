@@ -0,0 +1,48 @@
+# encoding: utf-8
+
+import pytest
+import out_of_core_processing_fuc
+import spatiotemporal_flow_clustering_fuc
+from out_of_core_processing_fuc import select_weekday_records, run_user_pipeline
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters, extract_heavy_user_spatial_flow_clusters
+from spatiotemporal_flow_clustering_fuc import extract_spatiotemporal_flow_clusters, \
+    extract_heavy_user_spatiotemporal_flow_clusters
+from equivalence_harness_fuc import make_synthetic_records, diff_spatial_flow_clusters, \
+    diff_spatiotemporal_flow_clusters
+
+
+@pytest.fixture(scope='module')
+def heavy_user_record(public_station_df):
+    _record_df = make_synthetic_records(1, 600, _seed=7, _od_num=4, _public_station_df=public_station_df)
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(_record_df)
+    return _weekday_record_df.to_dict(orient='records'), _activity_weekdays_dict['synthetic_user0']
+
+
+@pytest.mark.parametrize('_workers', [1, 4, -1, 0])
+def test_heavy_user_spatial_flow_clusters(heavy_user_record, _workers):
+    _record_list, _activity_weekdays = heavy_user_record
+    assert diff_spatial_flow_clusters(
+        extract_spatial_flow_clusters(_record_list, _activity_weekdays),
+        extract_heavy_user_spatial_flow_clusters(_record_list, _activity_weekdays, _workers=_workers)) == []
+
+
+@pytest.mark.parametrize('_heavy_sfc_record_num', [1, 50, 10 ** 9])
+def test_heavy_user_spatiotemporal_flow_clusters(heavy_user_record, monkeypatch, _heavy_sfc_record_num):
+    # Both the vectorized and the original clustering of each spatial flow cluster are exercised
+    monkeypatch.setattr(spatiotemporal_flow_clustering_fuc, 'HEAVY_SFC_RECORD_NUM', _heavy_sfc_record_num)
+    _record_list, _activity_weekdays = heavy_user_record
+    assert diff_spatiotemporal_flow_clusters(
+        extract_spatiotemporal_flow_clusters(extract_spatial_flow_clusters(_record_list, _activity_weekdays)),
+        extract_heavy_user_spatiotemporal_flow_clusters(
+            extract_spatial_flow_clusters(_record_list, _activity_weekdays))) == []
+
+
+@pytest.mark.parametrize('_workers', [-1, 0])
+def test_run_user_pipeline_with_all_cpus(heavy_user_record, public_station_k_tree, public_station_df, monkeypatch,
+                                         _workers):
+    monkeypatch.setattr(out_of_core_processing_fuc, 'HEAVY_USER_RECORD_NUM', 100)
+    _record_list, _activity_weekdays = heavy_user_record
+    _reference_dcf_obj = run_user_pipeline(_record_list, _activity_weekdays, public_station_k_tree, public_station_df)[3]
+    _dcf_obj = run_user_pipeline(_record_list, _activity_weekdays, public_station_k_tree, public_station_df,
+                                 _workers=_workers)[3]
+    assert _dcf_obj.to_record() == _reference_dcf_obj.to_record()
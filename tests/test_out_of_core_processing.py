@@ -0,0 +1,169 @@
+# encoding: utf-8
+
+import os
+import pandas as pd
+import pytest
+import out_of_core_processing_fuc
+from out_of_core_processing_fuc import run_out_of_core_pipeline, process_all_users, _MANIFEST_NAME
+from equivalence_harness_fuc import make_synthetic_records
+
+
+@pytest.fixture(scope='module')
+def record_path(tmp_path_factory, public_station_df):
+    _path = tmp_path_factory.mktemp('records') / 'records.csv'
+    make_synthetic_records(8, 150, _seed=3, _public_station_df=public_station_df).to_csv(_path, index=False)
+    return str(_path)
+
+
+def _read_sorted_output(_output_path):
+    return pd.read_csv(_output_path).sort_values('uid').reset_index(drop=True)
+
+
+def test_out_of_core_matches_in_memory(tmp_path, record_path, public_station_k_tree, public_station_df):
+    _output_path = run_out_of_core_pipeline(record_path, str(tmp_path / 'work'), str(tmp_path / 'dcf.csv'),
+                                            public_station_k_tree, public_station_df, _shard_num=4)
+    _each_user_result_dict = process_all_users(pd.read_csv(record_path), public_station_k_tree, public_station_df)
+    _expected_uid_list = sorted(_uid for _uid, _result in _each_user_result_dict.items() if _result['dcf'] is not None)
+    _output_df = _read_sorted_output(_output_path)
+    assert _output_df['uid'].tolist() == _expected_uid_list
+    for _, _row in _output_df.iterrows():
+        assert _row['commuting_category'] == _each_user_result_dict[_row['uid']]['dcf'].commuting_category
+
+
+def test_resume_after_crash_before_marking_done(tmp_path, record_path, public_station_k_tree, public_station_df):
+    _reference_df = _read_sorted_output(run_out_of_core_pipeline(
+        record_path, str(tmp_path / 'reference_work'), str(tmp_path / 'reference.csv'), public_station_k_tree,
+        public_station_df, _shard_num=4))
+    # The last shard has written its results but the process died before it was marked as done
+    _work_dir = tmp_path / 'work'
+    _output_path = str(tmp_path / 'dcf.csv')
+    run_out_of_core_pipeline(record_path, str(_work_dir), _output_path, public_station_k_tree, public_station_df,
+                             _shard_num=4)
+    _manifest_path = _work_dir / _MANIFEST_NAME
+    _manifest_lines = _manifest_path.read_text(encoding='utf-8').splitlines()
+    _manifest_path.write_text('\n'.join(_manifest_lines[:-1]) + '\n', encoding='utf-8')
+    _resumed_df = _read_sorted_output(run_out_of_core_pipeline(
+        record_path, str(_work_dir), _output_path, public_station_k_tree, public_station_df, _shard_num=4))
+    assert not _resumed_df['uid'].duplicated().any()
+    pd.testing.assert_frame_equal(_resumed_df, _reference_df)
+
+
+def test_resume_after_crash_in_shard(tmp_path, record_path, public_station_k_tree, public_station_df, monkeypatch):
+    _reference_df = _read_sorted_output(run_out_of_core_pipeline(
+        record_path, str(tmp_path / 'reference_work'), str(tmp_path / 'reference.csv'), public_station_k_tree,
+        public_station_df, _shard_num=4))
+    _process_record_shard = out_of_core_processing_fuc.process_record_shard
+    _processed_shard_list = []
+
+    def _crash_on_second_shard(_shard_path, *_args):
+        if len(_processed_shard_list) == 1:
+            raise KeyboardInterrupt
+        _processed_shard_list.append(_shard_path)
+        return _process_record_shard(_shard_path, *_args)
+
+    _work_dir = str(tmp_path / 'work')
+    _output_path = str(tmp_path / 'dcf.csv')
+    monkeypatch.setattr(out_of_core_processing_fuc, 'process_record_shard', _crash_on_second_shard)
+    with pytest.raises(KeyboardInterrupt):
+        run_out_of_core_pipeline(record_path, _work_dir, _output_path, public_station_k_tree, public_station_df,
+                                 _shard_num=4)
+    assert not os.path.exists(_output_path)
+    monkeypatch.setattr(out_of_core_processing_fuc, 'process_record_shard', _process_record_shard)
+    _resumed_df = _read_sorted_output(run_out_of_core_pipeline(
+        record_path, _work_dir, _output_path, public_station_k_tree, public_station_df, _shard_num=4))
+    pd.testing.assert_frame_equal(_resumed_df, _reference_df)
+
+
+def test_out_of_core_empty_input(tmp_path, public_station_k_tree, public_station_df):
+    _record_path = str(tmp_path / 'records.csv')
+    make_synthetic_records(0, 0).to_csv(_record_path, index=False)
+    _output_path = run_out_of_core_pipeline(_record_path, str(tmp_path / 'work'), str(tmp_path / 'dcf.csv'),
+                                            public_station_k_tree, public_station_df, _shard_num=4)
+    assert os.path.exists(_output_path)
+    assert os.path.getsize(_output_path) == 0
+
+
+def test_resume_rejects_other_input_or_params(tmp_path, record_path, public_station_k_tree, public_station_df):
+    _work_dir = str(tmp_path / 'work')
+    _output_path = str(tmp_path / 'dcf.csv')
+    run_out_of_core_pipeline(record_path, _work_dir, _output_path, public_station_k_tree, public_station_df, _shard_num=4)
+    # The same input and parameters resume the completed run
+    run_out_of_core_pipeline(record_path, _work_dir, _output_path, public_station_k_tree, public_station_df, _shard_num=4,
+                             _params={'size_coefficient': 0.3})
+    with pytest.raises(ValueError):
+        run_out_of_core_pipeline(record_path, _work_dir, _output_path, public_station_k_tree, public_station_df,
+                                 _shard_num=4, _params={'size_coefficient': 0.4})
+    _other_record_path = str(tmp_path / 'other_records.csv')
+    pd.read_csv(record_path).iloc[:100].to_csv(_other_record_path, index=False)
+    with pytest.raises(ValueError):
+        run_out_of_core_pipeline(_other_record_path, _work_dir, _output_path, public_station_k_tree, public_station_df,
+                                 _shard_num=4)
+    # A refreshed input file at the same path is not resumed either
+    _refreshed_record_path = str(tmp_path / 'refreshed_records.csv')
+    pd.read_csv(record_path).to_csv(_refreshed_record_path, index=False)
+    _refreshed_work_dir = str(tmp_path / 'refreshed_work')
+    run_out_of_core_pipeline(_refreshed_record_path, _refreshed_work_dir, _output_path, public_station_k_tree,
+                             public_station_df, _shard_num=4)
+    pd.read_csv(record_path).iloc[:100].to_csv(_refreshed_record_path, index=False)
+    with pytest.raises(ValueError):
+        run_out_of_core_pipeline(_refreshed_record_path, _refreshed_work_dir, _output_path, public_station_k_tree,
+                                 public_station_df, _shard_num=4)
+
+
+def _get_reachable_object_list(_root):
+    # Every object reachable from the root through references, without entering the module or class objects
+    import gc
+    import types
+    _seen_id_set = set()
+    _stack = [_root]
+    _object_list = []
+    while _stack:
+        _object = _stack.pop()
+        if id(_object) in _seen_id_set or isinstance(_object, (type, types.ModuleType, types.FunctionType)):
+            continue
+        _seen_id_set.add(id(_object))
+        _object_list.append(_object)
+        _stack.extend(gc.get_referents(_object))
+    return _object_list
+
+
+@pytest.fixture(scope='module')
+def user_result_pair(record_path, public_station_k_tree, public_station_df):
+    _record_df = pd.read_csv(record_path)
+    return (process_all_users(_record_df, public_station_k_tree, public_station_df),
+            process_all_users(_record_df, public_station_k_tree, public_station_df, _debug=True))
+
+
+def test_summary_mode_drops_cluster_objects(user_result_pair):
+    from spatial_flow_clustering_fuc import SpatialClusterFlow
+    from spatiotemporal_flow_clustering_fuc import SpatioTemporalFlowCluster
+    from ruled_base_decision_tress_fuc import SimplifiedCommutingFlow
+    _summary_result_dict, _ = user_result_pair
+    for _result in _summary_result_dict.values():
+        assert all(isinstance(_summary, dict) for _stage in ['sfc', 'stfc', 'cf'] for _summary in _result[_stage])
+        assert all('record_uuid_list' not in _summary for _stage in ['sfc', 'stfc'] for _summary in _result[_stage])
+    _cluster_object_list = [_o for _o in _get_reachable_object_list(_summary_result_dict)
+                            if isinstance(_o, (SpatialClusterFlow, SpatioTemporalFlowCluster, SimplifiedCommutingFlow))]
+    assert _cluster_object_list == []
+
+
+def test_debug_mode_keeps_what_the_plots_need(user_result_pair):
+    pytest.importorskip('folium')
+    from results_plot_fuc import plot_sfc_obj, plot_stfc_obj, plot_dcf_obj
+    _summary_result_dict, _debug_result_dict = user_result_pair
+    assert list(_debug_result_dict) == list(_summary_result_dict)
+    _dcf_num = 0
+    for _uid, _result in _debug_result_dict.items():
+        assert [_s['sfc_id'] for _s in _summary_result_dict[_uid]['sfc']] == list(_result['sfc'])
+        assert [_s['stfc_id'] for _s in _summary_result_dict[_uid]['stfc']] == list(_result['stfc'])
+        for _sfc_obj in _result['sfc'].values():
+            assert len(_sfc_obj.including_record_detail) == _sfc_obj.record_num
+            plot_sfc_obj(_sfc_obj, _uid)
+        for _stfc_obj in _result['stfc'].values():
+            assert all(isinstance(_detail, dict) for _detail in _stfc_obj.including_record_detail.values())
+            plot_stfc_obj(_stfc_obj, _uid)
+        if _result['dcf'] is not None:
+            assert _result['dcf'].to_record() == _summary_result_dict[_uid]['dcf'].to_record()
+            plot_dcf_obj(_result['dcf'], _uid)
+            _dcf_num += 1
+    assert _dcf_num > 0
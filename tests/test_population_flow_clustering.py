@@ -0,0 +1,47 @@
+# encoding: utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+from population_flow_clustering_fuc import load_population_flows, cluster_population_flows, \
+    cluster_population_flows_from_file, POPULATION_CLUSTER_COLUMNS
+from equivalence_harness_fuc import make_synthetic_records
+
+
+@pytest.fixture(scope='module')
+def record_path(tmp_path_factory, public_station_df):
+    _path = tmp_path_factory.mktemp('records') / 'records.csv'
+    make_synthetic_records(30, 200, _seed=11, _public_station_df=public_station_df).to_csv(_path, index=False)
+    return str(_path)
+
+
+def test_empty_flows():
+    _population_flow_cluster_df, _label_array = cluster_population_flows(np.empty((0, 2)), np.empty((0, 2)))
+    assert list(_population_flow_cluster_df.columns) == POPULATION_CLUSTER_COLUMNS
+    assert len(_population_flow_cluster_df) == 0
+    assert len(_label_array) == 0
+
+
+def test_filter_selecting_nothing(record_path):
+    _origin_array, _destination_array = load_population_flows(record_path)
+    _is_selected = _origin_array[:, 0] < 0
+    _population_flow_cluster_df, _label_array = cluster_population_flows(_origin_array[_is_selected],
+                                                                         _destination_array[_is_selected])
+    assert len(_population_flow_cluster_df) == 0 and len(_label_array) == 0
+
+
+def test_empty_file(tmp_path):
+    _path = tmp_path / 'records.csv'
+    pd.DataFrame(columns=['origin_x', 'origin_y', 'destination_x', 'destination_y']).to_csv(_path, index=False)
+    _origin_array, _destination_array = load_population_flows(str(_path))
+    assert _origin_array.shape == (0, 2)
+    assert len(cluster_population_flows_from_file(str(_path), str(tmp_path / 'bands'))) == 0
+
+
+@pytest.mark.parametrize('_band_tile_num', [1, 7, 50])
+def test_from_file_matches_in_memory(tmp_path, record_path, _band_tile_num):
+    _population_flow_cluster_df, _label_array = cluster_population_flows(*load_population_flows(record_path))
+    assert (_label_array >= 0).all()
+    _file_population_flow_cluster_df = cluster_population_flows_from_file(
+        record_path, str(tmp_path / 'bands'), _chunk_size=997, _band_tile_num=_band_tile_num)
+    pd.testing.assert_frame_equal(_file_population_flow_cluster_df, _population_flow_cluster_df)
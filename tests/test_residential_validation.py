@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+import json
+import pytest
+from residential_validation_fuc import load_land_use_polygons
+
+
+@pytest.fixture
+def land_use_path(tmp_path):
+    _feature_list = [{'type': 'Feature', 'properties': {'landuse': _landuse},
+                      'geometry': {'type': 'Polygon', 'coordinates': [[[114, 22.5], [114.01, 22.5], [114.01, 22.51], [114, 22.5]]]}}
+                     for _landuse in ['R', 'R', 'C']]
+    _path = tmp_path / 'land_use.geojson'
+    _path.write_text(json.dumps({'type': 'FeatureCollection', 'features': _feature_list}), encoding='utf-8')
+    return str(_path)
+
+
+def test_filter_by_land_use(land_use_path):
+    assert len(load_land_use_polygons(land_use_path)) == 3
+    assert len(load_land_use_polygons(land_use_path, 'landuse', ['R'])) == 2
+
+
+@pytest.mark.parametrize('_land_use_field, _residential_value_list', [('landuse', None), (None, ['R'])])
+def test_land_use_field_without_values(land_use_path, _land_use_field, _residential_value_list):
+    with pytest.raises(ValueError):
+        load_land_use_polygons(land_use_path, _land_use_field, _residential_value_list)
+
+
+def test_validate_commuting_locations_matches_brute_force():
+    import numpy as np
+    import pandas as pd
+    from shapely.geometry import Point, Polygon
+    from residential_validation_fuc import validate_commuting_locations, LOCATION_TYPE_LIST
+    _polygon_array = np.array([Polygon([(0, 0), (100, 0), (100, 100), (0, 100)]),
+                               Polygon([(300, 0), (500, 0), (500, 50), (350, 50), (350, 200), (300, 200)]),
+                               Polygon([(0, 400), (60, 400), (30, 460)])], dtype=object)
+    # Inside, within 50 m, within 100 m, within 200 m and beyond all thresholds of the polygons, and one user without a work location
+    _home_array = np.array([[50, 50], [130, 50], [420, 130], [30, 650], [1000, 1000], [320, 150], [-40, 430]], dtype=float)
+    _work_array = np.array([[310, 10], [200, 50], [30, 300], [30, 430], [np.nan, np.nan], [480, 120], [50, -49]])
+    _dcf_df = pd.DataFrame({'uid': [f'user{_i}' for _i in range(len(_home_array))],
+                            'commuting_category': ['biking', 'biking_transit', 'biking', 'transit_biking', 'biking',
+                                                   'biking_transit', 'biking'],
+                            'home_location_x': _home_array[:, 0], 'home_location_y': _home_array[:, 1],
+                            'work_location_x': _work_array[:, 0], 'work_location_y': _work_array[:, 1]})
+    _distance_threshold_list = (50, 100, 200)
+    _location_df, _hit_rate_df = validate_commuting_locations(_dcf_df, _polygon_array, _distance_threshold_list)
+
+    _expected_row_list = []
+    for _location_type, _location_array in zip(LOCATION_TYPE_LIST, [_home_array, _work_array]):
+        for _index, (_x, _y) in enumerate(_location_array):
+            if np.isnan(_x):
+                continue
+            _point = Point(_x, _y)
+            _expected_row_list.append({
+                'uid': f'user{_index}', 'location_type': _location_type,
+                'is_within_residential': any(_point.within(_polygon) for _polygon in _polygon_array),
+                'nearest_residential_distance': min(_polygon.distance(_point) for _polygon in _polygon_array)})
+    _expected_df = pd.DataFrame(_expected_row_list)
+    _actual_df = _location_df.set_index(['uid', 'location_type']).loc[
+        list(zip(_expected_df['uid'], _expected_df['location_type']))].reset_index()
+    assert len(_location_df) == len(_expected_df) == 13
+    assert _actual_df['is_within_residential'].tolist() == _expected_df['is_within_residential'].tolist()
+    np.testing.assert_allclose(_actual_df['nearest_residential_distance'], _expected_df['nearest_residential_distance'])
+    for _distance_threshold in _distance_threshold_list:
+        _expected_is_within = _expected_df['nearest_residential_distance'] <= _distance_threshold
+        assert _actual_df[f'is_within_{_distance_threshold}m'].tolist() == _expected_is_within.tolist()
+    # Every band of distances is exercised: inside, within each threshold and outside all of them
+    _distance_array = _expected_df['nearest_residential_distance'].to_numpy()
+    assert all(np.histogram(_distance_array, bins=[0, 1e-9, 50, 100, 200, np.inf])[0] > 0)
+
+    _expected_df['commuting_category'] = _expected_df['uid'].map(dict(zip(_dcf_df['uid'], _dcf_df['commuting_category'])))
+    for _, _row in _hit_rate_df.iterrows():
+        _group_df = _expected_df[(_expected_df['commuting_category'] == _row['commuting_category']) &
+                                 (_expected_df['location_type'] == _row['location_type'])]
+        assert _row['location_num'] == len(_group_df)
+        assert _row['within_rate'] == pytest.approx(_group_df['is_within_residential'].mean())
+        for _distance_threshold in _distance_threshold_list:
+            assert _row[f'within_{_distance_threshold}m_rate'] == pytest.approx(
+                (_group_df['nearest_residential_distance'] <= _distance_threshold).mean())
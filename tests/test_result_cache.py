@@ -0,0 +1,111 @@
+# encoding: utf-8
+
+import os
+import time
+import pytest
+from out_of_core_processing_fuc import select_weekday_records, process_user_records
+from result_cache_fuc import UserResultCache
+from equivalence_harness_fuc import make_synthetic_records
+
+
+@pytest.fixture(scope='module')
+def user_record(public_station_df):
+    # The DCF of synthetic_user5 with seed 1 depends on the order of its ride records
+    _weekday_record_df, _activity_weekdays_dict = select_weekday_records(
+        make_synthetic_records(6, 150, _seed=1, _public_station_df=public_station_df))
+    _uid = 'synthetic_user5'
+    return _weekday_record_df[_weekday_record_df['uid'] == _uid].to_dict(orient='records'), _activity_weekdays_dict[_uid]
+
+
+def _get_dcf_record(_dcf_obj):
+    return None if _dcf_obj is None else _dcf_obj.to_record()
+
+
+def test_reordered_records_are_not_served_from_cache(tmp_path, user_record, public_station_k_tree, public_station_df):
+    _record_list, _activity_weekdays = user_record
+    _reversed_record_list = _record_list[::-1]
+    _uncached_dcf_record = _get_dcf_record(process_user_records(
+        _reversed_record_list, _activity_weekdays, public_station_k_tree, public_station_df))
+    assert _uncached_dcf_record != _get_dcf_record(process_user_records(
+        _record_list, _activity_weekdays, public_station_k_tree, public_station_df))
+
+    _cache = UserResultCache(str(tmp_path / 'cache'), public_station_df)
+    process_user_records(_record_list, _activity_weekdays, public_station_k_tree, public_station_df, _cache=_cache)
+    assert _get_dcf_record(process_user_records(_reversed_record_list, _activity_weekdays, public_station_k_tree,
+                                                public_station_df, _cache=_cache)) == _uncached_dcf_record
+    assert _cache.stats['hit'] == 0
+    # Once cached, the same order is served
+    assert _get_dcf_record(process_user_records(_reversed_record_list, _activity_weekdays, public_station_k_tree,
+                                                public_station_df, _cache=_cache)) == _uncached_dcf_record
+    assert _cache.stats['hit'] == 1
+
+
+def _put_entry(_cache, _record_list, _params, _payload_size=0):
+    _key = _cache.make_key(_record_list, 10, _params)
+    _cache.put(_key, None, [{'padding': 'x' * _payload_size}], [])
+    return _key
+
+
+def test_hit_after_put_and_report(tmp_path, user_record):
+    _record_list, _ = user_record
+    _cache = UserResultCache(str(tmp_path / 'cache'))
+    _key = _cache.make_key(_record_list, 10, {'size_coefficient': 0.3})
+    assert _cache.get(_key) is None
+    _cache.put(_key, 'dcf', ['sfc'], ['stfc'])
+    assert _cache.get(_key) == {'dcf': 'dcf', 'sfc': ['sfc'], 'stfc': ['stfc']}
+    assert _cache.report() == {'hit': 1, 'miss': 1, 'write': 1, 'evict': 0, 'hit_rate': 0.5}
+    assert UserResultCache(str(tmp_path / 'empty_cache')).report()['hit_rate'] == 0.0
+
+
+def test_key_changes_with_params_and_stations(tmp_path, user_record, public_station_df):
+    _record_list, _ = user_record
+    _cache = UserResultCache(str(tmp_path / 'cache'))
+    _key = _put_entry(_cache, _record_list, {'size_coefficient': 0.3, 'expansion_coefficient': 0.5})
+    # The order of the parameters does not matter, their values do
+    assert _cache.make_key(_record_list, 10, {'expansion_coefficient': 0.5, 'size_coefficient': 0.3}) == _key
+    _changed_key = _cache.make_key(_record_list, 10, {'size_coefficient': 0.4, 'expansion_coefficient': 0.5})
+    assert _changed_key != _key
+    assert _cache.get(_changed_key) is None
+    assert _cache.make_key(_record_list, 11, {'size_coefficient': 0.3, 'expansion_coefficient': 0.5}) != _key
+    _station_cache = UserResultCache(str(tmp_path / 'cache'), public_station_df)
+    assert _station_cache.make_key(_record_list, 10, {'size_coefficient': 0.3, 'expansion_coefficient': 0.5}) != _key
+    _moved_record_list = [{**_record_list[0], 'origin_x': _record_list[0]['origin_x'] + 1}] + _record_list[1:]
+    assert _cache.make_key(_moved_record_list, 10, {'size_coefficient': 0.3, 'expansion_coefficient': 0.5}) != _key
+
+
+def test_evict_by_age(tmp_path, user_record):
+    _record_list, _ = user_record
+    _cache = UserResultCache(str(tmp_path / 'cache'), _max_age_days=1)
+    _old_key = _put_entry(_cache, _record_list, {'size_coefficient': 0.1})
+    _new_key = _put_entry(_cache, _record_list, {'size_coefficient': 0.2})
+    _two_days_ago = time.time() - 2 * 86400
+    os.utime(_cache._get_path(_old_key), (_two_days_ago, _two_days_ago))
+    assert _cache.evict() == 1
+    assert _cache.get(_old_key) is None
+    assert _cache.get(_new_key) is not None
+    assert _cache.report()['evict'] == 1
+
+
+def test_evict_least_recently_used_by_size(tmp_path, user_record):
+    _record_list, _ = user_record
+    _cache = UserResultCache(str(tmp_path / 'cache'), _max_size_mb=0.25)
+    _key_list = [_put_entry(_cache, _record_list, {'size_coefficient': _i}, 100000) for _i in range(4)]
+    # The entries were last used in the order 1, 0, 2, 3, and only the two most recently used fit within 0.25 MB
+    for _age, _key in zip([30, 40, 20, 10], _key_list):
+        os.utime(_cache._get_path(_key), (time.time() - _age, time.time() - _age))
+    assert _cache.evict() == 2
+    assert [_cache.get(_key) is not None for _key in _key_list] == [False, False, True, True]
+    assert _cache.evict() == 0
+
+
+@pytest.mark.parametrize('_content', [b'', b'not a pickle', b'\x80\x05\x95\x10'])
+def test_corrupt_entry_is_a_miss(tmp_path, user_record, _content):
+    _record_list, _ = user_record
+    _cache = UserResultCache(str(tmp_path / 'cache'))
+    _key = _put_entry(_cache, _record_list, {'size_coefficient': 0.3})
+    with open(_cache._get_path(_key), 'wb') as _f:
+        _f.write(_content)
+    assert _cache.get(_key) is None
+    assert _cache.stats['miss'] == 1
+    _cache.put(_key, 'dcf', [], [])
+    assert _cache.get(_key)['dcf'] == 'dcf'
@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+import json
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+import pytest
+from result_query_fuc import CommutingResultIndex, make_result_query_server, SPATIAL_INDEX_FIELD_LIST
+
+_STATION_ID_LIST = ['station_a', 'station_b', 'station_c']
+
+
+@pytest.fixture(scope='module')
+def dcf_df():
+    # A synthetic table of daily commuting flows, where every location, station and time is missing for some of the users
+    _rng = np.random.default_rng(11)
+    _user_num = 400
+    _dcf_df = pd.DataFrame({'uid': [f'user{_i}' for _i in range(_user_num)],
+                            'commuting_category': _rng.choice(['Only-biking', 'Biking-transit', 'Transit-biking'], _user_num)})
+    for _field in SPATIAL_INDEX_FIELD_LIST:
+        _point_array = _rng.uniform([12680000, 2570000], [12685000, 2575000], (_user_num, 2))
+        _point_array[_rng.random(_user_num) < 0.2] = np.nan
+        _dcf_df[f'{_field}_x'] = _point_array[:, 0]
+        _dcf_df[f'{_field}_y'] = _point_array[:, 1]
+    for _direction in ['to_transit', 'from_transit']:
+        _dcf_df[f'{_direction}_station_id'] = pd.Series(_rng.choice(_STATION_ID_LIST, _user_num)).where(
+            _rng.random(_user_num) < 0.6)
+    for _field in ['moment_leave_home', 'moment_leave_work']:
+        _second_array = _rng.integers(0, 86400, _user_num)
+        _dcf_df[_field] = pd.Series([f'{_s // 3600:02d}:{_s % 3600 // 60:02d}:{_s % 60:02d}' for _s in _second_array]).where(
+            _rng.random(_user_num) < 0.9)
+    return _dcf_df
+
+
+@pytest.fixture(scope='module')
+def result_index(dcf_df):
+    return CommutingResultIndex(dcf_df, {'user0': {'sfc': [{'sfc_id': 'sfc000'}], 'stfc': [], 'cf': []},
+                                         'user_without_dcf': {'sfc': [], 'stfc': [], 'cf': []}})
+
+
+def _get_hour_series(_time_series):
+    return _time_series.map(lambda _t: np.nan if pd.isna(_t) else
+                            int(_t[:2]) + int(_t[3:5]) / 60 + int(_t[6:]) / 3600)
+
+
+def _is_in_time_window(_hour_series, _start_hour, _end_hour):
+    if _start_hour <= _end_hour:
+        return (_hour_series >= _start_hour) & (_hour_series <= _end_hour)
+    return (_hour_series >= _start_hour) | (_hour_series <= _end_hour)
+
+
+def _assert_same_users(_result_df, _expected_mask):
+    assert _result_df['uid'].tolist() == _expected_mask[_expected_mask].index.map(lambda _i: f'user{_i}').tolist()
+
+
+def test_get_user(result_index, dcf_df):
+    _user_result = result_index.get_user('user3')
+    assert _user_result['dcf']['uid'] == 'user3'
+    assert _user_result['dcf']['commuting_category'] == dcf_df.loc[3, 'commuting_category']
+    assert _user_result['sfc'] is None
+    assert result_index.get_user('user0')['sfc'] == [{'sfc_id': 'sfc000'}]
+    assert result_index.get_user('user_without_dcf')['dcf'] is None
+    assert result_index.get_user('unknown_user') is None
+
+
+@pytest.mark.parametrize('_field', ['moment_leave_home', 'moment_leave_work'])
+@pytest.mark.parametrize('_start_hour, _end_hour', [(7, 9), (0, 24), (22.5, 6.25), (9, 9)])
+def test_query_by_time(result_index, dcf_df, _field, _start_hour, _end_hour):
+    _assert_same_users(result_index.query_by_time(_field, _start_hour, _end_hour),
+                       _is_in_time_window(_get_hour_series(dcf_df[_field]), _start_hour, _end_hour))
+
+
+@pytest.mark.parametrize('_station_id', _STATION_ID_LIST + ['unknown_station'])
+@pytest.mark.parametrize('_direction', [None, 'to_transit', 'from_transit'])
+@pytest.mark.parametrize('_time_window', [(None, None), (7, 9), (20, 2)])
+def test_query_station_transfers(result_index, dcf_df, _station_id, _direction, _time_window):
+    _expected_mask = pd.Series(False, index=dcf_df.index)
+    for _this_direction, _time_field in [('to_transit', 'moment_leave_home'), ('from_transit', 'moment_leave_work')]:
+        if _direction is not None and _direction != _this_direction:
+            continue
+        _direction_mask = dcf_df[f'{_this_direction}_station_id'] == _station_id
+        if _time_window[0] is not None:
+            _direction_mask &= _is_in_time_window(_get_hour_series(dcf_df[_time_field]), *_time_window)
+        _expected_mask |= _direction_mask
+    _assert_same_users(result_index.query_station_transfers(_station_id, *_time_window, _direction=_direction),
+                       _expected_mask)
+
+
+@pytest.mark.parametrize('_field', SPATIAL_INDEX_FIELD_LIST)
+@pytest.mark.parametrize('_radius', [0, 300, 1500])
+def test_query_near_point(result_index, dcf_df, _field, _radius):
+    _x, _y = 12682000, 2572500
+    _distance = np.hypot(dcf_df[f'{_field}_x'] - _x, dcf_df[f'{_field}_y'] - _y)
+    _assert_same_users(result_index.query_near_point(_field, _x, _y, _radius), _distance <= _radius)
+
+
+@pytest.mark.parametrize('_field', SPATIAL_INDEX_FIELD_LIST)
+@pytest.mark.parametrize('_distance', [0, 200])
+def test_query_near_polygon(result_index, dcf_df, _field, _distance):
+    from shapely.geometry import Point, Polygon
+    _polygon = Polygon([(12681000, 2571000), (12683500, 2571500), (12682000, 2574000), (12681500, 2572000)])
+    _expected_mask = pd.Series([not np.isnan(_x) and _polygon.distance(Point(_x, _y)) <= _distance
+                                for _x, _y in zip(dcf_df[f'{_field}_x'], dcf_df[f'{_field}_y'])], index=dcf_df.index)
+    assert _expected_mask.any()
+    _assert_same_users(result_index.query_near_polygon(_field, _polygon, _distance), _expected_mask)
+
+
+def test_empty_index():
+    _dcf_df = pd.DataFrame({_column: pd.Series(dtype=float) for _column in
+                            [f'{_field}_{_axis}' for _field in SPATIAL_INDEX_FIELD_LIST for _axis in 'xy']})
+    for _column in ['uid', 'to_transit_station_id', 'from_transit_station_id', 'moment_leave_home', 'moment_leave_work']:
+        _dcf_df[_column] = pd.Series(dtype=object)
+    _result_index = CommutingResultIndex(_dcf_df)
+    assert _result_index.query_by_time('moment_leave_home', 7, 9).empty
+    assert _result_index.query_station_transfers('station_a', 7, 9).empty
+    assert _result_index.query_near_point('home_location', 0, 0, 100).empty
+    assert _result_index.get_user('user0') is None
+
+
+@pytest.fixture
+def server_url(result_index):
+    _server = make_result_query_server(result_index, _port=0)
+    _thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    _thread.start()
+    yield f'http://127.0.0.1:{_server.server_address[1]}'
+    _server.shutdown()
+    _server.server_close()
+    _thread.join()
+
+
+def test_http_routes(server_url, result_index):
+    with urllib.request.urlopen(f'{server_url}/time?field=moment_leave_home&start=7&end=9') as _response:
+        assert _response.status == 200
+        _record_list = json.loads(_response.read())
+    assert [_r['uid'] for _r in _record_list] == result_index.query_by_time('moment_leave_home', 7, 9)['uid'].tolist()
+    with urllib.request.urlopen(f'{server_url}/user?uid=user3') as _response:
+        assert json.loads(_response.read())['dcf']['uid'] == 'user3'
+    for _path, _status in [('/time?field=unknown_field&start=7&end=9', 400), ('/time?field=moment_leave_home&start=seven&end=9', 400),
+                           ('/near?field=home_location&x=1', 400), ('/unknown', 404)]:
+        with pytest.raises(urllib.error.HTTPError) as _error_info:
+            urllib.request.urlopen(server_url + _path)
+        assert _error_info.value.code == _status
@@ -0,0 +1,28 @@
+# encoding: utf-8
+
+import pytest
+from startup_profile_fuc import measure_startup, HEADLESS_MODULE_LIST
+
+# The modules of the headless pipeline, which may load pandas but never the plotting and geometry dependencies
+_PIPELINE_MODULE_LIST = ['out_of_core_processing_fuc', 'columnar_decision_tree_fuc', 'compact_storage_fuc', 'result_cache_fuc',
+                         'streaming_window_fuc', 'station_rollup_fuc', 'result_query_fuc', 'equivalence_harness_fuc']
+
+
+def test_headless_core_loads_no_lazy_dependency():
+    _profile = measure_startup()
+    assert _profile['loaded_lazy_dependency_list'] == []
+    assert _profile['import_seconds'] > 0
+
+
+@pytest.mark.parametrize('_module_name_list', [HEADLESS_MODULE_LIST + _PIPELINE_MODULE_LIST] +
+                         [[_module_name] for _module_name in _PIPELINE_MODULE_LIST])
+def test_headless_pipeline_loads_no_shapely_or_folium(_module_name_list):
+    _loaded_list = measure_startup(_module_name_list)['loaded_lazy_dependency_list']
+    assert 'shapely' not in _loaded_list
+    assert 'folium' not in _loaded_list
+
+
+def test_lazy_dependency_is_seen_when_loaded():
+    # The plots load folium when a map is first drawn, while the residential validation needs shapely at import
+    assert 'folium' not in measure_startup(['results_plot_fuc'])['loaded_lazy_dependency_list']
+    assert 'shapely' in measure_startup(['residential_validation_fuc'])['loaded_lazy_dependency_list']
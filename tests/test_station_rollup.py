@@ -0,0 +1,96 @@
+# encoding: utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+from station_rollup_fuc import build_station_rollup, merge_station_rollups, summarize_station_rollup, TRANSFER_DIRECTION_DICT
+
+_UNMATCHED_STATION_ID = 'bus_station_001'
+
+
+@pytest.fixture(scope='module')
+def dcf_df(public_station_df):
+    # A synthetic table of daily commuting flows transferring at 6 entrances of 3 metro stations and at a bus station
+    # missing from the metro entrances, where some of the stations, times and locations are missing
+    _rng = np.random.default_rng(7)
+    _user_num = 300
+    _metro_list = public_station_df['metro'].drop_duplicates().iloc[:3].tolist()
+    _station_df = public_station_df[public_station_df['metro'].isin(_metro_list)].groupby('metro').head(2)
+    _station_df = pd.concat([_station_df[['pid', 'x_coord', 'y_coord']], pd.DataFrame(
+        {'pid': [_UNMATCHED_STATION_ID], 'x_coord': [12690000.0], 'y_coord': [2580000.0]})], ignore_index=True)
+    _dcf_df = pd.DataFrame({'uid': [f'user{_i}' for _i in range(_user_num)]})
+    for _field in ['moment_leave_home', 'moment_leave_work']:
+        _second_array = _rng.integers(0, 86400, _user_num)
+        _dcf_df[_field] = pd.Series([f'{_s // 3600:02d}:{_s % 3600 // 60:02d}:{_s % 60:02d}' for _s in _second_array]).where(
+            _rng.random(_user_num) < 0.9)
+    for _direction, _anchor in TRANSFER_DIRECTION_DICT.items():
+        _station_index = _rng.integers(0, len(_station_df), _user_num)
+        _has_station = _rng.random(_user_num) < 0.7
+        _dcf_df[f'{_direction}_station_id'] = _station_df['pid'].to_numpy()[_station_index]
+        _dcf_df[f'{_direction}_station_location_x'] = _station_df['x_coord'].to_numpy()[_station_index]
+        _dcf_df[f'{_direction}_station_location_y'] = _station_df['y_coord'].to_numpy()[_station_index]
+        # The catchment distance spreads over 0 to 12 km, beyond the last bin of 10 km
+        _distance_array = _rng.uniform(0, 12000, _user_num)
+        _angle_array = _rng.uniform(0, 2 * np.pi, _user_num)
+        _dcf_df[f'{_anchor}_x'] = _dcf_df[f'{_direction}_station_location_x'] + _distance_array * np.cos(_angle_array)
+        _dcf_df[f'{_anchor}_y'] = _dcf_df[f'{_direction}_station_location_y'] + _distance_array * np.sin(_angle_array)
+        _dcf_df.loc[~_has_station, [f'{_direction}_station_id', f'{_direction}_station_location_x',
+                                    f'{_direction}_station_location_y']] = np.nan
+    return _dcf_df
+
+
+def test_merge_of_shards_equals_whole(dcf_df):
+    _whole_rollup_df = build_station_rollup(dcf_df).sort_index()
+    for _shard_num in [1, 3, 7]:
+        _shard_rollup_df_list = [build_station_rollup(dcf_df.iloc[_index_array]) for _index_array in
+                                 np.array_split(np.arange(len(dcf_df)), _shard_num)]
+        pd.testing.assert_frame_equal(merge_station_rollups(_shard_rollup_df_list).sort_index(), _whole_rollup_df,
+                                      check_dtype=False)
+    # An empty shard does not change the merge
+    pd.testing.assert_frame_equal(merge_station_rollups([build_station_rollup(dcf_df.iloc[:0]), _whole_rollup_df]).sort_index(),
+                                  _whole_rollup_df, check_dtype=False)
+
+
+def _get_hour_series(_time_series):
+    return _time_series.map(lambda _t: np.nan if pd.isna(_t) else int(_t[:2]))
+
+
+@pytest.mark.parametrize('_level, _group_field', [('entrance', 'pid'), ('station', 'metro')])
+def test_summary_at_both_levels(dcf_df, public_station_df, _level, _group_field):
+    _summary_df = summarize_station_rollup(build_station_rollup(dcf_df), public_station_df, _level).set_index(_group_field)
+    _pid_to_metro = dict(zip(public_station_df['pid'], public_station_df['metro']))
+    _expected_key_set = set()
+    for _direction, _anchor in TRANSFER_DIRECTION_DICT.items():
+        _transfer_df = dcf_df[dcf_df[f'{_direction}_station_id'].notna()]
+        _station_id_series = _transfer_df[f'{_direction}_station_id']
+        # The stations missing from the metro entrances are kept under their station_id
+        _key_series = _station_id_series if _level == 'entrance' else _station_id_series.map(
+            lambda _pid: _pid_to_metro.get(_pid, _pid))
+        _expected_key_set |= set(_key_series)
+        _catchment_distance = np.hypot(_transfer_df[f'{_anchor}_x'] - _transfer_df[f'{_direction}_station_location_x'],
+                                       _transfer_df[f'{_anchor}_y'] - _transfer_df[f'{_direction}_station_location_y'])
+        for _key, _key_df in _transfer_df.groupby(_key_series):
+            _row = _summary_df.loc[_key]
+            assert _row[f'{_direction}_user_num'] == len(_key_df)
+            assert _row[f'{_direction}_catchment_mean'] == pytest.approx(_catchment_distance[_key_df.index].mean())
+            # A catchment percentile falls in the 25 m bin of its order statistic, where the last bin holds the longer distances
+            _sorted_distance = np.sort(np.minimum(_catchment_distance[_key_df.index], 9999.0))
+            for _percentile in [50, 75, 90]:
+                assert abs(_row[f'{_direction}_catchment_p{_percentile}'] -
+                           _sorted_distance[int(np.ceil(len(_key_df) * _percentile / 100)) - 1]) <= 25
+            for _field, _column in [('moment_leave_home', 'leave_home'), ('moment_leave_work', 'leave_work')]:
+                _expected_count = _get_hour_series(_key_df[_field]).value_counts().reindex(range(24), fill_value=0)
+                assert _row[[f'{_direction}_{_column}_h{_h:02d}' for _h in range(24)]].tolist() == _expected_count.tolist()
+        _absent_key_list = list(set(_summary_df.index) - set(_key_series))
+        assert (_summary_df.loc[_absent_key_list, f'{_direction}_user_num'] == 0).all()
+    assert set(_summary_df.index) == _expected_key_set
+    assert (_summary_df['transfer_user_num'] == _summary_df['to_transit_user_num'] + _summary_df['from_transit_user_num']).all()
+    assert not _summary_df.loc[_UNMATCHED_STATION_ID, 'is_matched']
+    assert _summary_df['is_matched'].sum() == len(_summary_df) - 1
+    assert pd.isna(_summary_df.loc[_UNMATCHED_STATION_ID, 'metro_en'])
+    assert _summary_df['to_transit_user_num'].sum() == dcf_df['to_transit_station_id'].notna().sum()
+
+
+def test_summary_rejects_unknown_level(dcf_df, public_station_df):
+    with pytest.raises(ValueError):
+        summarize_station_rollup(build_station_rollup(dcf_df), public_station_df, 'district')
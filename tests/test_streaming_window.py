@@ -0,0 +1,131 @@
+# encoding: utf-8
+
+import datetime
+import pytest
+from out_of_core_processing_fuc import process_all_users
+from ruled_base_decision_tress_fuc import build_daily_commuting_flow_df
+from spatial_flow_clustering_fuc import extract_spatial_flow_clusters
+from streaming_window_fuc import StreamingCommutingMonitor, UserWindowState, DEFAULT_MAX_INCREMENTAL_RATE
+from equivalence_harness_fuc import make_synthetic_records, diff_daily_commuting_flows
+
+
+@pytest.fixture(scope='module')
+def stream_record_df(public_station_df):
+    return make_synthetic_records(8, 150, _seed=5, _public_station_df=public_station_df).sort_values(
+        'date', kind='stable')
+
+
+def _get_batch_dcf_df(_record_df, _end_date, _window_days, _public_station_k_tree, _public_station_df):
+    _start_date = (datetime.date.fromisoformat(_end_date) - datetime.timedelta(days=_window_days - 1)).isoformat()
+    _window_record_df = _record_df[(_record_df['date'] >= _start_date) & (_record_df['date'] <= _end_date)]
+    _result_dict = process_all_users(_window_record_df, _public_station_k_tree, _public_station_df)
+    return build_daily_commuting_flow_df({_uid: _r['dcf'] for _uid, _r in _result_dict.items() if _r['dcf'] is not None})
+
+
+def _run_stream(_monitor, _record_df, _checked_date_set):
+    _date_record_dict = {_date: _df.to_dict(orient='records') for _date, _df in _record_df.groupby('date')}
+    _date = datetime.date.fromisoformat(_record_df['date'].min())
+    _dcf_df_dict = {}
+    while _date.isoformat() <= _record_df['date'].max():
+        _monitor.step(_date.isoformat(), _date_record_dict.get(_date.isoformat(), []))
+        if _date.isoformat() in _checked_date_set:
+            _dcf_df_dict[_date.isoformat()] = build_daily_commuting_flow_df(_monitor.dcf_dict)
+        _date += datetime.timedelta(days=1)
+    return _dcf_df_dict
+
+
+@pytest.mark.parametrize('_max_incremental_rate', [0, DEFAULT_MAX_INCREMENTAL_RATE, 1])
+@pytest.mark.parametrize('_window_days', [28, 10])
+def test_stream_matches_batch_windows(stream_record_df, public_station_k_tree, public_station_df, _window_days,
+                                      _max_incremental_rate):
+    # 0 re-clusters every changed user from scratch, while the incremental updates are not exact in general but give no
+    # difference on these ride records
+    _checked_date_set = {'2021-04-29', '2021-05-20', '2021-06-10', '2021-06-30'}
+    _dcf_df_dict = _run_stream(StreamingCommutingMonitor(public_station_k_tree, public_station_df, _window_days,
+                                                         _max_incremental_rate=_max_incremental_rate),
+                               stream_record_df, _checked_date_set)
+    for _date in sorted(_checked_date_set):
+        _batch_dcf_df = _get_batch_dcf_df(stream_record_df, _date, _window_days, public_station_k_tree, public_station_df)
+        assert len(_batch_dcf_df) > 0
+        assert diff_daily_commuting_flows(_batch_dcf_df, _dcf_df_dict[_date]) == []
+
+
+def test_stream_orders_late_records_by_date(stream_record_df, public_station_k_tree, public_station_df):
+    # The days of a week arrive at its end in reverse order, and their ride records are still clustered in the order of their dates
+    _end_date = '2021-05-21'
+    _record_df = stream_record_df[stream_record_df['date'] <= _end_date]
+    _monitor = StreamingCommutingMonitor(public_station_k_tree, public_station_df)
+    _monitor.step('2021-05-14', _record_df[_record_df['date'] <= '2021-05-14'].to_dict(orient='records'))
+    _late_record_list = []
+    for _date, _date_record_df in reversed(list(_record_df[_record_df['date'] > '2021-05-14'].groupby('date'))):
+        _late_record_list += _date_record_df.to_dict(orient='records')
+    _monitor.step(_end_date, _late_record_list)
+    assert diff_daily_commuting_flows(
+        _get_batch_dcf_df(_record_df, _end_date, 28, public_station_k_tree, public_station_df),
+        build_daily_commuting_flow_df(_monitor.dcf_dict)) == []
+
+
+def _get_partition(_uuid_set_list):
+    return sorted(sorted(_uuid_set) for _uuid_set in _uuid_set_list)
+
+
+@pytest.mark.parametrize('_max_incremental_rate', [0.1, DEFAULT_MAX_INCREMENTAL_RATE])
+def test_full_reclustering_bounds_incremental_changes(stream_record_df, public_station_k_tree, public_station_df,
+                                                      _max_incremental_rate):
+    _monitor = StreamingCommutingMonitor(public_station_k_tree, public_station_df, _max_incremental_rate=_max_incremental_rate)
+    _date_record_dict = {_date: _df.to_dict(orient='records') for _date, _df in stream_record_df.groupby('date')}
+    _full_reclustering_num = 0
+    for _date in sorted(_date_record_dict.keys()):
+        _monitor.step(_date, _date_record_dict[_date])
+        for _user_state in _monitor.user_state_dict.values():
+            # No user drifts further from its last full re-clustering than the given rate of its ride records
+            assert _user_state.incremental_record_num <= _max_incremental_rate * len(_user_state.record_dict)
+            if _user_state.incremental_record_num == 0:
+                # Right after a full re-clustering, the spatial flow clusters are the ones of the batch mode
+                _full_reclustering_num += 1
+                _batch_sfc_dict = extract_spatial_flow_clusters(_user_state.get_record_list(), 0)
+                assert _get_partition([_c.uuid_set for _c in _user_state.cluster_dict.values()]) == _get_partition(
+                    [_sfc_obj.including_record_detail.keys() for _sfc_obj in _batch_sfc_dict.values()])
+    assert _full_reclustering_num > 0
+
+
+def test_unchanged_clusters_are_reused(stream_record_df):
+    _uid = stream_record_df['uid'].iloc[0]
+    _record_list = stream_record_df[(stream_record_df['uid'] == _uid) & (stream_record_df['date'] <= '2021-04-28')].to_dict(
+        orient='records')
+    _user_state = UserWindowState()
+    for _record in _record_list:
+        _user_state.add_record(_record)
+    _user_state.get_spatiotemporal_flow_clusters(_max_incremental_rate=1)
+    _cluster_dict = dict(_user_state.cluster_dict)
+    _stfc_obj_list_dict = {_key: _cluster.stfc_obj_list for _key, _cluster in _cluster_dict.items()}
+    assert len(_cluster_dict) > 1
+
+    # A ride record far from all the others starts a spatial flow cluster of its own and leaves the others untouched
+    _far_record = {**_record_list[-1], 'uuid': 'far_record', 'origin_x': _record_list[-1]['origin_x'] + 50000,
+                   'destination_x': _record_list[-1]['destination_x'] + 50000}
+    assert _user_state.add_record(_far_record)
+    assert not _user_state.add_record(_far_record)
+    _user_state.get_spatiotemporal_flow_clusters(_max_incremental_rate=1)
+    assert _user_state.incremental_record_num == 1
+    assert set(_cluster_dict.keys()) < set(_user_state.cluster_dict.keys())
+    for _key, _cluster in _cluster_dict.items():
+        assert _user_state.cluster_dict[_key] is _cluster
+        assert _cluster.stfc_obj_list is _stfc_obj_list_dict[_key]
+    assert _user_state.cluster_dict[_user_state.record_cluster_dict['far_record']].uuid_set == {'far_record'}
+
+    # Expiring a ride record changes its spatial flow cluster, which is re-clustered
+    _expired_uuid = _record_list[0]['uuid']
+    _expired_key = _user_state.record_cluster_dict[_expired_uuid]
+    assert _user_state.expire_record(_expired_uuid)
+    assert not _user_state.expire_record(_expired_uuid)
+    _user_state.get_spatiotemporal_flow_clusters(_max_incremental_rate=1)
+    assert _expired_key not in _user_state.cluster_dict
+    assert _expired_uuid not in _user_state.record_cluster_dict
+    assert sum(_cluster.record_num for _cluster in _user_state.cluster_dict.values()) == len(_record_list)
+
+
+def test_stream_empty(public_station_k_tree, public_station_df):
+    _monitor = StreamingCommutingMonitor(public_station_k_tree, public_station_df)
+    assert _monitor.step('2021-04-01', []) == {}
+    assert _monitor.dcf_dict == {}
@@ -87,3 +87,21 @@ def hour_to_time(_hour:float):
     _mm = int((_hour - _hh) * 3600 / 60)
     _ss = int((_hour - _hh) * 3600 - (60 * _mm))
     return f'{str(_hh).zfill(2)}:{str(_mm).zfill(2)}:{str(_ss).zfill(2)}'
+
+
+class FlowLine:
+    """
+    A straight flow between an origin and a destination, which provides the coords and length used by the clustering and decision-tree code without loading shapely.
+    """
+    __slots__ = ('coords',)
+
+    def __init__(self, _coord_list):
+        _origin, _destination = _coord_list
+        self.coords = ((float(_origin[0]), float(_origin[1])), (float(_destination[0]), float(_destination[1])))
+
+    @property
+    def length(self):
+        return get_distance(*self.coords)
+
+    def __repr__(self):
+        return f'FlowLine({self.coords})'